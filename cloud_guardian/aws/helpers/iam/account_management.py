@@ -0,0 +1,16 @@
+from typing import Iterator
+
+from botocore.exceptions import ClientError
+from cloud_guardian import logger
+
+
+def get_account_authorization_details(iam) -> Iterator[dict]:
+    """Yields the pages of the account's users, groups, roles and policies."""
+    try:
+        paginator = iam.get_paginator("get_account_authorization_details")
+        for page in paginator.paginate():
+            yield page
+        logger.info("Retrieved account authorization details.")
+    except ClientError as e:
+        logger.error(f"Error retrieving account authorization details: {e}")
+        raise e
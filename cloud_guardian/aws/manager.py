@@ -16,10 +16,7 @@ from cloud_guardian.aws.helpers.iam.user_management import (
 )
 from cloud_guardian.aws.helpers.s3.bucket_operations import create_bucket
 from cloud_guardian.aws.helpers.s3.bucket_policy import set_bucket_policy
-from cloud_guardian.utils.loaders import (
-    extract_bucket_names,
-    load_iam_data_into_dictionaries,
-)
+from cloud_guardian.utils.loaders import extract_bucket_names, stream_json_array
 from cloud_guardian.utils.maps import BiMap
 from cloud_guardian.utils.strings import get_name_from_arn
 
@@ -85,20 +82,22 @@ class AWSManager:
 
     def import_from_json(self, folder_path: Path):
         """Import IAM and S3 configurations from JSON files and create AWS resources"""
-        groups_dict, policies_dict, roles_dict, users_dict = (
-            load_iam_data_into_dictionaries(folder_path)
-        )
+        folder_path = Path(folder_path)
+        policies_file = folder_path / "policies.json"
+        groups_file = folder_path / "groups.json"
 
         bi_map = BiMap()
 
+        # Records are streamed one at a time so that large exports are never
+        # fully loaded in memory
         # Create identity-based policies and attach them to the identities
-        for policy in policies_dict["IdentityBasedPolicies"]:
+        for policy in stream_json_array(policies_file, "IdentityBasedPolicies"):
             policy_name = get_name_from_arn(policy["ID"])
             policy_arn = create_policy(self.iam, policy_name, policy["PolicyDocument"])
             bi_map.add(policy_arn, policy["ID"])
 
         # Create groups and attach policies
-        for group in groups_dict["Groups"]:
+        for group in stream_json_array(groups_file, "Groups"):
             group_name = get_name_from_arn(group["ID"])
             group_arn = create_group(self.iam, group_name)
             bi_map.add(group_arn, group["ID"])
@@ -107,7 +106,7 @@ class AWSManager:
                 attach_policy_to_group(self.iam, policy_arn, group_name)
 
         # Create users, attach policies
-        for user in users_dict["Users"]:
+        for user in stream_json_array(folder_path / "users.json", "Users"):
             user_name = get_name_from_arn(user["ID"])
             user_info = create_user_and_access_keys(self.iam, user_name)
             user_arn = user_info["Arn"]
@@ -121,14 +120,14 @@ class AWSManager:
                 attach_policy_to_user(self.iam, policy_arn, user_name)
 
         # Add users to groups
-        for group in groups_dict["Groups"]:
+        for group in stream_json_array(groups_file, "Groups"):
             group_name = get_name_from_arn(group["ID"])
             for user in group["Users"]:
                 user_name = get_name_from_arn(bi_map.get(user["ID"]))
                 add_user_to_group(self.iam, user_name, group_name)
 
         # Create roles and attach policies
-        for role in roles_dict["Roles"]:
+        for role in stream_json_array(folder_path / "roles.json", "Roles"):
             role_name = get_name_from_arn(role["ID"])
             role_arn = create_role(
                 self.iam, role_name, role["AssumeRolePolicyDocument"]
@@ -136,7 +135,7 @@ class AWSManager:
             bi_map.add(role_arn, role["ID"])
 
         # # Process resource-based policies
-        for policy in policies_dict["ResourceBasedPolicies"]:
+        for policy in stream_json_array(policies_file, "ResourceBasedPolicies"):
             for resource_name in extract_bucket_names(policy):
                 create_bucket(self.s3, resource_name)
                 set_bucket_policy(self.s3, resource_name, policy["PolicyDocument"])
@@ -0,0 +1,582 @@
+"""
+End-to-end benchmark suite.
+
+Times every stage of the pipeline (JSON ingestion, processing, import into
+moto, graph construction, multi-account ingestion, action matching, graph
+queries, the permission matrix, permission checks and MDP steps) on datasets
+of several scales, writes the results as JSON and compares them against a
+stored baseline.
+
+    python -m cloud_guardian.benchmarks.run --scales small medium
+    python -m cloud_guardian.benchmarks.run --save-baseline
+    python -m cloud_guardian.benchmarks.run --baseline output/benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cloud_guardian import logger
+from cloud_guardian.aws.manager import AWSManager
+from cloud_guardian.iam_dynamic.model import IAMGraphMDP
+from cloud_guardian.iam_static.graph.delta import compute_delta
+from cloud_guardian.iam_static.graph.evaluation import (
+    Decision,
+    EffectivePermissionEvaluator,
+)
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.identities.group import GroupFactory
+from cloud_guardian.iam_static.graph.identities.resources import ResourceFactory
+from cloud_guardian.iam_static.graph.identities.role import RoleFactory
+from cloud_guardian.iam_static.graph.identities.services import ServiceFactory
+from cloud_guardian.iam_static.graph.identities.user import UserFactory
+from cloud_guardian.iam_static.graph.initializers import (
+    GraphBuilder,
+    create_graph,
+    create_multi_account_graph,
+)
+from cloud_guardian.iam_static.graph.matrix import PermissionMatrix
+from cloud_guardian.iam_static.graph.permission.actions import ActionsFactory
+from cloud_guardian.iam_static.graph.permission.normalization import collapse_patterns
+from cloud_guardian.iam_static.graph.permission.permission import PermissionFactory
+from cloud_guardian.iam_static.graph.relationships.relationships import CanAssumeRole
+from cloud_guardian.iam_static.model import IAMManager
+from cloud_guardian.utils.generator import _ACTIONS, GeneratorConfig, generate_dataset
+from cloud_guardian.utils.loaders import (
+    iter_authorization_details_page,
+    stream_iam_records,
+)
+from cloud_guardian.utils.processing import process_files
+from cloud_guardian.utils.shared import data_path, output_path
+from moto import mock_aws
+
+results_path = output_path / "benchmarks"
+
+DEFAULT_BASELINE = results_path / "baseline.json"
+
+# Relative slowdown of the median above which a benchmark counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+@dataclass
+class Scale:
+    # None stands for data/toy_example
+    config: Optional[GeneratorConfig]
+    repeat: int
+    # importing into moto and replaying traces goes through the AWS API one
+    # call at a time, which is too slow to measure on the largest datasets
+    with_aws: bool = True
+
+
+SCALES = {
+    "small": Scale(config=None, repeat=5),
+    "medium": Scale(
+        config=GeneratorConfig(users=1000, groups=50, roles=100, policies=200),
+        repeat=3,
+    ),
+    "large": Scale(
+        config=GeneratorConfig(
+            users=20000, groups=200, roles=1000, policies=1000, buckets=200
+        ),
+        repeat=1,
+        with_aws=False,
+    ),
+}
+
+
+def _time(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "repeat": repeat,
+    }
+
+
+def _catalogue() -> List[str]:
+    return [
+        f"{service}:{action}"
+        for service, actions in _ACTIONS.items()
+        for action in actions
+    ]
+
+
+def _dataset(name: str, scale: Scale, workdir: Path) -> Path:
+    """Return the folder of the `original` JSON files of a scale."""
+    if scale.config is None:
+        return data_path / "toy_example" / "original"
+    folder = workdir / name / "original"
+    generate_dataset(scale.config, folder)
+    return folder
+
+
+def check_same_decisions(
+    graph: IAMGraph, other: IAMGraph, requests: int = 20000, seed: int = 0
+) -> int:
+    """Evaluate random requests against two graphs of the same accounts and
+    raise if any decision differs; returns the number of requests checked."""
+    principals = [node_id for node_id, _ in graph.get_nodes(["user", "role"])]
+    resources = [node_id for node_id, _ in graph.get_nodes(["resource"])] + [None]
+    catalogue = _catalogue()
+    rng = random.Random(seed)
+    evaluators = [
+        EffectivePermissionEvaluator(graph),
+        EffectivePermissionEvaluator(other),
+    ]
+    mismatches = []
+    for _ in range(requests):
+        request = (rng.choice(principals), rng.choice(catalogue), rng.choice(resources))
+        decisions = [evaluator.evaluate(*request) for evaluator in evaluators]
+        if decisions[0] != decisions[1]:
+            mismatches.append((request, decisions))
+    if mismatches:
+        raise RuntimeError(
+            f"{len(mismatches)} of {requests} decisions differ, e.g. {mismatches[0]}"
+        )
+    return requests
+
+
+def check_delta_duplicate_grants():
+    """Detach through a delta two policies granting the same statement, and
+    raise if the user keeps an edge or access from either."""
+    user_arn = "arn:aws:iam::123456789012:user/BenchmarkDeltaUser"
+    document = {
+        "Version": "2012-10-17",
+        "Statement": [{"Effect": "Allow", "Action": "s3:GetObject", "Resource": "*"}],
+    }
+    policy_arns = [f"arn:aws:iam::123456789012:policy/{name}" for name in "AB"]
+
+    def export(attached: List[str]) -> IAMGraph:
+        page = {
+            "UserDetailList": [
+                {
+                    "UserName": "BenchmarkDeltaUser",
+                    "Arn": user_arn,
+                    "AttachedManagedPolicies": [
+                        {"PolicyName": arn.rsplit("/", 1)[1], "PolicyArn": arn}
+                        for arn in attached
+                    ],
+                }
+            ],
+            "Policies": [
+                {
+                    "PolicyName": arn.rsplit("/", 1)[1],
+                    "Arn": arn,
+                    "DefaultVersionId": "v1",
+                    "PolicyVersionList": [
+                        {
+                            "VersionId": "v1",
+                            "IsDefaultVersion": True,
+                            "Document": document,
+                        }
+                    ],
+                }
+                for arn in policy_arns
+            ],
+        }
+        builder = GraphBuilder()
+        builder.add_records(iter_authorization_details_page(page))
+        return builder.finish()
+
+    with mock_aws():
+        iam_manager = IAMManager(AWSManager())
+    iam_manager.graph.merge(export(policy_arns))
+    iam_manager.apply_delta(compute_delta(iam_manager.graph, export([])))
+    edges = iam_manager.graph.graph.number_of_edges()
+    decision = iam_manager.evaluator.evaluate(
+        user_arn, "s3:GetObject", "arn:aws:s3:::bucket"
+    )
+    if edges or decision != Decision.IMPLICIT_DENY:
+        raise RuntimeError(
+            f"Detaching duplicate grants left {edges} edges, decision {decision}"
+        )
+
+
+def check_action_case():
+    """Grant and deny actions spelled in other cases than the catalogue's, and
+    raise if they are not matched as IAM matches them, regardless of case."""
+    user_arn = "arn:aws:iam::123456789012:user/BenchmarkCaseUser"
+    statements = [
+        {
+            "Effect": "Allow",
+            "Action": ["S3:getobject", "s3:GetObject"],
+            "Resource": "*",
+        },
+        {"Effect": "Deny", "Action": "IAM:createuser", "Resource": "*"},
+        {"Effect": "Allow", "Action": "iam:Create*", "Resource": "*"},
+    ]
+    page = {
+        "UserDetailList": [
+            {
+                "UserName": "BenchmarkCaseUser",
+                "Arn": user_arn,
+                "UserPolicyList": [
+                    {
+                        "PolicyName": "case",
+                        "PolicyDocument": {
+                            "Version": "2012-10-17",
+                            "Statement": statements,
+                        },
+                    }
+                ],
+            }
+        ]
+    }
+    builder = GraphBuilder()
+    builder.add_records(iter_authorization_details_page(page))
+    graph = builder.finish()
+    evaluator = EffectivePermissionEvaluator(graph)
+    decisions = [
+        evaluator.evaluate(user_arn, action, "arn:aws:s3:::bucket")
+        for action in ["s3:GetObject", "iam:CreateUser", "iam:CreateRole"]
+    ]
+    expected = [Decision.ALLOW, Decision.EXPLICIT_DENY, Decision.ALLOW]
+    patterns = collapse_patterns(statements[0]["Action"])
+    if decisions != expected or len(patterns) != 1:
+        raise RuntimeError(
+            f"Actions matched by case: decisions {decisions}, patterns {patterns}"
+        )
+
+
+def _run_multi_account(
+    original: Path, config: GeneratorConfig, workdir: Path, repeat: int
+) -> Dict[str, Dict[str, float]]:
+    """Ingest the dataset and a second account in a process pool, checking that
+    the merged graph's nodes and permissions are known to this process, that
+    its edges join its nodes, and that it decides like graphs built here and
+    merged."""
+    second = workdir / "second_account"
+    generate_dataset(
+        replace(config, account_id="210987654321", seed=config.seed + 1), second
+    )
+    folders = [original, second]
+    graph = None
+
+    def build():
+        nonlocal graph
+        graph = create_multi_account_graph(folders)
+
+    results = {"multi_account_graph": _time(build, repeat)}
+    unregistered = [
+        permission.id
+        for permission in (
+            data["relationship"].permission
+            for _, _, data in graph.get_edges(["permission"])
+        )
+        if PermissionFactory._instances.get(permission.id) is not permission
+        or ActionsFactory._instances.get(permission.action.aws_action_pattern)
+        is not permission.action
+    ]
+    if unregistered:
+        raise RuntimeError(
+            f"{len(unregistered)} permissions of the merged graph are unknown"
+            " to this process' factories"
+        )
+    known = {}
+    for factory in (
+        UserFactory,
+        GroupFactory,
+        RoleFactory,
+        ResourceFactory,
+        ServiceFactory,
+    ):
+        known.update(factory._instances)
+    detached = [
+        node_id
+        for node_id, data in graph.get_nodes()
+        if known.get(node_id) is not data["instance"]
+    ] + [
+        (source_id, target_id)
+        for source_id, target_id, data in graph.get_edges()
+        if data["relationship"].source is not graph.get_entity_by_id(source_id)
+        or data["relationship"].target is not graph.get_entity_by_id(target_id)
+    ]
+    if detached:
+        raise RuntimeError(
+            f"{len(detached)} nodes or edges of the merged graph are not the"
+            " factories' instances or do not join the graph's nodes"
+        )
+    merged = create_graph(original)
+    merged.merge(create_graph(second))
+    check_same_decisions(graph, merged)
+    return results
+
+
+def run_scale(name: str, scale: Scale, workdir: Path) -> Dict[str, Dict[str, float]]:
+    original = _dataset(name, scale, workdir)
+    processed = workdir / name / "processed"
+    results = {}
+
+    results["json_ingestion"] = _time(
+        lambda: sum(1 for _ in stream_iam_records(original)), scale.repeat
+    )
+
+    def process():
+        shutil.rmtree(processed, ignore_errors=True)
+        process_files(original, processed, max_workers=1)
+
+    results["process_files"] = _time(process, scale.repeat)
+
+    graph = None
+
+    def build():
+        nonlocal graph
+        graph = create_graph(original)
+
+    results["graph_construction"] = _time(build, scale.repeat)
+
+    if scale.config is not None:
+        results.update(
+            _run_multi_account(original, scale.config, workdir / name, scale.repeat)
+        )
+
+    catalogue = _catalogue()
+    patterns = list(ActionsFactory._instances.values())
+    results["find_matching_actions"] = _time(
+        lambda: [pattern.find_matching_actions(catalogue) for pattern in patterns],
+        scale.repeat,
+    )
+
+    ActionsFactory.matcher.add_actions(catalogue)
+
+    def match():
+        for pattern in patterns:
+            ActionsFactory.matcher.expand(pattern)
+        for action in catalogue:
+            ActionsFactory.patterns_matching(action)
+
+    results["action_matcher"] = _time(match, scale.repeat)
+
+    rng = random.Random(0)
+    node_ids = list(graph.graph.nodes)
+    sample = rng.sample(node_ids, min(1000, len(node_ids)))
+    names = [graph.get_entity_by_id(node_id).name for node_id in sample[:20]]
+
+    def query():
+        for node_id in sample:
+            graph.get_entity_by_id(node_id)
+            graph.get_relationships_from_node(node_id, filter_types=["permission"])
+            graph.get_relationships_to_node(node_id)
+        for entity_name in names:
+            try:
+                graph.get_entity_by_name(entity_name)
+            except ValueError:
+                pass
+
+    results["graph_queries"] = _time(query, scale.repeat)
+
+    matrix = None
+
+    def build_matrix():
+        nonlocal matrix
+        matrix = PermissionMatrix.from_graph(graph)
+
+    results["permission_matrix"] = _time(build_matrix, scale.repeat)
+
+    def query_matrix():
+        for principal in matrix.principals[:1000]:
+            matrix.actions_of(principal)
+        for action in catalogue:
+            matrix.principals_with(action)
+
+    results["matrix_queries"] = _time(query_matrix, scale.repeat)
+
+    permissions = list(PermissionFactory._instances.values())
+    runtime_values = {
+        "aws:CurrentTime": "2024-06-15T00:00:00Z",
+        "aws:SourceIp": "10.1.2.3",
+    }
+    results["is_granted"] = _time(
+        lambda: [permission.is_granted(runtime_values) for permission in permissions],
+        scale.repeat,
+    )
+
+    if scale.with_aws:
+        results.update(_run_aws(processed, scale.repeat))
+    return results
+
+
+def _trace_entities(graph: IAMGraph) -> Tuple[str, Optional[str]]:
+    """The first user that can assume a role, and that role; the first user
+    and None if no user can assume one."""
+    users = sorted(node_id for node_id, _ in graph.get_nodes(["user"]))
+    if not users:
+        raise ValueError("No user to replay the benchmark trace with")
+    roles: Dict[str, str] = {}
+    for source_id, target_id, _ in graph.get_edges([CanAssumeRole.type]):
+        if graph.graph.nodes[source_id].get("type") == "user":
+            roles[source_id] = min(target_id, roles.get(source_id, target_id))
+    user = next((user for user in users if user in roles), users[0])
+    return user, roles.get(user)
+
+
+def _run_aws(processed: Path, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Benchmarks that go through the AWS API, against moto."""
+    results = {}
+
+    def import_json():
+        with mock_aws():
+            AWSManager().import_from_json(processed)
+
+    results["import_from_json"] = _time(import_json, repeat)
+
+    step_timings, trace_timings = [], []
+    for _ in range(repeat):
+        with mock_aws():
+            aws_manager = AWSManager()
+            aws_manager.import_from_json(processed)
+            iam_manager = IAMManager(aws_manager)
+            iam_manager.update_graph()
+            mdp = IAMGraphMDP(iam_manager, aws_manager)
+
+            user, role = _trace_entities(iam_manager.graph)
+
+            start = time.perf_counter()
+            mdp.step_from_dict(
+                {
+                    "entity": user,
+                    "action": "iam:CreateUser",
+                    "parameters": {"user_name": "BenchmarkStepUser"},
+                }
+            )
+            step_timings.append(time.perf_counter() - start)
+
+            trace = {
+                "transitions": [
+                    {
+                        "entity": user,
+                        "action": "iam:CreateUser",
+                        "parameters": {"user_name": "BenchmarkUser"},
+                    },
+                    {
+                        "entity": user,
+                        "action": "iam:CreatePolicy",
+                        "parameters": {
+                            "policy_name": "BenchmarkPolicy",
+                            "actions": ["s3:*"],
+                            "resource": "*",
+                        },
+                    },
+                    {
+                        "entity": user,
+                        "action": "iam:AttachUserPolicy",
+                        "parameters": {
+                            "user_name": "BenchmarkUser",
+                            "policy_name": "BenchmarkPolicy",
+                        },
+                    },
+                ]
+            }
+            if role is not None:
+                # last, as it switches the identity the API is called with
+                trace["transitions"].append(
+                    {
+                        "entity": user,
+                        "action": "sts:AssumeRole",
+                        "parameters": {"role_arn": role},
+                    }
+                )
+            start = time.perf_counter()
+            mdp.execute_trace(trace)
+            trace_timings.append(time.perf_counter() - start)
+
+    for name, timings in [("mdp_step", step_timings), ("execute_trace", trace_timings)]:
+        results[name] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "repeat": repeat,
+        }
+    return results
+
+
+def compare(
+    results: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD
+) -> List[str]:
+    """Print current vs. baseline medians and return the regressed benchmarks."""
+    regressions = []
+    for scale, benchmarks in results["scales"].items():
+        baseline_benchmarks = baseline.get("scales", {}).get(scale, {})
+        for name, timing in benchmarks.items():
+            if name not in baseline_benchmarks:
+                continue
+            before = baseline_benchmarks[name]["median"]
+            after = timing["median"]
+            ratio = after / before if before else float("inf")
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{scale}/{name}")
+            print(
+                f"{scale:>8} {name:<24} {before:10.4f}s -> {after:10.4f}s"
+                f" ({ratio:5.2f}x){flag}"
+            )
+    return regressions
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scales", nargs="+", choices=list(SCALES), default=["small", "medium"]
+    )
+    parser.add_argument("--output", type=Path, help="where to write the results")
+    parser.add_argument("--baseline", type=Path, help="baseline to compare against")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"store the results as the baseline ({DEFAULT_BASELINE})",
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+
+    # per-node and per-edge logging would dominate the timings
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scales": {},
+    }
+    check_delta_duplicate_grants()
+    check_action_case()
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale_name in args.scales:
+            print(f"Running {scale_name} benchmarks")
+            results["scales"][scale_name] = run_scale(
+                scale_name, SCALES[scale_name], Path(workdir)
+            )
+
+    output = (
+        args.output or results_path / f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    if args.save_baseline:
+        output = DEFAULT_BASELINE
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"Regressions above {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -73,7 +73,7 @@ class CreatePolicy(SupportedAction):
 
         policy_arn = create_policy(aws_manager.iam, policy_name, policy_document)
 
-        iam_manager.update_permissions_to_node(policy_arn, policy_document)
+        # The policy grants nothing until it is attached (see AttachUserPolicy)
 
         return policy_arn
 
@@ -91,10 +91,10 @@ class AttachUserPolicy(SupportedAction):
         user_name: str,
         policy_name: str,
     ) -> None:
-        policy_arn = get_policy_from_name(aws_manager.iam, policy_name)["PolicyArn"]
-        attach_policy_to_user(aws_manager.iam, policy_arn, user_name)
-        user_arn = get_user(aws_manager.iam, user_name)
-        iam_manager.update_permissions_to_node(policy_arn, user_arn)
+        policy = get_policy_from_name(aws_manager.iam, policy_name)
+        attach_policy_to_user(aws_manager.iam, policy["PolicyArn"], user_name)
+        user_arn = get_user(aws_manager.iam, user_name)["Arn"]
+        iam_manager.update_permissions_to_node(policy["PolicyDocument"], user_arn)
 
 
 @dataclass(frozen=True)
@@ -0,0 +1,271 @@
+"""
+Search of privilege escalation paths over an IAMGraph.
+
+An attacker starts as a principal (user or role) and acts as one principal
+at a time. Using the actions of `supported.py`, it can:
+
+- assume a role that trusts the acting principal (`can_assume_role` edges);
+- create a user, whose access keys it then holds;
+- create a policy granting any action;
+- attach that policy to a user whose credentials it holds (the created user
+  or the starting user), giving that user any privilege.
+
+Whether the acting principal may perform an action is decided by
+`EffectivePermissionEvaluator`, so group memberships, explicit denies and
+resource-based grants are taken into account. A path ends as soon as a
+principal whose credentials the attacker holds has the target privilege.
+
+Paths are found by breadth-first search over (acting principal, user
+created, policy created) states, with a visited-state table, so they are
+shortest in number of actions. Principals that cannot reach, by assuming
+roles, any principal holding the target or able to create or attach
+policies are pruned up front by a reverse BFS over the CSR view of the graph.
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from cloud_guardian.iam_dynamic.actions.supported import (
+    AssumeRole,
+    AttachUserPolicy,
+    CreatePolicy,
+    CreateUser,
+)
+from cloud_guardian.iam_static.graph.evaluation import (
+    Decision,
+    EffectivePermissionEvaluator,
+)
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.permission.actions import ExcludedActions
+from cloud_guardian.iam_static.graph.relationships.relationships import (
+    CanAssumeRole,
+)
+from cloud_guardian.utils.arn import is_arn, parse_arn
+
+PRINCIPAL_TYPES = ["user", "role"]
+
+
+class _State(NamedTuple):
+    principal: str
+    created_user: bool
+    created_policy: bool
+
+
+@dataclass
+class EscalationPath:
+    # principal the attacker starts as
+    principal: str
+    # principal that ends up with the target privilege
+    holder: str
+    # transitions, in the format of `IAMGraphMDP.step_from_dict`
+    steps: List[Dict[str, Any]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def to_trace(self) -> Dict[str, Any]:
+        """The path as a trace for `IAMGraphMDP.execute_trace`."""
+        return {"transitions": self.steps}
+
+
+def _user_arn(principal_arn: str, user_name: str) -> Optional[str]:
+    """ARN of a user created in the account of a principal."""
+    if not is_arn(principal_arn):
+        return None
+    parsed = parse_arn(principal_arn)
+    return f"arn:{parsed.partition}:iam::{parsed.account}:user/{user_name}"
+
+
+class EscalationSearch:
+    def __init__(
+        self,
+        graph: IAMGraph,
+        target_action: str = "*",
+        target_resource: Optional[str] = None,
+        evaluator: Optional[EffectivePermissionEvaluator] = None,
+        user_name: str = "NewUser",
+        policy_name: str = "AdminPolicy",
+        max_depth: Optional[int] = None,
+    ):
+        self.graph = graph
+        self.target_action = target_action
+        self.target_resource = target_resource
+        self.evaluator = evaluator or EffectivePermissionEvaluator(graph)
+        # names given to the user and the policy the attacker creates
+        self.user_name = user_name
+        self.policy_name = policy_name
+        self.max_depth = max_depth
+        # principal -> (has the target, may create users, may create policies)
+        self._capabilities: Dict[str, Tuple[bool, bool, bool]] = {}
+
+    def _allowed(
+        self, principal: str, action: str, resource: Optional[str] = None
+    ) -> bool:
+        return self.evaluator.is_allowed(principal, action, resource)
+
+    def _has_target(self, principal: str) -> bool:
+        evaluation = self.evaluator.explain(
+            principal, self.target_action, self.target_resource
+        )
+        if evaluation.decision != Decision.ALLOW:
+            return False
+        # the complement of a NotAction list does not grant a whole wildcard
+        return "*" not in self.target_action or any(
+            not isinstance(statement.permission.action, ExcludedActions)
+            for statement in evaluation.statements
+        )
+
+    def capabilities(self, principal: str) -> Tuple[bool, bool, bool]:
+        capabilities = self._capabilities.get(principal)
+        if capabilities is None:
+            capabilities = (
+                self._has_target(principal),
+                self._allowed(principal, CreateUser.aws_action_id),
+                self._allowed(principal, CreatePolicy.aws_action_id),
+            )
+            self._capabilities[principal] = capabilities
+        return capabilities
+
+    def _assumable_roles(self, principal: str) -> List[str]:
+        return [
+            role
+            for _, role, _ in self.graph.get_outgoing_edges(
+                principal, filter_types=[CanAssumeRole.type]
+            )
+        ]
+
+    def _step(self, start: str, action_id: str, **parameters) -> Dict[str, Any]:
+        return {"entity": start, "action": action_id, "parameters": parameters}
+
+    def find_path(self, start: str) -> Optional[EscalationPath]:
+        """Shortest escalation path of a principal, None if it has none."""
+        if start not in self.graph.graph:
+            return None
+        if self.capabilities(start)[0]:
+            return EscalationPath(start, start)
+        start_type = self.graph.graph.nodes[start].get("type")
+        created_user = _user_arn(start, self.user_name)
+
+        initial = _State(start, False, False)
+        parents: Dict[_State, Tuple[Optional[_State], Optional[Dict]]] = {
+            initial: (None, None)
+        }
+        queue = deque([(initial, 0)])
+        while queue:
+            state, depth = queue.popleft()
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+            principal = state.principal
+            _, can_create_user, can_create_policy = self.capabilities(principal)
+
+            successors = [
+                (
+                    _State(role, state.created_user, state.created_policy),
+                    self._step(start, AssumeRole.aws_action_id, role_arn=role),
+                )
+                for role in self._assumable_roles(principal)
+            ]
+            if can_create_user and not state.created_user:
+                successors.append(
+                    (
+                        _State(principal, True, state.created_policy),
+                        self._step(
+                            start, CreateUser.aws_action_id, user_name=self.user_name
+                        ),
+                    )
+                )
+            if can_create_policy and not state.created_policy:
+                successors.append(
+                    (
+                        _State(principal, state.created_user, True),
+                        self._step(
+                            start,
+                            CreatePolicy.aws_action_id,
+                            policy_name=self.policy_name,
+                            actions=[self.target_action],
+                            resource=self.target_resource or "*",
+                        ),
+                    )
+                )
+
+            for successor, step in successors:
+                if successor in parents:
+                    continue
+                parents[successor] = (state, step)
+                if self.capabilities(successor.principal)[0]:
+                    return self._path(start, successor.principal, successor, parents)
+                queue.append((successor, depth + 1))
+
+            if not state.created_policy:
+                continue
+            # attaching the created policy to a user whose credentials are held
+            holders = []
+            if state.created_user:
+                holders.append((created_user, self.user_name))
+            if start_type == "user":
+                holders.append((start, self.graph.graph.nodes[start]["label"]))
+            for holder, holder_name in holders:
+                if self._allowed(principal, AttachUserPolicy.aws_action_id, holder):
+                    step = self._step(
+                        start,
+                        AttachUserPolicy.aws_action_id,
+                        user_name=holder_name,
+                        policy_name=self.policy_name,
+                    )
+                    path = self._path(start, holder, state, parents)
+                    path.steps.append(step)
+                    return path
+        return None
+
+    def _path(
+        self,
+        start: str,
+        holder: str,
+        state: _State,
+        parents: Dict[_State, Tuple[Optional[_State], Optional[Dict]]],
+    ) -> EscalationPath:
+        steps = []
+        while True:
+            state, step = parents[state]
+            if state is None:
+                break
+            steps.append(step)
+        return EscalationPath(start, holder, steps[::-1])
+
+    def candidates(self, principals: Optional[Iterable[str]] = None) -> List[str]:
+        """Principals that may have an escalation path.
+
+        Only those that can reach, by assuming roles, a principal with the
+        target or able to create users or policies are kept.
+        """
+        if principals is None:
+            principals = [node for node, _ in self.graph.get_nodes(PRINCIPAL_TYPES)]
+        principals = list(principals)
+        csr = self.graph.to_csr()
+        useful = [
+            csr.node_index[principal]
+            for principal, _ in self.graph.get_nodes(PRINCIPAL_TYPES)
+            if any(self.capabilities(principal))
+        ]
+        if not useful:
+            return []
+        levels = csr.bfs_levels(useful, [CanAssumeRole.type], reverse=True)
+        reaching = set(np.flatnonzero(levels >= 0).tolist())
+        return [
+            principal
+            for principal in principals
+            if csr.node_index.get(principal) in reaching
+        ]
+
+    def find_all(
+        self, principals: Optional[Iterable[str]] = None
+    ) -> Dict[str, EscalationPath]:
+        """Shortest escalation path of every principal that has one."""
+        paths = {}
+        for principal in self.candidates(principals):
+            path = self.find_path(principal)
+            if path is not None:
+                paths[principal] = path
+        return paths
@@ -93,9 +93,11 @@ class IAMGraphMDP:
     def step_from_dict(self, transition_data: Dict[str, Any]):
         action_id = transition_data["action"]
         parameters = Parameters.from_dict(transition_data["parameters"])
-        # entity = self.iam_manager.graph.get_entity_by_name(transition_data["entity"])
-        # TODO: remove after TODOs are done
-        entity = "arn:aws:iam::123456789012:user/Eve"
+        # the entity is given by its ARN or by its (unique) name
+        graph = self.iam_manager.graph
+        entity = graph.get_entity_by_id(transition_data["entity"])
+        if entity is None:
+            entity = graph.get_entity_by_name(transition_data["entity"])
         self.step(entity, action_id, parameters)
 
     def execute_trace(self, trace: dict):
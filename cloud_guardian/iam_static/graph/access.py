@@ -0,0 +1,309 @@
+"""
+Reverse index answering "who can perform this action on this resource".
+
+Permission edges are indexed by the resource they are granted on (or
+`GLOBAL` for those granted on every resource) and by action pattern, with
+the nodes holding them: principals, groups, or resources granting an action
+to every principal. The index follows the graph's changes, re-indexing the
+permission edges of the node a change comes from, so it stays valid while
+`IAMManager` updates the graph in place.
+
+A query looks up the holders of the patterns covering the action, expands
+groups into their members, decides each candidate with
+`EffectivePermissionEvaluator` (so denies, `NotResource`, `NotPrincipal` and
+conditions apply), then follows `can_assume_role` edges backwards: whoever
+can assume an allowed role, directly or through a chain of roles or through
+one of its groups, can access the resource too. Each principal comes with
+the path of nodes its access derives from.
+
+Candidates whose only grants are on every resource get the same decision on
+any resource nothing else names: their access, and who reaches them by
+assuming roles, is worked out once per action and shared by every resource
+whose own grants do not change it, so reports over many resources stay cheap.
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from cloud_guardian.iam_static.graph.evaluation import (
+    Decision,
+    EffectivePermissionEvaluator,
+    MatchedStatement,
+    resource_id,
+)
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.relationships.relationships import (
+    CanAssumeRole,
+    HasPermission,
+    IsPartOf,
+)
+
+# index key of the permissions granted on every resource
+GLOBAL = "*"
+
+# node types a resource-wide grant extends to
+PRINCIPAL_TYPES = ["user", "role"]
+
+
+@dataclass
+class AccessPath:
+    principal: str
+    # nodes the access derives from, starting with the principal: the roles
+    # it assumes (and the groups it assumes them through), then the group or
+    # resource holding the permission if it is not the last role itself
+    path: List[str]
+    # the Allow statements behind the access
+    statements: Tuple[MatchedStatement, ...] = field(default_factory=tuple)
+
+
+class _UnscopedAccess(NamedTuple):
+    """Access through permissions granted on every resource."""
+
+    # principals allowed on any resource nothing else names
+    allowed: Dict[str, AccessPath]
+    # those and whoever can assume one of the allowed roles
+    answer: Dict[str, AccessPath]
+    # principals whose `NotResource` exclusions require deciding resource by
+    # resource
+    per_resource: List[str]
+
+
+class ResourceAccessIndex:
+    def __init__(
+        self,
+        graph: IAMGraph,
+        evaluator: Optional[EffectivePermissionEvaluator] = None,
+    ):
+        self.graph = graph
+        # sharing an evaluator shares its per-principal caches
+        self.evaluator = evaluator or EffectivePermissionEvaluator(graph)
+        # resource id (or GLOBAL) -> action pattern -> nodes holding a
+        # permission with that pattern on that resource
+        self._grants: Dict[str, Dict[str, Dict[str, None]]] = {}
+        # holder -> its (resource id, action pattern) entries of `_grants`
+        self._holder_keys: Dict[str, List[Tuple[str, str]]] = {}
+        # (resource, action) -> answer without context; dropped on every
+        # change
+        self._answers: Dict[Tuple[str, str], Dict[str, AccessPath]] = {}
+        # action -> access without context through permissions on every
+        # resource; dropped on every change
+        self._unscoped: Dict[str, _UnscopedAccess] = {}
+        for holder in dict.fromkeys(
+            source_id for source_id, _, _ in graph.get_edges(["permission"])
+        ):
+            self._reindex(holder)
+        graph.add_listener(self._on_change)
+
+    def close(self):
+        """Stop following changes to the graph."""
+        self.graph.remove_listener(self._on_change)
+
+    def _reindex(self, holder: str):
+        """Replace the entries of a node by those of its current permission edges."""
+        for key, pattern in self._holder_keys.pop(holder, []):
+            holders = self._grants[key][pattern]
+            holders.pop(holder, None)
+            if not holders:
+                del self._grants[key][pattern]
+                if not self._grants[key]:
+                    del self._grants[key]
+        if holder not in self.graph.graph:
+            return
+        is_resource = self.graph.graph.nodes[holder].get("type") == "resource"
+        entries = {}
+        for relationship in self.graph.get_relationships_from_node(
+            holder, filter_types=["permission"]
+        ):
+            key = (
+                GLOBAL
+                if isinstance(relationship, HasPermission) and not is_resource
+                else relationship.target.id
+            )
+            pattern = relationship.permission.action.aws_action_pattern
+            entries[(key, pattern)] = None
+            self._grants.setdefault(key, {}).setdefault(pattern, {})[holder] = None
+        if entries:
+            self._holder_keys[holder] = list(entries)
+
+    def _on_change(self, event: str, source_id: str, target_id: Optional[str]):
+        # permission edges leave their holder, so only the source of a change
+        # can have different entries; any change may alter the answers
+        self._answers.clear()
+        self._unscoped.clear()
+        if event != "add_node":
+            self._reindex(source_id)
+
+    def holders(
+        self, resource: str, action: str, resource_wide: bool = True
+    ) -> List[str]:
+        """Nodes holding a permission (Allow or Deny) that may apply to an
+        action on a resource; with `resource_wide`, also those holding it on
+        every resource."""
+        target = resource_id(resource)
+        keys = [target, GLOBAL] if resource_wide else [target]
+        holders: Dict[str, None] = {}
+        for pattern in self.evaluator.patterns_matching(action):
+            for key in keys:
+                holders.update(self._grants.get(key, {}).get(pattern, {}))
+        return list(holders)
+
+    def _principals_of(self, holder: str) -> List[str]:
+        holder_type = self.graph.graph.nodes[holder].get("type")
+        if holder_type == "group":
+            return [
+                member_id
+                for member_id, _, _ in self.graph.get_incoming_edges(
+                    holder, filter_types=[IsPartOf.type]
+                )
+            ]
+        if holder_type == "resource":
+            return [node_id for node_id, _ in self.graph.get_nodes(PRINCIPAL_TYPES)]
+        return [holder]
+
+    def _has_not_resources(self, principal: str, action: str) -> bool:
+        permissions = self.evaluator.permissions_of(principal)
+        return any(
+            permission.not_resources
+            for pattern in self.evaluator.patterns_matching(action)
+            for permission, scope, _ in permissions.get(pattern, [])
+            if scope is None
+        )
+
+    def _direct_access(
+        self,
+        principal: str,
+        action: str,
+        resource: Optional[str],
+        context: Optional[Dict[str, Any]],
+    ) -> Optional[AccessPath]:
+        evaluation = self.evaluator.explain(principal, action, resource, context)
+        if evaluation.decision != Decision.ALLOW:
+            return None
+        source = evaluation.statements[0].source
+        path = [principal] if source == principal else [principal, source]
+        return AccessPath(principal, path, evaluation.statements)
+
+    def _unscoped_access(
+        self, action: str, context: Optional[Dict[str, Any]]
+    ) -> _UnscopedAccess:
+        unscoped = None if context else self._unscoped.get(action)
+        if unscoped is not None:
+            return unscoped
+        principals: Dict[str, None] = {}
+        for pattern in self.evaluator.patterns_matching(action):
+            for holder in self._grants.get(GLOBAL, {}).get(pattern, {}):
+                principals.update(dict.fromkeys(self._principals_of(holder)))
+        allowed, per_resource = {}, []
+        for principal in principals:
+            if self._has_not_resources(principal, action):
+                per_resource.append(principal)
+                continue
+            access = self._direct_access(principal, action, None, context)
+            if access is not None:
+                allowed[principal] = access
+        answer = dict(allowed)
+        self._add_assumers(answer, list(allowed))
+        unscoped = _UnscopedAccess(allowed, answer, per_resource)
+        if not context:
+            self._unscoped[action] = unscoped
+        return unscoped
+
+    def who_can(
+        self,
+        resource: str,
+        action: str,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, AccessPath]:
+        """Principals that may perform an action on a resource, with how.
+
+        Resources sharing the same answer share the same dict, which must not
+        be modified.
+        """
+        answer = None if context else self._answers.get((resource, action))
+        if answer is not None:
+            return answer
+
+        # principals with a permission naming the resource, or granted by it
+        scoped: Dict[str, None] = {}
+        for holder in self.holders(resource, action, resource_wide=False):
+            scoped.update(dict.fromkeys(self._principals_of(holder)))
+        unscoped = self._unscoped_access(action, context)
+        decided = {
+            principal: self._direct_access(principal, action, resource, context)
+            for principal in [*scoped, *unscoped.per_resource]
+        }
+
+        if not decided:
+            answer = unscoped.answer
+        elif any(
+            access is None and principal in unscoped.allowed
+            for principal, access in decided.items()
+        ):
+            # denied here, and maybe the role others reach the resource through
+            answer = {
+                principal: access
+                for principal, access in unscoped.allowed.items()
+                if principal not in decided
+            }
+            answer.update(
+                (principal, access)
+                for principal, access in decided.items()
+                if access is not None
+            )
+            self._add_assumers(answer, list(answer))
+        else:
+            added = [
+                principal for principal, access in decided.items() if access is not None
+            ]
+            answer = {**unscoped.answer, **{p: decided[p] for p in added}}
+            self._add_assumers(answer, added)
+
+        if not context:
+            self._answers[(resource, action)] = answer
+        return answer
+
+    def _add_assumers(self, answer: Dict[str, AccessPath], roles: List[str]):
+        """Add who can reach one of the roles (if allowed) by assuming roles,
+        with the shortest such chain."""
+        queue = deque(roles)
+        while queue:
+            role = queue.popleft()
+            if self.graph.graph.nodes[role].get("type") != "role":
+                continue
+            access = answer[role]
+            for source_id, _, _ in self.graph.get_incoming_edges(
+                role, filter_types=[CanAssumeRole.type]
+            ):
+                if self.graph.graph.nodes[source_id].get("type") == "group":
+                    assumers = [
+                        (member_id, [member_id, source_id])
+                        for member_id in self._principals_of(source_id)
+                    ]
+                else:
+                    assumers = [(source_id, [source_id])]
+                for assumer, prefix in assumers:
+                    if assumer in answer:
+                        continue
+                    answer[assumer] = AccessPath(
+                        assumer, prefix + access.path, access.statements
+                    )
+                    queue.append(assumer)
+
+    def exposure(
+        self,
+        actions: Iterable[str],
+        resources: Optional[Iterable[str]] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Dict[str, Dict[str, AccessPath]]]:
+        """Who can perform each action on each resource (every resource node
+        by default), by resource and action."""
+        actions = list(actions)
+        if resources is None:
+            resources = [node_id for node_id, _ in self.graph.get_nodes(["resource"])]
+        return {
+            resource: {
+                action: self.who_can(resource, action, context) for action in actions
+            }
+            for resource in resources
+        }
@@ -24,6 +24,7 @@ from cloud_guardian.iam_static.graph.relationships.relationships import (
     HasPermissionToResource,
     IsPartOf,
 )
+from cloud_guardian.utils.arn import parse_arn
 
 logger = logging.getLogger(__name__)
 
@@ -263,5 +264,4 @@ def connect_graph(graph: IAMGraph, groups_data, policies_data, roles_data, users
 
 
 def extract_identifier_from_ARN(arn: str) -> str:
-    # Simple example, real extraction might be more complex.
-    return arn.split(":")[-1]
+    return parse_arn(arn).resource
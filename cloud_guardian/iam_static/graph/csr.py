@@ -0,0 +1,296 @@
+"""
+Compressed sparse row (CSR) view of an IAMGraph.
+
+Nodes are numbered in the order of the graph and every edge of the
+`MultiDiGraph` becomes one entry of flat NumPy arrays: the outgoing edges of
+node `i` are `indices[indptr[i]:indptr[i + 1]]`, with their type in
+`edge_types` and their permission (if any) in `edge_permissions`. Whole-graph
+algorithms (degrees, BFS frontiers, reachability) then run vectorised over
+those arrays instead of walking networkx dictionaries.
+
+`IAMGraph.to_csr` keeps the view of a graph and rebuilds it after the graph
+changes. scipy is optional: when it is installed, BFS frontiers are expanded
+by sparse matrix products and `to_scipy` exports the adjacency matrix.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.permission.permission import Permission
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# `edge_permissions` entry of edges that carry no permission
+NO_PERMISSION = -1
+
+
+@dataclass
+class CSRGraph:
+    # node index -> node id
+    node_ids: List[str]
+    # (nodes,) codes into `node_type_names`
+    node_types: np.ndarray
+    node_type_names: List[str]
+    # (nodes + 1,) offsets into the edge arrays
+    indptr: np.ndarray
+    # (edges,) target node of each edge
+    indices: np.ndarray
+    # (edges,) codes into `edge_type_names`
+    edge_types: np.ndarray
+    edge_type_names: List[str]
+    # (edges,) index into `permissions`, or NO_PERMISSION
+    edge_permissions: np.ndarray
+    permissions: List[Permission]
+    node_index: Dict[str, int] = field(init=False, repr=False)
+    _reversed: Optional["CSRGraph"] = field(default=None, init=False, repr=False)
+    _matrices: Dict[tuple, object] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.node_index = {
+            node_id: index for index, node_id in enumerate(self.node_ids)
+        }
+
+    @classmethod
+    def from_graph(cls, graph: IAMGraph) -> "CSRGraph":
+        """Export the nodes and edges of an IAMGraph."""
+        node_ids = list(graph.graph.nodes)
+        node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+        node_type_names: Dict[str, int] = {}
+        node_types = np.array(
+            [
+                node_type_names.setdefault(node_type, len(node_type_names))
+                for _, node_type in graph.graph.nodes(data="type")
+            ],
+            dtype=np.uint8,
+        )
+
+        edge_type_names: Dict[str, int] = {}
+        permission_index: Dict[str, int] = {}
+        permissions: List[Permission] = []
+        sources, targets, edge_types, edge_permissions = [], [], [], []
+        for source, target, edge_data in graph.graph.edges(data=True):
+            sources.append(node_index[source])
+            targets.append(node_index[target])
+            edge_types.append(
+                edge_type_names.setdefault(edge_data["type"], len(edge_type_names))
+            )
+            permission = getattr(edge_data["relationship"], "permission", None)
+            if permission is None:
+                edge_permissions.append(NO_PERMISSION)
+                continue
+            if permission.id not in permission_index:
+                permission_index[permission.id] = len(permissions)
+                permissions.append(permission)
+            edge_permissions.append(permission_index[permission.id])
+
+        return cls._from_edges(
+            node_ids,
+            node_types,
+            list(node_type_names),
+            np.array(sources, dtype=np.int64),
+            np.array(targets, dtype=np.int32),
+            np.array(edge_types, dtype=np.uint8),
+            list(edge_type_names),
+            np.array(edge_permissions, dtype=np.int32),
+            permissions,
+        )
+
+    @classmethod
+    def _from_edges(
+        cls,
+        node_ids: List[str],
+        node_types: np.ndarray,
+        node_type_names: List[str],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        edge_types: np.ndarray,
+        edge_type_names: List[str],
+        edge_permissions: np.ndarray,
+        permissions: List[Permission],
+    ) -> "CSRGraph":
+        # stable, so that the edges of a node keep their order
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=indptr[1:])
+        return cls(
+            node_ids=node_ids,
+            node_types=node_types,
+            node_type_names=node_type_names,
+            indptr=indptr,
+            indices=targets[order].astype(np.int32),
+            edge_types=edge_types[order],
+            edge_type_names=edge_type_names,
+            edge_permissions=edge_permissions[order],
+            permissions=permissions,
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def sources(self) -> np.ndarray:
+        """(edges,) source node of each edge."""
+        return np.repeat(
+            np.arange(self.num_nodes, dtype=np.int32), np.diff(self.indptr)
+        )
+
+    def reversed(self) -> "CSRGraph":
+        """The view with every edge reversed (incoming edges by node)."""
+        if self._reversed is None:
+            self._reversed = self._from_edges(
+                self.node_ids,
+                self.node_types,
+                self.node_type_names,
+                self.indices.astype(np.int64),
+                self.sources(),
+                self.edge_types,
+                self.edge_type_names,
+                self.edge_permissions,
+                self.permissions,
+            )
+            self._reversed._reversed = self
+        return self._reversed
+
+    def node_mask(self, node_types: Iterable[str]) -> np.ndarray:
+        """(nodes,) whether each node is of one of the types."""
+        codes = [
+            self.node_type_names.index(node_type)
+            for node_type in node_types
+            if node_type in self.node_type_names
+        ]
+        return np.isin(self.node_types, codes)
+
+    def edge_mask(self, edge_types: Optional[Iterable[str]] = None) -> np.ndarray:
+        """(edges,) whether each edge is of one of the types (all edges for None)."""
+        if edge_types is None:
+            return np.ones(self.num_edges, dtype=bool)
+        codes = [
+            self.edge_type_names.index(edge_type)
+            for edge_type in edge_types
+            if edge_type in self.edge_type_names
+        ]
+        return np.isin(self.edge_types, codes)
+
+    def out_degree(self, edge_types: Optional[Iterable[str]] = None) -> np.ndarray:
+        if edge_types is None:
+            return np.diff(self.indptr)
+        return np.bincount(
+            self.sources()[self.edge_mask(edge_types)], minlength=self.num_nodes
+        )
+
+    def in_degree(self, edge_types: Optional[Iterable[str]] = None) -> np.ndarray:
+        return np.bincount(
+            self.indices[self.edge_mask(edge_types)], minlength=self.num_nodes
+        )
+
+    def degree_statistics(
+        self, edge_types: Optional[Iterable[str]] = None
+    ) -> Dict[str, Dict[str, float]]:
+        """Min, max, mean and median of the in and out degrees."""
+        statistics = {}
+        for name, degrees in [
+            ("out", self.out_degree(edge_types)),
+            ("in", self.in_degree(edge_types)),
+        ]:
+            statistics[name] = (
+                {
+                    "min": int(degrees.min()),
+                    "max": int(degrees.max()),
+                    "mean": float(degrees.mean()),
+                    "median": float(np.median(degrees)),
+                }
+                if len(degrees)
+                else {}
+            )
+        return statistics
+
+    def to_scipy(self, edge_types: Optional[Iterable[str]] = None):
+        """(nodes, nodes) `scipy.sparse.csr_matrix` counting the edges between nodes."""
+        if sparse is None:
+            raise ImportError("scipy is required to export a scipy.sparse matrix")
+        key = None if edge_types is None else tuple(sorted(set(edge_types)))
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            mask = self.edge_mask(edge_types)
+            matrix = sparse.csr_matrix(
+                (
+                    np.ones(int(mask.sum()), dtype=np.int32),
+                    (self.sources()[mask], self.indices[mask]),
+                ),
+                shape=(self.num_nodes, self.num_nodes),
+            )
+            self._matrices[key] = matrix
+        return matrix
+
+    def _successors(self, frontier: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Targets of the (masked) edges leaving the frontier nodes."""
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int32)
+        # positions of the edges of every frontier node, concatenated
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        edges = np.arange(total, dtype=np.int64) + offsets
+        return self.indices[edges[mask[edges]]]
+
+    def bfs_levels(
+        self,
+        sources: Iterable[Union[str, int]],
+        edge_types: Optional[Iterable[str]] = None,
+        reverse: bool = False,
+        max_depth: Optional[int] = None,
+    ) -> np.ndarray:
+        """(nodes,) BFS depth of each node from the sources, -1 if not reached.
+
+        `reverse` follows the edges backwards, e.g. to find who can reach a node.
+        """
+        graph = self.reversed() if reverse else self
+        levels = np.full(self.num_nodes, -1, dtype=np.int32)
+        frontier = np.unique(
+            np.array(
+                [
+                    self.node_index[source] if isinstance(source, str) else source
+                    for source in sources
+                ],
+                dtype=np.int64,
+            )
+        )
+        levels[frontier] = 0
+        matrix = None
+        if sparse is not None:
+            # edges into each node, so that a product expands the frontier
+            matrix = graph.to_scipy(edge_types).T
+        else:
+            mask = graph.edge_mask(edge_types)
+        depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            depth += 1
+            if matrix is not None:
+                indicator = np.zeros(self.num_nodes, dtype=np.int32)
+                indicator[frontier] = 1
+                reached = np.flatnonzero(matrix @ indicator)
+            else:
+                reached = np.unique(graph._successors(frontier, mask))
+            frontier = reached[levels[reached] == -1]
+            levels[frontier] = depth
+        return levels
+
+    def reachable(
+        self,
+        sources: Iterable[Union[str, int]],
+        edge_types: Optional[Iterable[str]] = None,
+        reverse: bool = False,
+    ) -> List[str]:
+        """Ids of the nodes reachable from the sources (sources included)."""
+        levels = self.bfs_levels(sources, edge_types, reverse)
+        return [self.node_ids[index] for index in np.flatnonzero(levels >= 0)]
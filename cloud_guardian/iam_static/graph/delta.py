@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.identities.group import Group
+from cloud_guardian.iam_static.graph.identities.resources import Resource
+from cloud_guardian.iam_static.graph.identities.role import Role
+from cloud_guardian.iam_static.graph.identities.services import SupportedService
+from cloud_guardian.iam_static.graph.identities.user import User
+from cloud_guardian.iam_static.graph.initializers import (
+    create_graph,
+    create_graph_from_authorization_details,
+)
+from cloud_guardian.iam_static.graph.relationships.relationships import Relationship
+from cloud_guardian.iam_static.graph.snapshot import load_snapshot
+
+Node = Union[User, Group, Role, Resource, SupportedService]
+
+# (source id, target id, relationship type, permission id)
+RelationshipKey = Tuple[str, str, str, Optional[str]]
+
+
+def relationship_key(relationship: Relationship) -> RelationshipKey:
+    """Identity of a relationship, independent of the graph it belongs to."""
+    permission = getattr(relationship, "permission", None)
+    return (
+        relationship.source.id,
+        relationship.target.id,
+        relationship.type,
+        None if permission is None else permission.id,
+    )
+
+
+@dataclass
+class GraphDelta:
+    """Changes turning one IAMGraph into another."""
+
+    added_nodes: List[Node] = field(default_factory=list)
+    removed_nodes: List[Node] = field(default_factory=list)
+    added_relationships: List[Relationship] = field(default_factory=list)
+    removed_relationships: List[Relationship] = field(default_factory=list)
+    # policy ARN -> (previous default version, new default version); None when
+    # the policy did not exist on that side
+    policy_versions: Dict[str, Tuple[Optional[str], Optional[str]]] = field(
+        default_factory=dict
+    )
+
+    def is_empty(self) -> bool:
+        return not (
+            self.added_nodes
+            or self.removed_nodes
+            or self.added_relationships
+            or self.removed_relationships
+            or self.policy_versions
+        )
+
+    def touched_ids(self) -> Set[str]:
+        """Ids of the nodes added, removed, or at either end of a changed edge."""
+        touched = {node.id for node in self.added_nodes + self.removed_nodes}
+        for relationship in self.added_relationships + self.removed_relationships:
+            touched.add(relationship.source.id)
+            touched.add(relationship.target.id)
+        return touched
+
+    def summary(self) -> str:
+        return (
+            f"+{len(self.added_nodes)}/-{len(self.removed_nodes)} nodes, "
+            f"+{len(self.added_relationships)}/-{len(self.removed_relationships)} "
+            f"relationships, {len(self.policy_versions)} policy version changes"
+        )
+
+
+def _relationships(iam_graph: IAMGraph) -> Dict[RelationshipKey, List[Relationship]]:
+    """Relationships of a graph by key; a key has several when the same grant
+    comes from several policies."""
+    relationships: Dict[RelationshipKey, List[Relationship]] = {}
+    for _, _, edge_data in iam_graph.graph.edges(data=True):
+        relationship = edge_data["relationship"]
+        relationships.setdefault(relationship_key(relationship), []).append(
+            relationship
+        )
+    return relationships
+
+
+def compute_delta(old: IAMGraph, new: IAMGraph) -> GraphDelta:
+    """Compute the delta that turns `old` into `new`.
+
+    Relationships are compared as multisets: each parallel edge more or less
+    than on the other side is one added or removed relationship.
+    """
+    delta = GraphDelta()
+
+    old_nodes, new_nodes = old.graph.nodes, new.graph.nodes
+    for node_id in new_nodes:
+        if node_id not in old_nodes:
+            delta.added_nodes.append(new_nodes[node_id]["instance"])
+    for node_id in old_nodes:
+        if node_id not in new_nodes:
+            delta.removed_nodes.append(old_nodes[node_id]["instance"])
+
+    old_relationships, new_relationships = _relationships(old), _relationships(new)
+    for key, relationships in new_relationships.items():
+        count = len(old_relationships.get(key, ()))
+        delta.added_relationships.extend(relationships[count:])
+    for key, relationships in old_relationships.items():
+        count = len(new_relationships.get(key, ()))
+        delta.removed_relationships.extend(relationships[count:])
+
+    for policy_arn in old.policy_versions.keys() | new.policy_versions.keys():
+        old_version = old.policy_versions.get(policy_arn)
+        new_version = new.policy_versions.get(policy_arn)
+        if old_version != new_version:
+            delta.policy_versions[policy_arn] = (old_version, new_version)
+    return delta
+
+
+def diff_export(
+    snapshot_path: Path, export_paths: Union[Path, Iterable[Path]]
+) -> Tuple[GraphDelta, IAMGraph]:
+    """Compare a new export against the snapshot of the previous one.
+
+    `export_paths` is either a groups/policies/roles/users.json folder or
+    authorization details dumps. Returns the delta together with the graph of
+    the new export, which can be saved as the next snapshot.
+    """
+    previous = load_snapshot(snapshot_path)
+    if (
+        isinstance(export_paths, (str, Path))
+        and (Path(export_paths) / "users.json").exists()
+    ):
+        current = create_graph(export_paths)
+    else:
+        current = create_graph_from_authorization_details(export_paths)
+    return compute_delta(previous, current), current
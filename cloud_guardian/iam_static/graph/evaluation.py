@@ -0,0 +1,402 @@
+"""
+Effective permissions of principals, following the IAM evaluation logic.
+
+A request (principal, action, resource) is evaluated against every
+permission that applies to the principal: its own, those of the groups it is
+part of, and those granted to it by resource-based policies, either by name
+or as every principal but those of a `NotPrincipal` element. Then:
+
+1. if an applicable Deny has all its conditions met, the request is
+   explicitly denied, whatever else allows it;
+2. otherwise, if an applicable Allow has all its conditions met, it is allowed;
+3. otherwise it is implicitly denied.
+
+A permission applies when its action pattern (or `NotAction` complement)
+covers the action and it is either granted on every resource (a
+`HasPermission` edge, less its `NotResource` exclusions) or on the resource
+of the request (a `HasPermissionToResource` edge). Whether a condition whose
+key is missing from the request context is met depends on its operator.
+"""
+
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.permission.actions import ActionMatcher
+from cloud_guardian.iam_static.graph.permission.effects import Effect
+from cloud_guardian.iam_static.graph.permission.permission import Permission
+from cloud_guardian.iam_static.graph.relationships.relationships import (
+    HasPermission,
+    IsPartOf,
+)
+from cloud_guardian.utils.arn import is_arn, parse_arn
+
+
+class Decision(Enum):
+    ALLOW = "Allow"
+    EXPLICIT_DENY = "ExplicitDeny"
+    IMPLICIT_DENY = "ImplicitDeny"
+
+    def __str__(self):
+        return self.value
+
+
+# A permission with the id of the resource it is granted on (None for every
+# resource but its `not_resources`) and the id of the node holding it (the
+# principal itself or one of its groups)
+ScopedPermission = Tuple[Permission, Optional[str], str]
+
+# (action, resource ARN, context key) of a memoised decision
+_DecisionKey = Tuple[str, Optional[str], Optional[Hashable]]
+
+# memo key (None if it cannot be memoised), resource and context of a request
+# to evaluate, with the positions of the requests it answers
+_PendingRequest = Tuple[
+    Optional[_DecisionKey], Optional[str], Optional[Dict[str, Any]], List[int]
+]
+
+
+class MatchedStatement(NamedTuple):
+    """A permission that took part in a decision, with where it comes from."""
+
+    # principal, group or resource (for resource-wide grants) holding it
+    source: str
+    permission: Permission
+    # resource it is granted on, None for every resource
+    resource: Optional[str]
+
+
+class Evaluation(NamedTuple):
+    decision: Decision
+    # the Deny statements of an explicit deny, or the Allow statements of an
+    # allowed request
+    statements: Tuple[MatchedStatement, ...] = ()
+
+
+_IMPLICIT_DENY = Evaluation(Decision.IMPLICIT_DENY)
+
+_NOT_IN_GRAPH = _IMPLICIT_DENY
+
+# Number of distinct resource ARNs whose node id is kept
+_RESOURCE_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=_RESOURCE_CACHE_SIZE)
+def resource_id(arn: Optional[str]) -> Optional[str]:
+    """Id of the graph node a resource ARN refers to (S3 objects map to their bucket)."""
+    if arn is None or not is_arn(arn):
+        return arn
+    parsed = parse_arn(arn)
+    if parsed.service == "s3":
+        return f"arn:{parsed.partition}:s3:::{parsed.bucket}"
+    return arn
+
+
+def _context_key(context: Optional[Dict[str, Any]]) -> Optional[Hashable]:
+    """Hashable form of a request context, or None if it cannot be memoised."""
+    if not context:
+        return ()
+    try:
+        key = tuple(sorted(context.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class EffectivePermissionEvaluator:
+    """Evaluates requests of the principals of an IAMGraph.
+
+    The permissions applying to each principal and the decisions of the
+    requests evaluated for it are memoised. The evaluator listens to the
+    graph and forgets what it memoised for a principal as soon as an edge
+    from it or from one of its groups is added or removed, so it stays valid
+    while `IAMManager` updates the graph in place.
+    """
+
+    def __init__(self, graph: IAMGraph):
+        self.graph = graph
+        # principal id -> action pattern -> permissions with that pattern
+        self._permissions: Dict[str, Dict[str, List[ScopedPermission]]] = {}
+        self._decisions: Dict[str, Dict[_DecisionKey, Evaluation]] = {}
+        # resource id -> action pattern -> permissions the resource grants to
+        # every principal but those it excludes (`HasPermission` edges of the
+        # resource node)
+        self._resource_permissions: Dict[str, Dict[str, List[Permission]]] = {}
+        # action patterns of the graph's permission edges, indexed on first
+        # use; patterns of removed edges stay, as they match no permission
+        self._matcher: Optional[ActionMatcher] = None
+        # action -> patterns covering it; patterns only become relevant with
+        # new edges, which clear it
+        self._patterns: Dict[str, Tuple[str, ...]] = {}
+        graph.add_listener(self._on_change)
+
+    def close(self):
+        """Stop following changes to the graph."""
+        self.graph.remove_listener(self._on_change)
+
+    def permissions_of(self, principal_id: str) -> Dict[str, List[ScopedPermission]]:
+        """Permissions applying to a principal, by action pattern."""
+        permissions = self._permissions.get(principal_id)
+        if permissions is None:
+            permissions = {}
+            holders = [principal_id] + [
+                group_id
+                for _, group_id, _ in self.graph.get_outgoing_edges(
+                    principal_id, filter_types=[IsPartOf.type]
+                )
+            ]
+            for holder in holders:
+                for relationship in self.graph.get_relationships_from_node(
+                    holder, filter_types=["permission"]
+                ):
+                    scope = (
+                        None
+                        if isinstance(relationship, HasPermission)
+                        else relationship.target.id
+                    )
+                    permission = relationship.permission
+                    permissions.setdefault(
+                        permission.action.aws_action_pattern, []
+                    ).append((permission, scope, holder))
+            self._permissions[principal_id] = permissions
+        return permissions
+
+    def resource_permissions_of(self, target: str) -> Dict[str, List[Permission]]:
+        """Permissions a resource grants to (almost) every principal, by action pattern."""
+        permissions = self._resource_permissions.get(target)
+        if permissions is None:
+            permissions = {}
+            if self.graph.graph.nodes.get(target, {}).get("type") == "resource":
+                for relationship in self.graph.get_relationships_from_node(
+                    target, filter_types=["permission"]
+                ):
+                    permission = relationship.permission
+                    permissions.setdefault(
+                        permission.action.aws_action_pattern, []
+                    ).append(permission)
+            self._resource_permissions[target] = permissions
+        return permissions
+
+    def evaluate(
+        self,
+        principal_id: str,
+        action: str,
+        resource: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Decision:
+        """Decide whether `principal_id` may perform `action` on `resource`.
+
+        `resource` is a resource ARN, or None for actions that are not
+        performed on a resource (only permissions granted on every resource
+        apply then). `context` holds the values of the condition keys.
+        """
+        return self.explain(principal_id, action, resource, context).decision
+
+    def is_allowed(
+        self,
+        principal_id: str,
+        action: str,
+        resource: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        return self.evaluate(principal_id, action, resource, context) == Decision.ALLOW
+
+    def explain(
+        self,
+        principal_id: str,
+        action: str,
+        resource: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> Evaluation:
+        """Like `evaluate`, also returning the statements behind the decision."""
+        return self.explain_many(principal_id, [(action, resource, context)])[0]
+
+    def explain_many(
+        self,
+        principal_id: str,
+        requests: Iterable[Tuple[str, Optional[str], Optional[Dict[str, Any]]]],
+    ) -> List[Evaluation]:
+        """Evaluate many (action, resource, context) requests of one principal.
+
+        The principal's memo is looked up once for the whole batch, and the
+        requests it misses are evaluated action by action (see
+        `_evaluate_action`).
+        """
+        if principal_id not in self.graph.graph:
+            return [_NOT_IN_GRAPH for _ in requests]
+        decisions = self._decisions.setdefault(principal_id, {})
+        evaluations: List[Optional[Evaluation]] = []
+        # requests to evaluate, by action
+        pending: Dict[str, List[_PendingRequest]] = {}
+        positions: Dict[_DecisionKey, List[int]] = {}
+        for action, resource, context in requests:
+            context_key = _context_key(context)
+            key = (action, resource, context_key)
+            evaluation = decisions.get(key) if context_key is not None else None
+            if evaluation is None:
+                if context_key is None:
+                    pending.setdefault(action, []).append(
+                        (None, resource, context, [len(evaluations)])
+                    )
+                elif key in positions:
+                    positions[key].append(len(evaluations))
+                else:
+                    positions[key] = [len(evaluations)]
+                    pending.setdefault(action, []).append(
+                        (key, resource, context, positions[key])
+                    )
+            evaluations.append(evaluation)
+
+        for action, action_requests in pending.items():
+            action_evaluations = self._evaluate_action(
+                principal_id,
+                action,
+                [
+                    (resource, context or {})
+                    for _, resource, context, _ in action_requests
+                ],
+            )
+            for (key, _, _, indexes), evaluation in zip(
+                action_requests, action_evaluations
+            ):
+                if key is not None:
+                    decisions[key] = evaluation
+                for index in indexes:
+                    evaluations[index] = evaluation
+        return evaluations
+
+    def _evaluate_action(
+        self,
+        principal_id: str,
+        action: str,
+        requests: List[Tuple[Optional[str], Dict[str, Any]]],
+    ) -> List[Evaluation]:
+        """Evaluate (resource, context) requests of a principal for one action.
+
+        The permissions covering the action are gathered once, and the
+        conditions of each are checked against the contexts of all the
+        requests it applies to at once.
+        """
+        permissions = self.permissions_of(principal_id)
+        contexts = [context for _, context in requests]
+        # resource id -> positions of the requests on it
+        by_target: Dict[Optional[str], List[int]] = {}
+        for position, (resource, _) in enumerate(requests):
+            by_target.setdefault(resource_id(resource), []).append(position)
+        resource_permissions = {
+            target: self.resource_permissions_of(target)
+            for target in by_target
+            if target is not None
+        }
+        every_request = list(range(len(requests)))
+        allows: List[List[MatchedStatement]] = [[] for _ in requests]
+        denies: List[List[MatchedStatement]] = [[] for _ in requests]
+
+        def match(statement: MatchedStatement, applicable: List[int]):
+            permission = statement.permission
+            if permission.conditions:
+                met = permission.conditions_met_many(
+                    [contexts[position] for position in applicable]
+                )
+                applicable = [position for position, ok in zip(applicable, met) if ok]
+            matched = denies if permission.effect == Effect.DENY else allows
+            for position in applicable:
+                matched[position].append(statement)
+
+        for pattern in self.patterns_matching(action):
+            for permission, scope, holder in permissions.get(pattern, []):
+                if scope is not None:
+                    applicable = by_target.get(scope, [])
+                elif permission.not_resources:
+                    applicable = [
+                        position
+                        for position, (resource, _) in enumerate(requests)
+                        if permission.applies_to(resource)
+                    ]
+                else:
+                    applicable = every_request
+                if applicable:
+                    match(MatchedStatement(holder, permission, scope), applicable)
+            for target, target_permissions in resource_permissions.items():
+                for permission in target_permissions.get(pattern, []):
+                    if not permission.excludes_principal(principal_id):
+                        match(
+                            MatchedStatement(target, permission, target),
+                            by_target[target],
+                        )
+        return [
+            (
+                Evaluation(Decision.EXPLICIT_DENY, tuple(denied))
+                if denied
+                else (
+                    Evaluation(Decision.ALLOW, tuple(allowed))
+                    if allowed
+                    else _IMPLICIT_DENY
+                )
+            )
+            for allowed, denied in zip(allows, denies)
+        ]
+
+    def _action_matcher(self) -> ActionMatcher:
+        if self._matcher is None:
+            self._matcher = ActionMatcher()
+            for _, _, edge_data in self.graph.get_edges(["permission"]):
+                self._matcher.add(edge_data["relationship"].permission.action)
+        return self._matcher
+
+    def patterns_matching(self, action: str) -> Tuple[str, ...]:
+        """Action patterns of the graph's permissions covering an action."""
+        patterns = self._patterns.get(action)
+        if patterns is None:
+            patterns = tuple(
+                pattern.aws_action_pattern
+                for pattern in self._action_matcher().patterns_for(action)
+            )
+            self._patterns[action] = patterns
+        return patterns
+
+    def invalidate(self, principal_id: str):
+        """Forget what was memoised for a principal, or for the members of a group."""
+        self._permissions.pop(principal_id, None)
+        self._decisions.pop(principal_id, None)
+        if principal_id in self.graph.graph:
+            for member_id, _, _ in self.graph.get_incoming_edges(
+                principal_id, filter_types=[IsPartOf.type]
+            ):
+                self._permissions.pop(member_id, None)
+                self._decisions.pop(member_id, None)
+
+    def _invalidate_resource(self, invalidated_id: str):
+        """Forget a resource's permissions and every decision on that resource."""
+        self._resource_permissions.pop(invalidated_id, None)
+        for decisions in self._decisions.values():
+            for key in [
+                key for key in decisions if resource_id(key[1]) == invalidated_id
+            ]:
+                del decisions[key]
+
+    def clear(self):
+        self._permissions.clear()
+        self._decisions.clear()
+        self._resource_permissions.clear()
+        self._patterns.clear()
+        self._matcher = None
+
+    def _on_change(self, event: str, source_id: str, target_id: Optional[str]):
+        # permissions and memberships are edges from the principal (or its
+        # group, or the resource granting them), so the source of a change is
+        # all that needs forgetting
+        if event == "add_relationship":
+            self._patterns.clear()
+            if self._matcher is not None:
+                for edge_data in (
+                    self.graph.graph.get_edge_data(source_id, target_id) or {}
+                ).values():
+                    permission = getattr(edge_data["relationship"], "permission", None)
+                    if permission is not None:
+                        self._matcher.add(permission.action)
+        if event.endswith("_relationship") and source_id in self._resource_permissions:
+            self._invalidate_resource(source_id)
+        self.invalidate(source_id)
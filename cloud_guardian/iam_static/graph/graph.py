@@ -1,5 +1,16 @@
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple, Union
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import networkx as nx
 from cloud_guardian.iam_static.graph.identities.group import Group
@@ -10,6 +21,28 @@ from cloud_guardian.iam_static.graph.identities.user import User
 from cloud_guardian.iam_static.graph.relationships.relationships import Relationship
 from loguru import logger
 
+if TYPE_CHECKING:
+    from cloud_guardian.iam_static.graph.csr import CSRGraph
+
+# Called as listener(event, source_id, target_id) after every change to the
+# graph; `event` is one of "add_node", "remove_node", "add_relationship" or
+# "remove_relationship", and `target_id` is None for node events
+GraphListener = Callable[[str, str, Optional[str]], None]
+
+# (source id, target id, key) of an edge of the `nx.MultiDiGraph`
+EdgeKey = Tuple[str, str, int]
+
+# edge type -> keys of the edges of that type, in insertion order, with the
+# attribute dict networkx keeps for each
+EdgesByType = Dict[str, Dict[EdgeKey, Dict[str, Any]]]
+
+
+def _node_type(node: Union[User, Group, Role, Resource, SupportedService]) -> str:
+    node_type = node.__class__.__name__.lower()
+    if "service" in node_type:
+        node_type = "service"
+    return node_type
+
 
 @dataclass
 class IAMGraph:
@@ -19,16 +52,201 @@ class IAMGraph:
     # a `nx.MultiDiGraph` is required
     graph: nx.MultiDiGraph = field(default_factory=nx.MultiDiGraph)
 
+    # default version id of each managed policy the graph was built from
+    policy_versions: Dict[str, str] = field(default_factory=dict)
+
+    # callbacks used by derived caches to invalidate what a change touches
+    listeners: List[GraphListener] = field(
+        default_factory=list, repr=False, compare=False
+    )
+
+    # indexes answering the type-filtered queries without scanning the graph
+    # node type -> ids of the nodes of that type, in insertion order
+    _nodes_by_type: Dict[str, Dict[str, None]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _edges_by_type: EdgesByType = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # node id -> its outgoing (incoming) edges by type
+    _out_edges: Dict[str, EdgesByType] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _in_edges: Dict[str, EdgesByType] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # entity name -> ids of the nodes with that name
+    _ids_by_name: Dict[str, Dict[str, None]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # compressed sparse row view, dropped on every change
+    _csr: Optional["CSRGraph"] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        # index a graph given to the constructor
+        for node_id, node_data in self.graph.nodes(data=True):
+            self._index_node(node_id, node_data.get("type"))
+            if "instance" in node_data:
+                self._index_name(node_id, node_data["instance"].name)
+        for source_id, target_id, key, edge_data in self.graph.edges(
+            keys=True, data=True
+        ):
+            self._index_edge((source_id, target_id, key), edge_data)
+
+    def _index_node(self, node_id: str, node_type: str):
+        self._nodes_by_type.setdefault(node_type, {})[node_id] = None
+
+    def _index_name(self, node_id: str, name: str):
+        self._ids_by_name.setdefault(name, {})[node_id] = None
+
+    def _unindex_name(self, node_id: str, name: str):
+        ids = self._ids_by_name.get(name, {})
+        ids.pop(node_id, None)
+        if not ids:
+            self._ids_by_name.pop(name, None)
+
+    def _index_edge(self, edge: EdgeKey, edge_data: Dict[str, Any]):
+        source_id, target_id, _ = edge
+        edge_type = edge_data.get("type")
+        out_edges = self._out_edges.setdefault(source_id, {})
+        in_edges = self._in_edges.setdefault(target_id, {})
+        self._edges_by_type.setdefault(edge_type, {})[edge] = edge_data
+        out_edges.setdefault(edge_type, {})[edge] = edge_data
+        in_edges.setdefault(edge_type, {})[edge] = edge_data
+
+    def _unindex_edge(self, edge: EdgeKey, edge_type: str):
+        source_id, target_id, _ = edge
+        self._edges_by_type.get(edge_type, {}).pop(edge, None)
+        self._out_edges.get(source_id, {}).get(edge_type, {}).pop(edge, None)
+        self._in_edges.get(target_id, {}).get(edge_type, {}).pop(edge, None)
+
+    def _indexed_edges(
+        self, edges_by_type: EdgesByType, filter_types: Iterable[str]
+    ) -> List[Tuple[str, str, Dict]]:
+        return [
+            (source_id, target_id, edge_data)
+            for edge_type in dict.fromkeys(filter_types)
+            for (source_id, target_id, _), edge_data in edges_by_type.get(
+                edge_type, {}
+            ).items()
+        ]
+
+    def add_listener(self, listener: GraphListener):
+        """Register a callback notified after every change to the graph."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: GraphListener):
+        self.listeners.remove(listener)
+
+    def _notify(self, event: str, source_id: str, target_id: Optional[str] = None):
+        self._csr = None
+        for listener in self.listeners:
+            listener(event, source_id, target_id)
+
     def add_node(self, node: Union[User, Group, Role, Resource, SupportedService]):
         """Add a node to the graph, ensuring the node is not None."""
         if node is None:
             logger.error(f"Attempted to add a None node with ID {id}.")
             return
-        node_type = node.__class__.__name__.lower()
-        if "service" in node_type:
-            node_type = "service"
+        node_type = _node_type(node)
+        previous = self.graph.nodes.get(node.id)
+        if previous is not None:
+            if previous.get("type") != node_type:
+                self._nodes_by_type.get(previous.get("type"), {}).pop(node.id, None)
+            if "instance" in previous:
+                self._unindex_name(node.id, previous["instance"].name)
         self.graph.add_node(node.id, instance=node, type=node_type, label=node.name)
+        self._index_node(node.id, node_type)
+        self._index_name(node.id, node.name)
         logger.info(f"Adding node {node.id} of type {node_type}")
+        self._notify("add_node", node.id)
+
+    def add_many(
+        self,
+        nodes: Iterable[Union[User, Group, Role, Resource, SupportedService]],
+        relationships: Iterable[Relationship],
+    ):
+        """Add many nodes, then many relationships, at once.
+
+        The nodes and edges are added to the networkx graph and indexed in a
+        single pass, without logging each of them, so that large graphs (e.g.
+        snapshots) load quickly. Listeners are still notified of every
+        addition.
+        """
+        node_rows = []
+        for node in nodes:
+            if node.id in self.graph:
+                # replacing a node has index entries to drop
+                if self.graph.nodes[node.id]["instance"] is not node:
+                    self.add_node(node)
+                continue
+            node_data = {"instance": node, "type": _node_type(node), "label": node.name}
+            node_rows.append((node.id, node_data))
+        self.graph.add_nodes_from(node_rows)
+        for node_id, node_data in node_rows:
+            self._index_node(node_id, node_data["type"])
+            self._index_name(node_id, node_data["label"])
+
+        add_edge, get_edge_data = self.graph.add_edge, self.graph.get_edge_data
+        edge_rows = []
+        for relationship in relationships:
+            source_id = relationship.source.id
+            target_id = relationship.target.id
+            if source_id not in self.graph or target_id not in self.graph:
+                logger.error(
+                    f"Attempting to add relationship of type {relationship.type} with non-existent node: {source_id} or {target_id}"
+                )
+                continue
+            edge_type = relationship.type
+            key = add_edge(
+                source_id,
+                target_id,
+                relationship=relationship,
+                type=edge_type,
+                label=(
+                    relationship.permission.action.id
+                    if edge_type == "permission"
+                    else edge_type
+                ),
+            )
+            edge = (source_id, target_id, key)
+            self._index_edge(edge, get_edge_data(source_id, target_id, key))
+            edge_rows.append(edge)
+
+        logger.info(f"Added {len(node_rows)} nodes and {len(edge_rows)} relationships")
+        self._csr = None
+        if self.listeners:
+            for node_id, _ in node_rows:
+                self._notify("add_node", node_id)
+            for source_id, target_id, _ in edge_rows:
+                self._notify("add_relationship", source_id, target_id)
+
+    def remove_node(self, node_id: str):
+        """Remove a node and every relationship from or to it."""
+        if node_id not in self.graph:
+            logger.warning(f"Attempted to remove non-existent node {node_id}")
+            return
+        incident_edges = list(self.graph.in_edges(node_id)) + list(
+            self.graph.out_edges(node_id)
+        )
+        node_data = self.graph.nodes[node_id]
+        self._nodes_by_type.get(node_data.get("type"), {}).pop(node_id, None)
+        if "instance" in node_data:
+            self._unindex_name(node_id, node_data["instance"].name)
+        self.graph.remove_node(node_id)
+        for edges_by_type in [
+            self._out_edges.pop(node_id, {}),
+            self._in_edges.pop(node_id, {}),
+        ]:
+            for edge_type, edges in edges_by_type.items():
+                for edge in list(edges):
+                    self._unindex_edge(edge, edge_type)
+        logger.info(f"Removing node {node_id}")
+        for source_id, target_id in incident_edges:
+            self._notify("remove_relationship", source_id, target_id)
+        self._notify("remove_node", node_id)
 
     def add_relationship(self, relationship: Relationship):
         """Add a relationship to the graph."""
@@ -43,16 +261,72 @@ class IAMGraph:
             label = relationship.permission.action.id
         else:
             label = relationship.type
-        self.graph.add_edge(
+        key = self.graph.add_edge(
             source_id,
             target_id,
             relationship=relationship,
             type=relationship.type,
             label=label,
         )
+        self._index_edge(
+            (source_id, target_id, key),
+            self.graph.get_edge_data(source_id, target_id, key),
+        )
         logger.info(
             f"Adding relationship of type {relationship.type} from {source_id} to {target_id}"
         )
+        self._notify("add_relationship", source_id, target_id)
+
+    def remove_relationship(self, relationship: Relationship):
+        """Remove an edge carrying a relationship equal to `relationship`."""
+        source_id = relationship.source.id
+        target_id = relationship.target.id
+        edges = self.graph.get_edge_data(source_id, target_id) or {}
+        for key, edge_data in edges.items():
+            if edge_data["relationship"] == relationship:
+                self.graph.remove_edge(source_id, target_id, key)
+                self._unindex_edge((source_id, target_id, key), edge_data["type"])
+                logger.info(
+                    f"Removing relationship of type {relationship.type} from {source_id} to {target_id}"
+                )
+                self._notify("remove_relationship", source_id, target_id)
+                return
+        logger.warning(
+            f"Attempted to remove non-existent relationship of type {relationship.type} from {source_id} to {target_id}"
+        )
+
+    def merge(self, other: "IAMGraph"):
+        """Add all nodes and relationships of another graph to this graph."""
+        self.policy_versions.update(other.policy_versions)
+        self.add_many(
+            (node_data["instance"] for _, node_data in other.graph.nodes(data=True)),
+            (
+                edge_data["relationship"]
+                for _, _, edge_data in other.graph.edges(data=True)
+            ),
+        )
+
+    def save(self, file_path: Path):
+        """Save the graph as a binary snapshot (see `snapshot.py`)."""
+        from cloud_guardian.iam_static.graph.snapshot import save_snapshot
+
+        save_snapshot(self, file_path)
+
+    @classmethod
+    def load(cls, file_path: Path) -> "IAMGraph":
+        """Load a graph saved with `save`."""
+        from cloud_guardian.iam_static.graph.snapshot import load_snapshot
+
+        return load_snapshot(file_path)
+
+    def to_csr(self) -> "CSRGraph":
+        """Compressed sparse row view of the graph (see `csr.py`), rebuilt
+        after the graph changes."""
+        from cloud_guardian.iam_static.graph.csr import CSRGraph
+
+        if self._csr is None:
+            self._csr = CSRGraph.from_graph(self)
+        return self._csr
 
     def summary(self) -> str:
         """Return a summary of the graph: counts of each type of node and relationship."""
@@ -73,10 +347,11 @@ class IAMGraph:
         if filter_types is None:
             return list(self.graph.nodes(data=True))
         else:
+            nodes = self.graph.nodes
             return [
-                (node, data)
-                for node, data in self.graph.nodes(data=True)
-                if data.get("type") in filter_types
+                (node, nodes[node])
+                for node_type in dict.fromkeys(filter_types)
+                for node in self._nodes_by_type.get(node_type, {})
             ]
 
     def get_edges(
@@ -86,11 +361,7 @@ class IAMGraph:
         if filter_types is None:
             return list(self.graph.edges(data=True))
         else:
-            return [
-                (source, target, data)
-                for source, target, data in self.graph.edges(data=True)
-                if data.get("type") in filter_types
-            ]
+            return self._indexed_edges(self._edges_by_type, filter_types)
 
     def get_connected_nodes(
         self, node_id: str, filter_types: Optional[List[str]] = None
@@ -112,26 +383,18 @@ class IAMGraph:
         self, node_id: str, filter_types: Optional[List[str]] = None
     ) -> List[Tuple[str, str, Dict]]:
         """Get the outgoing edges of a given node with optional type filtering."""
-        outgoing_edges = self.graph.out_edges(node_id, data=True)
         if filter_types:
-            return [
-                (node_id, target, data)
-                for _, target, data in outgoing_edges
-                if data.get("type") in filter_types
-            ]
+            return self._indexed_edges(self._out_edges.get(node_id, {}), filter_types)
+        outgoing_edges = self.graph.out_edges(node_id, data=True)
         return [(node_id, target, data) for _, target, data in outgoing_edges]
 
     def get_incoming_edges(
         self, node_id: str, filter_types: Optional[List[str]] = None
     ) -> List[Tuple[str, str, Dict]]:
         """Get the incoming edges of a given node with optional type filtering."""
-        incoming_edges = self.graph.in_edges(node_id, data=True)
         if filter_types:
-            return [
-                (source, node_id, data)
-                for source, _, data in incoming_edges
-                if data.get("type") in filter_types
-            ]
+            return self._indexed_edges(self._in_edges.get(node_id, {}), filter_types)
+        incoming_edges = self.graph.in_edges(node_id, data=True)
         return [(source, node_id, data) for source, _, data in incoming_edges]
 
     def get_entity_by_id(
@@ -147,13 +410,22 @@ class IAMGraph:
         self, name: str
     ) -> Union[User, Group, Role, Resource, SupportedService]:
         """Get an entity from the graph by its name, if not unique, raise an error."""
-        nodes = [data["instance"] for _, data in self.graph.nodes(data=True) if data["instance"].name == name]
+        nodes = self.get_entities_by_name(name)
         if len(nodes) == 0:
             raise ValueError(f"No entity with name {name} found in the graph")
         elif len(nodes) > 1:
             raise ValueError(f"Multiple entities with name {name} found in the graph")
         return nodes[0]
 
+    def get_entities_by_name(
+        self, name: str
+    ) -> List[Union[User, Group, Role, Resource, SupportedService]]:
+        """Get every entity of the graph with a given name."""
+        nodes = self.graph.nodes
+        return [
+            nodes[node_id]["instance"] for node_id in self._ids_by_name.get(name, {})
+        ]
+
     def get_identities(
         self, filter_types: Optional[List[str]] = None
     ) -> List[Union[User, Group, Role, Resource]]:
@@ -1,4 +1,18 @@
+import re
+from bisect import bisect_left
 from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from cloud_guardian.utils.arn import (
+    arn_matches,
+    compile_wildcard,
+    has_wildcard,
+    parse_arn,
+)
+
+# Leading fields of an ARN (partition, service, region, account) matched one
+# by one; the resource field that follows is split on "/"
+_FIELDS = 4
 
 
 @dataclass
@@ -37,20 +51,163 @@ class Resource:
         return self.arn
 
 
+def _segments(arn: str) -> List[str]:
+    parsed = parse_arn(arn)
+    return [
+        parsed.partition,
+        parsed.service,
+        parsed.region,
+        parsed.account,
+    ] + parsed.resource.split("/")
+
+
+class _ArnTrieNode:
+    __slots__ = ("children", "wildcards", "values", "_keys")
+
+    def __init__(self):
+        # literal segment -> node, and segment containing wildcards -> node
+        self.children: Dict[str, "_ArnTrieNode"] = {}
+        self.wildcards: Dict[str, "_ArnTrieNode"] = {}
+        # (ARN or pattern, value) stored at this node
+        self.values: List[Tuple[str, Any]] = []
+        self._keys: Optional[List[str]] = None
+
+    def keys_with_prefix(self, prefix: str) -> List[str]:
+        """Literal child segments starting with `prefix`, by bisection."""
+        if self._keys is None:
+            self._keys = sorted(self.children)
+        keys = []
+        for index in range(bisect_left(self._keys, prefix), len(self._keys)):
+            if not self._keys[index].startswith(prefix):
+                break
+            keys.append(self._keys[index])
+        return keys
+
+    def subtree_values(self) -> List[Tuple[str, Any]]:
+        values, stack = [], [self]
+        while stack:
+            node = stack.pop()
+            values.extend(node.values)
+            stack.extend(node.children.values())
+            stack.extend(node.wildcards.values())
+        return values
+
+
+class ArnIndex:
+    """Trie over the segments of ARNs and ARN patterns.
+
+    Keys are split into the partition, service, region and account fields
+    and the "/"-separated parts of the resource field. Literal segments are
+    looked up directly, so a lookup only visits the branches its literal
+    segments lead to; a wildcard in the resource field can span "/", so the
+    subtree under it is checked with `arn_matches`.
+    """
+
+    def __init__(self):
+        self._root = _ArnTrieNode()
+
+    def add(self, key: str, value: Any):
+        node = self._root
+        for segment in _segments(key):
+            children = node.wildcards if has_wildcard(segment) else node.children
+            child = children.get(segment)
+            if child is None:
+                child = children[segment] = _ArnTrieNode()
+                node._keys = None
+            node = child
+        node.values.append((key, value))
+
+    def remove(self, key: str, value: Any):
+        node = self._root
+        for segment in _segments(key):
+            children = node.wildcards if has_wildcard(segment) else node.children
+            node = children.get(segment)
+            if node is None:
+                return
+        if (key, value) in node.values:
+            node.values.remove((key, value))
+
+    def matching(self, pattern: str) -> List[Any]:
+        """Values of the ARNs covered by an ARN pattern."""
+        segments = _segments(pattern)
+        candidates: List[Tuple[str, Any]] = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == len(segments):
+                candidates.extend(node.values)
+                continue
+            segment = segments[depth]
+            if not has_wildcard(segment):
+                child = node.children.get(segment)
+                if child is not None:
+                    stack.append((child, depth + 1))
+            elif depth < _FIELDS:
+                stack.extend(
+                    (child, depth + 1)
+                    for key, child in node.children.items()
+                    if compile_wildcard(segment).fullmatch(key)
+                )
+            else:
+                prefix = re.split(r"[*?]", segment, maxsplit=1)[0]
+                for key in node.keys_with_prefix(prefix):
+                    candidates.extend(node.children[key].subtree_values())
+        return [value for key, value in candidates if arn_matches(pattern, key)]
+
+    def covering(self, arn: str) -> List[Any]:
+        """Values of the ARN patterns (or equal ARNs) covering an ARN."""
+        segments = _segments(arn)
+        candidates: List[Tuple[str, Any]] = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == len(segments):
+                candidates.extend(node.values)
+            else:
+                child = node.children.get(segments[depth])
+                if child is not None:
+                    stack.append((child, depth + 1))
+            for key, child in node.wildcards.items():
+                if depth >= _FIELDS:
+                    candidates.extend(child.subtree_values())
+                elif depth < len(segments) and compile_wildcard(key).fullmatch(
+                    segments[depth]
+                ):
+                    stack.append((child, depth + 1))
+        return [value for key, value in candidates if arn_matches(key, arn)]
+
+
 class ResourceFactory:
     _instances = {}
+    # ARN index of every resource created
+    index = ArnIndex()
 
     @classmethod
     def get_or_create(cls, name, arn, service, resource_type):
         if arn not in cls._instances:
-            cls._instances[arn] = Resource(
-                name=name,
-                arn=arn,
-                service=service,
-                resource_type=resource_type,
+            cls.register(
+                Resource(
+                    name=name,
+                    arn=arn,
+                    service=service,
+                    resource_type=resource_type,
+                )
             )
         return cls._instances[arn]
 
+    @classmethod
+    def register(cls, resource: Resource) -> Resource:
+        """Make a resource built elsewhere (e.g. in another process) known."""
+        if resource.arn not in cls._instances:
+            cls._instances[resource.arn] = resource
+            cls.index.add(resource.arn, resource)
+        return cls._instances[resource.arn]
+
+    @classmethod
+    def matching(cls, pattern: str) -> List[Resource]:
+        """Resources whose ARN is covered by an ARN pattern."""
+        return cls.index.matching(pattern)
+
     @classmethod
     def from_dict(cls, resource_dict):
         name = resource_dict["ResourceName"]
@@ -1,11 +1,54 @@
-from cloud_guardian.iam_static.graph.analyzers_to_remove import connect_graph
+import json
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import unquote
+
+from cloud_guardian import logger
 from cloud_guardian.iam_static.graph.graph import IAMGraph
-from cloud_guardian.iam_static.graph.identities.group import GroupFactory
-from cloud_guardian.iam_static.graph.identities.role import RoleFactory
-from cloud_guardian.iam_static.graph.identities.services import ServiceFactory
-from cloud_guardian.iam_static.graph.identities.user import UserFactory
-from cloud_guardian.utils.loaders import load_iam_data_into_dictionaries
-from zipp import Path
+from cloud_guardian.iam_static.graph.identities.group import Group, GroupFactory
+from cloud_guardian.iam_static.graph.identities.resources import (
+    ArnIndex,
+    Resource,
+    ResourceFactory,
+)
+from cloud_guardian.iam_static.graph.identities.role import Role, RoleFactory
+from cloud_guardian.iam_static.graph.identities.services import (
+    ServiceFactory,
+    SupportedService,
+)
+from cloud_guardian.iam_static.graph.identities.user import User, UserFactory
+from cloud_guardian.iam_static.graph.permission.catalogue import (
+    precompute_expansions,
+)
+from cloud_guardian.iam_static.graph.permission.document import (
+    PolicyDocument,
+    StatementPermissions,
+    _as_list,
+    _as_list_of_statements,
+    statement_permissions,
+)
+from cloud_guardian.iam_static.graph.permission.normalization import (
+    normalize_statements,
+)
+from cloud_guardian.iam_static.graph.permission.permission import (
+    Permission,
+    PermissionFactory,
+)
+from cloud_guardian.iam_static.graph.relationships.relationships import (
+    CanAssumeRole,
+    HasPermission,
+    HasPermissionToResource,
+    IsPartOf,
+)
+from cloud_guardian.utils.arn import is_arn, parse_arn
+from cloud_guardian.utils.loaders import (
+    stream_authorization_details,
+    stream_iam_records,
+)
 
 
 def initialize_factories(groups_data, policies_data, roles_data, users_data):
@@ -38,13 +81,562 @@ def initialize_factories(groups_data, policies_data, roles_data, users_data):
     #         ResourceFactory.from_dict(statement["Resource"])
 
 
-def create_graph(data_folder: Path) -> IAMGraph:
-    print(data_folder)
-    groups_data, policies_data, roles_data, users_data = (
-        load_iam_data_into_dictionaries(data_folder)
+Identity = Union[User, Group, Role]
+
+
+def _record_arn(record: Dict[str, Any], arn_key: str) -> str:
+    """ARN of a record in either the original (`*Arn`) or processed (`ID`) format."""
+    return record.get(arn_key) or record["ID"]
+
+
+def _principal_arns(
+    principal: Union[str, Dict[str, Any]],
+) -> Tuple[List[str], List[str]]:
+    """Split a policy `Principal` element into (identity ARNs, service principals)."""
+    if isinstance(principal, str):
+        return [principal], []
+    arns = _as_list(principal.get("AWS")) + _as_list(principal.get("ID"))
+    return arns, _as_list(principal.get("Service"))
+
+
+def _resource_from_arn(arn: str) -> Optional[Resource]:
+    """Get or create the resource node an ARN refers to (S3 objects map to their bucket).
+
+    Returns None for ARN patterns that do not name a single resource.
+    """
+    if not is_arn(arn):
+        return None
+    parsed = parse_arn(arn)
+    if parsed.service == "s3":
+        if "*" in parsed.bucket or "?" in parsed.bucket:
+            return None
+        return ResourceFactory.get_or_create(
+            name=parsed.bucket,
+            arn=f"arn:{parsed.partition}:s3:::{parsed.bucket}",
+            service="s3",
+            resource_type="bucket",
+        )
+    if parsed.is_wildcard:
+        return None
+    return ResourceFactory.get_or_create(
+        name=parsed.name,
+        arn=arn,
+        service=parsed.service,
+        resource_type=parsed.resource_type,
+    )
+
+
+def _resource_pattern(arn: str) -> Optional[str]:
+    """Pattern over resource node ids of an ARN pattern (S3 patterns match buckets).
+
+    Returns None for values that name a single resource node, such as
+    `arn:aws:s3:::bucket/*`, and for values that are not ARNs.
+    """
+    if not is_arn(arn) or not parse_arn(arn).is_wildcard:
+        return None
+    parsed = parse_arn(arn)
+    if parsed.service == "s3":
+        if "*" not in parsed.bucket and "?" not in parsed.bucket:
+            return None
+        return f"arn:{parsed.partition}:s3:::{parsed.bucket}"
+    return arn
+
+
+def _decode_policy_document(policy_document: Union[str, Dict[str, Any]]) -> Dict:
+    """Policy documents returned by the IAM API are URL-encoded JSON strings."""
+    if isinstance(policy_document, str):
+        return json.loads(unquote(policy_document))
+    return policy_document
+
+
+def _lazy_policy_document(
+    policy_document: Union[str, Dict[str, Any], PolicyDocument],
+) -> PolicyDocument:
+    """Keep a policy document as raw JSON, without building its permissions."""
+    if isinstance(policy_document, PolicyDocument):
+        return policy_document
+    if isinstance(policy_document, str):
+        return PolicyDocument.from_json(unquote(policy_document))
+    return PolicyDocument.from_dict(policy_document)
+
+
+def _link_relationship(
+    source: Identity, relationship_type: str, target: Identity
+) -> Union[IsPartOf, CanAssumeRole]:
+    if relationship_type == IsPartOf.type:
+        return IsPartOf(source, target)
+    return CanAssumeRole(source, target)
+
+
+def _create_date(record: Dict[str, Any]) -> Optional[datetime]:
+    """Creation date of a dump record (ISO string) or an API response (datetime)."""
+    create_date = record.get("CreateDate")
+    if isinstance(create_date, str):
+        return datetime.fromisoformat(create_date)
+    return create_date
+
+
+@dataclass
+class GraphBuilder:
+    """Builds an IAMGraph incrementally, one IAM record at a time.
+
+    References to entities that have not been seen yet (a policy attached before
+    it is defined, a group member or a trusted principal defined later) are kept
+    pending and resolved as soon as the referenced entity is added.
+    """
+
+    graph: IAMGraph = field(default_factory=IAMGraph)
+    # policy ARN -> document of the policy, materialised when first attached
+    policies: Dict[str, PolicyDocument] = field(default_factory=dict)
+    _pending_policies: Dict[str, List[Identity]] = field(
+        default_factory=lambda: defaultdict(list)
     )
+    # node ARN -> relationships waiting for that node, as (type, other node)
+    _pending_nodes: Dict[str, List[Tuple[str, Identity]]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+    # group members referenced by group name (authorization details only)
+    _groups_by_name: Dict[str, Group] = field(default_factory=dict)
+    _pending_members: Dict[str, List[User]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+    # resource ARN patterns -> (identity, permission) granted on the resources
+    # they cover, including those added to the graph later on
+    _wildcard_grants: ArnIndex = field(default_factory=ArnIndex)
+
+    def add_record(self, kind: str, record: Dict[str, Any]):
+        """Dispatch a record yielded by one of the `cloud_guardian.utils.loaders` streams."""
+        handlers = {
+            "policy": self.add_policy,
+            "user": self.add_user,
+            "group": self.add_group,
+            "role": self.add_role,
+            "resource_policy": self.add_resource_policy,
+            "user_detail": self.add_user_detail,
+            "group_detail": self.add_group_detail,
+            "role_detail": self.add_role_detail,
+            "managed_policy": self.add_managed_policy,
+        }
+        handlers[kind](record)
+
+    def add_records(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        for kind, record in records:
+            self.add_record(kind, record)
+
+    def add_policy(self, policy_data: Dict[str, Any]):
+        """Register the permissions of an identity-based policy."""
+        policy_arn = _record_arn(policy_data, "PolicyArn")
+        self.add_policy_document(policy_arn, policy_data["PolicyDocument"])
+
+    def add_policy_document(
+        self,
+        policy_arn: str,
+        policy_document: Union[str, Dict[str, Any], PolicyDocument],
+    ):
+        """Register a policy; its permissions are built when it is first attached."""
+        document = _lazy_policy_document(policy_document)
+        self.policies[policy_arn] = document
+        for identity in self._pending_policies.pop(policy_arn, []):
+            self._connect_policy(identity, document.statement_permissions)
+
+    def add_user(self, user_data: Dict[str, Any]) -> User:
+        user = UserFactory.from_dict(user_data)
+        self._add_identity(user, user_data)
+        return user
+
+    def add_group(self, group_data: Dict[str, Any]) -> Group:
+        group = GroupFactory.from_dict(group_data)
+        self._add_identity(group, group_data)
+        for user_data in group_data.get("Users", []):
+            self._link(_record_arn(user_data, "UserArn"), IsPartOf.type, group)
+        return group
+
+    def add_role(self, role_data: Dict[str, Any]) -> Role:
+        role = RoleFactory.from_dict(role_data)
+        self._add_identity(role, role_data)
+        self.add_trust_policy(role, role_data.get("AssumeRolePolicyDocument", {}))
+        return role
+
+    def add_trust_policy(self, role: Role, trust_policy: Dict[str, Any]):
+        """Connect the principals allowed to assume `role`."""
+        for statement in _as_list_of_statements(trust_policy):
+            if statement.get("Effect") != "Allow":
+                continue
+            if "NotPrincipal" in statement:
+                # would need an edge from every principal but the listed ones
+                logger.warning(f"Skipping NotPrincipal trust statement of {role.id}")
+                continue
+            arns, services = _principal_arns(statement.get("Principal", {}))
+            for arn in arns:
+                self._link(arn, CanAssumeRole.type, role)
+            for service_principal in services:
+                try:
+                    service = ServiceFactory.get_or_create(service_principal)
+                except ValueError as e:
+                    logger.warning(f"Skipping trust of role {role.id}: {e}")
+                    continue
+                self.graph.add_node(service)
+                self.graph.add_relationship(CanAssumeRole(service, role))
+
+    def add_resource_policy(self, policy_data: Dict[str, Any]):
+        """Connect the principals of a resource-based policy to its resources."""
+        for statement in normalize_statements(
+            _as_list_of_statements(policy_data["PolicyDocument"])
+        ):
+            permissions = PermissionFactory.from_policy_document(
+                {"Statement": [statement]}
+            )
+            resources = {}
+            for arn in _as_list(statement.get("Resource")):
+                resource = _resource_from_arn(arn)
+                if resource is not None:
+                    resources[resource.id] = resource
+            for resource in resources.values():
+                self._add_resource(resource)
+            arns, _ = _principal_arns(statement.get("Principal", {}))
+            if "NotPrincipal" in statement or "*" in arns:
+                # granted to every principal but those of the permissions'
+                # `not_principals`: kept on the resource itself
+                for resource in resources.values():
+                    for permission in permissions:
+                        self.graph.add_relationship(
+                            HasPermission(resource, None, permission)
+                        )
+                arns = [arn for arn in arns if arn != "*"]
+            for arn in arns:
+                principal = self.graph.get_entity_by_id(arn)
+                if principal is None:
+                    logger.warning(f"Unknown principal {arn} in resource-based policy")
+                    continue
+                for resource in resources.values():
+                    for permission in permissions:
+                        self.graph.add_relationship(
+                            HasPermissionToResource(principal, resource, permission)
+                        )
+
+    def add_user_detail(self, user_detail: Dict[str, Any]) -> User:
+        """Add a `UserDetailList` entry of an authorization details dump."""
+        user = UserFactory.get_or_create(
+            name=user_detail["UserName"],
+            arn=user_detail["Arn"],
+            create_date=_create_date(user_detail),
+        )
+        self._add_identity_detail(user, user_detail, "UserPolicyList")
+        for group_name in user_detail.get("GroupList", []):
+            group = self._groups_by_name.get(group_name)
+            if group is None:
+                self._pending_members[group_name].append(user)
+            else:
+                self.graph.add_relationship(IsPartOf(user, group))
+        return user
+
+    def add_group_detail(self, group_detail: Dict[str, Any]) -> Group:
+        """Add a `GroupDetailList` entry of an authorization details dump."""
+        group = GroupFactory.get_or_create(
+            name=group_detail["GroupName"],
+            arn=group_detail["Arn"],
+            create_date=_create_date(group_detail),
+        )
+        self._add_identity_detail(group, group_detail, "GroupPolicyList")
+        self._groups_by_name[group.name] = group
+        for user in self._pending_members.pop(group.name, []):
+            self.graph.add_relationship(IsPartOf(user, group))
+        return group
+
+    def add_role_detail(self, role_detail: Dict[str, Any]) -> Role:
+        """Add a `RoleDetailList` entry of an authorization details dump."""
+        role = RoleFactory.get_or_create(
+            name=role_detail["RoleName"],
+            arn=role_detail["Arn"],
+            create_date=_create_date(role_detail),
+        )
+        self._add_identity_detail(role, role_detail, "RolePolicyList")
+        trust_policy = role_detail.get("AssumeRolePolicyDocument", {})
+        self.add_trust_policy(role, _decode_policy_document(trust_policy))
+        return role
 
-    initialize_factories(groups_data, policies_data, roles_data, users_data)
+    def add_managed_policy(self, policy_detail: Dict[str, Any]):
+        """Add a `Policies` entry of an authorization details dump.
+
+        Only the default version grants permissions; its id is kept in
+        the graph's `policy_versions`.
+        """
+        policy_arn = policy_detail["Arn"]
+        default_version_id = policy_detail.get("DefaultVersionId")
+        for version in policy_detail.get("PolicyVersionList", []):
+            if version.get("IsDefaultVersion") or (
+                version.get("VersionId") == default_version_id
+            ):
+                self.graph.policy_versions[policy_arn] = version.get("VersionId")
+                self.add_policy_document(policy_arn, version["Document"])
+                return
+        logger.warning(f"Policy {policy_arn} has no default version")
+
+    def _add_identity_detail(
+        self, identity: Identity, detail: Dict[str, Any], inline_policies_key: str
+    ):
+        self._add_identity(identity, detail)
+        for inline_policy in detail.get(inline_policies_key, []):
+            policy_document = _decode_policy_document(inline_policy["PolicyDocument"])
+            self.connect_policy_document(identity, policy_document)
+        for policy in detail.get("AttachedManagedPolicies", []):
+            self.attach_policy(identity, policy["PolicyArn"])
+
+    def unresolved(self) -> Dict[str, List[Tuple[str, Identity]]]:
+        """References to entities that were never added, keyed by their ARN."""
+        return dict(self._pending_nodes)
+
+    def finish(self, cache_dir: Optional[Path] = None) -> IAMGraph:
+        """Return the graph, reporting references that could not be resolved.
+
+        With a `cache_dir`, the action patterns seen are expanded over the
+        catalogue up front, reusing and updating the expansions cached there.
+        """
+        for arn in self._pending_policies:
+            logger.warning(f"Policy {arn} is attached but was never defined")
+        for name in self._pending_members:
+            logger.warning(f"Group {name} has members but was never defined")
+        for arn, links in self._pending_nodes.items():
+            logger.warning(
+                f"{len(links)} relationship(s) refer to unknown entity {arn}"
+            )
+        if cache_dir is not None:
+            precompute_expansions(cache_dir=cache_dir)
+        return self.graph
+
+    def _add_identity(self, identity: Identity, record: Dict[str, Any]):
+        self.graph.add_node(identity)
+        for relationship_type, other in self._pending_nodes.pop(identity.id, []):
+            self._add_link(identity, relationship_type, other)
+        for policy in record.get("AttachedPolicies", []):
+            self.attach_policy(identity, _record_arn(policy, "PolicyArn"))
+
+    def connect_policy_document(
+        self, identity: Identity, policy_document: Dict[str, Any]
+    ):
+        """Give an identity the permissions of an (inline) policy document."""
+        self._connect_policy(identity, statement_permissions(policy_document))
+
+    def attach_policy(self, identity: Identity, policy_arn: str):
+        """Attach a policy to an identity, or defer it until the policy is known."""
+        if policy_arn in self.policies:
+            self._connect_policy(
+                identity, self.policies[policy_arn].statement_permissions
+            )
+        else:
+            self._pending_policies[policy_arn].append(identity)
+
+    def _connect_policy(
+        self, identity: Identity, statements: Iterable[StatementPermissions]
+    ):
+        for resource_arns, permissions in statements:
+            if "*" in resource_arns:
+                for permission in permissions:
+                    self.graph.add_relationship(
+                        HasPermission(identity, None, permission)
+                    )
+                continue
+            for arn in resource_arns:
+                pattern = _resource_pattern(arn)
+                if pattern is not None:
+                    self._connect_pattern(identity, pattern, permissions)
+                    continue
+                resource = ResourceFactory._instances.get(arn)
+                resource = resource or _resource_from_arn(arn)
+                if resource is None:
+                    continue
+                self._add_resource(resource)
+                for permission in permissions:
+                    self.graph.add_relationship(
+                        HasPermissionToResource(identity, resource, permission)
+                    )
+
+    def _connect_pattern(
+        self, identity: Identity, pattern: str, permissions: List[Permission]
+    ):
+        """Grant permissions on the resources of the graph a pattern covers."""
+        for permission in permissions:
+            self._wildcard_grants.add(pattern, (identity, permission))
+        for resource in ResourceFactory.matching(pattern):
+            if resource.id not in self.graph.graph:
+                continue
+            for permission in permissions:
+                self.graph.add_relationship(
+                    HasPermissionToResource(identity, resource, permission)
+                )
+
+    def _add_resource(self, resource: Resource):
+        """Add a resource node, with the permissions wildcard grants give on it."""
+        if resource.id in self.graph.graph:
+            return
+        self.graph.add_node(resource)
+        for identity, permission in self._wildcard_grants.covering(resource.id):
+            self.graph.add_relationship(
+                HasPermissionToResource(identity, resource, permission)
+            )
+
+    def _link(self, source_arn: str, relationship_type: str, target: Identity):
+        """Add a relationship from `source_arn`, deferring it if the source is unknown."""
+        source = self.graph.get_entity_by_id(source_arn)
+        if source is None:
+            self._pending_nodes[source_arn].append((relationship_type, target))
+        else:
+            self._add_link(source, relationship_type, target)
+
+    def _add_link(self, source: Identity, relationship_type: str, target: Identity):
+        self.graph.add_relationship(
+            _link_relationship(source, relationship_type, target)
+        )
+
+
+def create_graph_from_authorization_details(
+    paths: Union[Path, Iterable[Path]], cache_dir: Optional[Path] = None
+) -> IAMGraph:
+    """Build an IAMGraph from `aws iam get-account-authorization-details` output.
+
+    `paths` can be a single dump, a folder of paginated dumps or a list of both.
+    Every page is read once, and references across pages are resolved as the
+    referenced users, groups, roles and policies appear. See
+    `GraphBuilder.finish` for `cache_dir`.
+    """
+    builder = GraphBuilder()
+    builder.add_records(stream_authorization_details(paths))
+    return builder.finish(cache_dir)
+
+
+def _account_id(arn: str) -> str:
+    """Account id of an ARN, or the value itself if it is a bare account id."""
+    return parse_arn(arn).account if is_arn(arn) else arn
+
+
+def _is_account_principal(arn: str) -> bool:
+    """Whether a trust policy principal designates a whole account."""
+    return arn.isdigit() or (arn.startswith("arn:") and arn.endswith(":root"))
+
+
+def _build_account_graph(
+    account_folder: Path,
+) -> Tuple[IAMGraph, Dict[str, List[Tuple[str, Identity]]]]:
+    """Build the partial graph of one account, with its unresolved references."""
+    account_folder = Path(account_folder)
+    builder = GraphBuilder()
+    if (account_folder / "users.json").exists():
+        builder.add_records(stream_iam_records(account_folder))
+    else:
+        builder.add_records(stream_authorization_details(account_folder))
+    return builder.graph, builder.unresolved()
+
+
+def _register_instance(
+    node: Union[Identity, Resource, SupportedService],
+) -> Union[Identity, Resource, SupportedService]:
+    """Make a node built in a worker process known to this process' factories.
+
+    Returns the factory's instance, which is not `node` when another account
+    already built a node with the same id (e.g. an S3 bucket).
+    """
+    factories = {
+        User: UserFactory,
+        Group: GroupFactory,
+        Role: RoleFactory,
+    }
+    if isinstance(node, Resource):
+        return ResourceFactory.register(node)
+    factory = factories.get(type(node), ServiceFactory)
+    return factory._instances.setdefault(node.id, node)
+
+
+def _register_account_graph(account_graph: IAMGraph):
+    """Make the nodes and permissions of a graph built in a worker process known
+    to this process' factories.
+
+    Nodes and permissions (and their actions and conditions) are re-interned:
+    a node or permission that was already built here, e.g. by another account,
+    replaces the worker's copy both in the graph and at the ends of its edges.
+    """
+    instances = {}
+    for node_id, node_data in account_graph.graph.nodes(data=True):
+        instance = _register_instance(node_data["instance"])
+        node_data["instance"] = instances[node_id] = instance
+    for _, _, edge_data in account_graph.graph.edges(data=True):
+        relationship = edge_data["relationship"]
+        relationship.source = instances[relationship.source.id]
+        relationship.target = instances[relationship.target.id]
+        if getattr(relationship, "permission", None) is not None:
+            relationship.permission = PermissionFactory.register(
+                relationship.permission
+            )
+
+
+def create_multi_account_graph(
+    account_folders: Iterable[Path],
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+) -> IAMGraph:
+    """Build a single IAMGraph out of many account folders, in parallel.
+
+    Each folder holds either the groups/policies/roles/users.json layout or
+    authorization details dumps. Folders are ingested in a process pool, one
+    partial graph per account, and merged here. Trust relationships pointing to
+    principals of another account are resolved on the merged graph; trusting an
+    account (its root or bare id) lets every user and role of that account
+    assume the role. See `GraphBuilder.finish` for `cache_dir`.
+    """
     graph = IAMGraph()
-    connect_graph(graph, groups_data, policies_data, roles_data, users_data)
+    unresolved: Dict[str, List[Tuple[str, Identity]]] = defaultdict(list)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for account_graph, account_unresolved in executor.map(
+            _build_account_graph, account_folders
+        ):
+            _register_account_graph(account_graph)
+            graph.merge(account_graph)
+            for arn, links in account_unresolved.items():
+                unresolved[arn].extend(links)
+
+    principals_by_account: Dict[str, List[Identity]] = defaultdict(list)
+    for _, node_data in graph.get_nodes(filter_types=["user", "role"]):
+        principal = node_data["instance"]
+        principals_by_account[_account_id(principal.id)].append(principal)
+
+    resolved = set()
+    for arn, links in unresolved.items():
+        source = graph.get_entity_by_id(arn)
+        if source is not None:
+            sources = [source]
+        elif _is_account_principal(arn):
+            sources = principals_by_account.get(_account_id(arn), [])
+        else:
+            logger.warning(
+                f"{len(links)} relationship(s) refer to unknown entity {arn}"
+            )
+            continue
+        for relationship_type, target in links:
+            for source in sources:
+                # a principal can be trusted both by ARN and through its account
+                if (source.id, target.id, relationship_type) in resolved:
+                    continue
+                resolved.add((source.id, target.id, relationship_type))
+                graph.add_relationship(
+                    _link_relationship(source, relationship_type, target)
+                )
+
+    if cache_dir is not None:
+        precompute_expansions(
+            {
+                relationship.permission.action.aws_action_pattern
+                for relationship in graph.get_relationships(filter_types=["permission"])
+            },
+            cache_dir=cache_dir,
+        )
     return graph
+
+
+def create_graph(data_folder: Path, cache_dir: Optional[Path] = None) -> IAMGraph:
+    """Build an IAMGraph from a groups/policies/roles/users.json folder.
+
+    Records are streamed and fed to the factories and the graph one at a time.
+    See `GraphBuilder.finish` for `cache_dir`.
+    """
+    builder = GraphBuilder()
+    builder.add_records(stream_iam_records(data_folder))
+    return builder.finish(cache_dir)
@@ -0,0 +1,170 @@
+"""
+Principal x action bit matrix of effective permissions.
+
+Each principal (user, group or role) has one row of allow bits and one row of
+deny bits over the action catalogue, packed 64 actions per `uint64` word.
+Users inherit the rows of their groups by a vectorised OR, and a principal
+can perform an action when its allow bit is set and its deny bit is not.
+
+The matrix abstracts away resources and conditions, over-approximating
+what a principal can do: an Allow counts whatever its resource or
+conditions, while a Deny only counts when it applies to every resource
+unconditionally.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.permission.actions import ActionsFactory
+from cloud_guardian.iam_static.graph.permission.catalogue import use_catalogue
+from cloud_guardian.iam_static.graph.permission.effects import Effect
+from cloud_guardian.iam_static.graph.relationships.relationships import (
+    HasPermission,
+    IsPartOf,
+)
+
+PRINCIPAL_TYPES = ["user", "group", "role"]
+
+_WORD_BITS = 64
+
+
+def _words(action_count: int) -> int:
+    return (action_count + _WORD_BITS - 1) // _WORD_BITS
+
+
+def _bit(index: int):
+    return index // _WORD_BITS, np.uint64(1) << np.uint64(index % _WORD_BITS)
+
+
+@dataclass
+class PermissionMatrix:
+    principals: List[str]
+    actions: List[str]
+    # (principals, words) packed bits, after inheritance from groups
+    allow: np.ndarray
+    deny: np.ndarray
+    principal_index: Dict[str, int] = field(init=False, repr=False)
+    action_index: Dict[str, int] = field(init=False, repr=False)
+    _masks: Dict[str, np.ndarray] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.principal_index = {
+            principal: index for index, principal in enumerate(self.principals)
+        }
+        self.action_index = {action: index for index, action in enumerate(self.actions)}
+        self._masks = {}
+
+    @classmethod
+    def from_graph(
+        cls, graph: IAMGraph, actions: Optional[List[str]] = None
+    ) -> "PermissionMatrix":
+        """Build the matrix of every principal of `graph`.
+
+        `actions` defaults to the bundled action catalogue.
+        """
+        if actions is None:
+            use_catalogue()
+            actions = ActionsFactory.matcher.catalogue
+        principals = [node for node, _ in graph.get_nodes(PRINCIPAL_TYPES)]
+        shape = (len(principals), _words(len(actions)))
+        matrix = cls(
+            principals=principals,
+            actions=actions,
+            allow=np.zeros(shape, dtype=np.uint64),
+            deny=np.zeros(shape, dtype=np.uint64),
+        )
+
+        # rows granted each pattern, so that each pattern is ORed in once
+        allowed: Dict[str, List[int]] = defaultdict(list)
+        denied: Dict[str, List[int]] = defaultdict(list)
+        for row, principal in enumerate(principals):
+            for relationship in graph.get_relationships_from_node(
+                principal, filter_types=["permission"]
+            ):
+                permission = relationship.permission
+                pattern = permission.action.aws_action_pattern
+                if permission.effect == Effect.ALLOW:
+                    allowed[pattern].append(row)
+                elif isinstance(relationship, HasPermission) and not (
+                    permission.conditions or permission.not_resources
+                ):
+                    denied[pattern].append(row)
+        for bits, rows_by_pattern in [(matrix.allow, allowed), (matrix.deny, denied)]:
+            for pattern, rows in rows_by_pattern.items():
+                bits[np.unique(rows)] |= matrix.mask(pattern)
+
+        members, groups = [], []
+        for source, target, _ in graph.get_edges([IsPartOf.type]):
+            if source in matrix.principal_index and target in matrix.principal_index:
+                members.append(matrix.principal_index[source])
+                groups.append(matrix.principal_index[target])
+        if members:
+            members, groups = np.array(members), np.array(groups)
+            # read the group rows before any OR, so inheritance is one level deep
+            group_allow, group_deny = matrix.allow[groups], matrix.deny[groups]
+            np.bitwise_or.at(matrix.allow, members, group_allow)
+            np.bitwise_or.at(matrix.deny, members, group_deny)
+        return matrix
+
+    def mask(self, pattern: str) -> np.ndarray:
+        """Packed bits of the catalogue actions covered by an action pattern."""
+        mask = self._masks.get(pattern)
+        if mask is None:
+            mask = np.zeros(self.allow.shape[1], dtype=np.uint64)
+            indexes = np.array(
+                [
+                    self.action_index[action]
+                    for action in ActionsFactory.expand(pattern)
+                    if action in self.action_index
+                ],
+                dtype=np.uint64,
+            )
+            np.bitwise_or.at(
+                mask,
+                (indexes // _WORD_BITS).astype(np.intp),
+                np.left_shift(np.uint64(1), indexes % _WORD_BITS),
+            )
+            self._masks[pattern] = mask
+        return mask
+
+    def effective(self, principal: str) -> np.ndarray:
+        row = self.principal_index[principal]
+        return self.allow[row] & ~self.deny[row]
+
+    def can(self, principal: str, action: str) -> bool:
+        """Whether `principal` may perform `action` (on some resource)."""
+        row = self.principal_index.get(principal)
+        column = self.action_index.get(action)
+        if row is None or column is None:
+            return False
+        word, bit = _bit(column)
+        return bool(self.allow[row, word] & ~self.deny[row, word] & bit)
+
+    def actions_of(self, principal: str) -> List[str]:
+        """Every catalogue action `principal` may perform."""
+        bits = np.unpackbits(
+            self.effective(principal).view(np.uint8), bitorder="little"
+        )
+        return [
+            self.actions[index] for index in np.flatnonzero(bits[: len(self.actions)])
+        ]
+
+    def principals_with(self, action: str) -> List[str]:
+        """Every principal that may perform `action`."""
+        column = self.action_index.get(action)
+        if column is None:
+            return []
+        word, bit = _bit(column)
+        rows = np.flatnonzero(self.allow[:, word] & ~self.deny[:, word] & bit)
+        return [self.principals[row] for row in rows]
+
+    def principals_with_any(self, patterns: Iterable[str]) -> List[str]:
+        """Every principal that may perform at least one action of the patterns."""
+        mask = np.zeros(self.allow.shape[1], dtype=np.uint64)
+        for pattern in patterns:
+            mask |= self.mask(pattern)
+        rows = np.flatnonzero(((self.allow & ~self.deny) & mask).any(axis=1))
+        return [self.principals[row] for row in rows]
@@ -1,24 +1,35 @@
 import re
+from bisect import bisect_left
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+from cloud_guardian.utils.arn import compile_wildcard, has_wildcard, wildcard_regex
+
+# Prefix of the patterns standing for the complement of a `NotAction` list,
+# e.g. "!iam:*,organizations:*"; AWS action names never contain "!" or ","
+NOT_ACTION_PREFIX = "!"
 
 
 @dataclass
 class SpecifiedActions:
     aws_action_pattern: str
     _regex_pattern: str = field(init=False, repr=False)
+    _regex: re.Pattern = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
         # Convert the AWS action pattern to a regular expression pattern.
-        # This involves escaping special characters in regex, replacing "*" with ".*" to match any sequence of characters.
-        escaped_pattern = re.escape(self.aws_action_pattern).replace(r"\*", ".*")
-        self._regex_pattern = f"^{escaped_pattern}$"
+        # This involves escaping special characters in regex, replacing "*" with ".*" to match any sequence of characters
+        # and "?" with "." to match a single one.
+        self._regex_pattern = f"^{wildcard_regex(self.aws_action_pattern)}$"
+        # Compiled once, as thousands of patterns overflow the `re` module cache;
+        # IAM action names are case-insensitive
+        self._regex = compile_wildcard(self.aws_action_pattern, ignore_case=True)
 
     def matches(self, action: str) -> bool:
         """
         Checks if a given action matches the specified AWS action pattern using a regex.
         """
-        match_found = re.fullmatch(self._regex_pattern, action) is not None
+        match_found = self._regex.fullmatch(action) is not None
         return match_found
 
     def find_matching_actions(self, actions: List[str]) -> List[str]:
@@ -36,8 +47,217 @@ class SpecifiedActions:
         return self.aws_action_pattern
 
 
+@dataclass
+class ExcludedActions(SpecifiedActions):
+    """Every action except those covered by the patterns of a `NotAction` list."""
+
+    excluded: Tuple[SpecifiedActions, ...] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.excluded = tuple(
+            ActionsFactory.get_or_create(pattern)
+            for pattern in excluded_patterns(self.aws_action_pattern)
+        )
+
+    def matches(self, action: str) -> bool:
+        return not any(pattern.matches(action) for pattern in self.excluded)
+
+
+def not_action_pattern(patterns: Iterable[str]) -> str:
+    """Pattern standing for every action not covered by `patterns`."""
+    return NOT_ACTION_PREFIX + ",".join(sorted(set(patterns)))
+
+
+def excluded_patterns(aws_action_pattern: str) -> List[str]:
+    """Patterns excluded by a `not_action_pattern`, empty for other patterns."""
+    if not aws_action_pattern.startswith(NOT_ACTION_PREFIX):
+        return []
+    return aws_action_pattern[len(NOT_ACTION_PREFIX) :].split(",")
+
+
+@dataclass(frozen=True)
+class ActionSet:
+    """A set of catalogue actions, or the complement of one.
+
+    Complements keep only the actions they exclude, so the action set of a
+    `NotAction` list stays as small as the list itself and unions,
+    intersections and membership tests never enumerate the catalogue.
+    """
+
+    actions: FrozenSet[str] = frozenset()
+    complement: bool = False
+
+    def __contains__(self, action: str) -> bool:
+        return (action in self.actions) != self.complement
+
+    def __invert__(self) -> "ActionSet":
+        return ActionSet(self.actions, not self.complement)
+
+    def __or__(self, other: "ActionSet") -> "ActionSet":
+        if not self.complement and not other.complement:
+            return ActionSet(self.actions | other.actions)
+        if self.complement and other.complement:
+            return ActionSet(self.actions & other.actions, True)
+        included, excluded = (other, self) if self.complement else (self, other)
+        return ActionSet(excluded.actions - included.actions, True)
+
+    def __and__(self, other: "ActionSet") -> "ActionSet":
+        return ~(~self | ~other)
+
+    def __sub__(self, other: "ActionSet") -> "ActionSet":
+        return self & ~other
+
+    def is_empty(self) -> bool:
+        return not self.complement and not self.actions
+
+
+class _TrieNode:
+    __slots__ = ("children", "patterns")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.patterns: List[SpecifiedActions] = []
+
+
+def _split_action(action: str) -> Tuple[str, str]:
+    """Split `service:Name` into its service prefix and name ("*" has no prefix)."""
+    service, separator, name = action.partition(":")
+    if not separator:
+        return "", action
+    return service, name
+
+
+def _action_key(action: str) -> Tuple[str, str]:
+    """`_split_action` of an action or pattern, in the case the index is keyed by."""
+    return _split_action(action.lower())
+
+
+class ActionMatcher:
+    """
+    Index over action patterns and over a catalogue of concrete actions.
+
+    Patterns are indexed by service prefix, each prefix holding a trie of the
+    action name patterns in which "*" and "?" are wildcard edges. Patterns whose
+    service prefix is itself a wildcard (such as "*") are kept aside and
+    checked against every action. Catalogue actions are kept sorted by service
+    so that a pattern expands by a range lookup on its literal prefix.
+
+    Action names are case-insensitive in IAM: the tries and the catalogue are
+    keyed by lowercased prefixes and names, and expansions return the
+    catalogue's own spelling.
+    """
+
+    def __init__(self):
+        self._tries: Dict[str, _TrieNode] = {}
+        self._wildcard_services: List[SpecifiedActions] = []
+        self._patterns: Set[str] = set()
+        # lowercased service prefix -> sorted actions of the catalogue
+        self._catalogue: Dict[str, List[str]] = {}
+        # lowercased service prefix -> (lowercased name, action), sorted
+        self._catalogue_keys: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(self, pattern: SpecifiedActions):
+        if pattern.aws_action_pattern in self._patterns:
+            return
+        self._patterns.add(pattern.aws_action_pattern)
+        service, name = _action_key(pattern.aws_action_pattern)
+        if not service or has_wildcard(service) or isinstance(pattern, ExcludedActions):
+            self._wildcard_services.append(pattern)
+            return
+        node = self._tries.setdefault(service, _TrieNode())
+        for char in name:
+            node = node.children.setdefault(char, _TrieNode())
+        node.patterns.append(pattern)
+
+    def clear_actions(self):
+        self._catalogue = {}
+        self._catalogue_keys = {}
+
+    def add_actions(self, actions: Iterable[str]):
+        """Add concrete actions (e.g. `s3:GetObject`) to the catalogue."""
+        added = set()
+        for action in actions:
+            service, _ = _action_key(action)
+            self._catalogue.setdefault(service, []).append(action)
+            added.add(service)
+        for service in added:
+            self._catalogue[service] = sorted(set(self._catalogue[service]))
+            self._catalogue_keys[service] = sorted(
+                (_action_key(action)[1], action) for action in self._catalogue[service]
+            )
+
+    @property
+    def catalogue(self) -> List[str]:
+        return [
+            action
+            for _, actions in sorted(self._catalogue.items())
+            for action in actions
+        ]
+
+    def patterns_for(self, action: str) -> List[SpecifiedActions]:
+        """Every known pattern that covers `action`."""
+        matches = [
+            pattern for pattern in self._wildcard_services if pattern.matches(action)
+        ]
+        service, name = _action_key(action)
+        root = self._tries.get(service)
+        if root is None:
+            return matches
+
+        # (trie node, position in name) states still to explore
+        stack = [(root, 0)]
+        seen = set()
+        while stack:
+            node, position = stack.pop()
+            if (id(node), position) in seen:
+                continue
+            seen.add((id(node), position))
+            star = node.children.get("*")
+            if star is not None:
+                # "*" consumes any number of characters, including none
+                stack.extend((star, end) for end in range(position, len(name) + 1))
+            if position == len(name):
+                matches.extend(node.patterns)
+            else:
+                child = node.children.get(name[position])
+                if child is not None:
+                    stack.append((child, position + 1))
+                # "?" consumes exactly one character
+                any_char = node.children.get("?")
+                if any_char is not None:
+                    stack.append((any_char, position + 1))
+        return matches
+
+    def expand(self, pattern: SpecifiedActions) -> List[str]:
+        """Every catalogue action covered by `pattern`."""
+        service_pattern, name_pattern = _action_key(pattern.aws_action_pattern)
+        if not service_pattern or has_wildcard(service_pattern):
+            return [action for action in self.catalogue if pattern.matches(action)]
+
+        keys = self._catalogue_keys.get(service_pattern, [])
+        prefix = re.split(r"[*?]", name_pattern, maxsplit=1)[0]
+        expanded = []
+        for index in range(bisect_left(keys, (prefix,)), len(keys)):
+            name, action = keys[index]
+            if not name.startswith(prefix) or (
+                # no wildcard: the names equal to the pattern come first
+                prefix == name_pattern
+                and name != name_pattern
+            ):
+                break
+            if pattern.matches(action):
+                expanded.append(action)
+        return sorted(expanded)
+
+
 class ActionsFactory:
     _instances = {}
+    matcher = ActionMatcher()
+    # action pattern -> catalogue actions it covers
+    _expansions: Dict[str, Tuple[str, ...]] = {}
 
     @classmethod
     def get_or_create(cls, aws_action_pattern: str) -> SpecifiedActions:
@@ -45,5 +265,87 @@ class ActionsFactory:
         Retrieves an existing SpecifiedActions object for the given action pattern or creates a new one if it does not exist.
         """
         if aws_action_pattern not in cls._instances:
-            cls._instances[aws_action_pattern] = SpecifiedActions(aws_action_pattern)
+            if aws_action_pattern.startswith(NOT_ACTION_PREFIX):
+                actions = ExcludedActions(aws_action_pattern)
+            else:
+                actions = SpecifiedActions(aws_action_pattern)
+            cls._instances[aws_action_pattern] = actions
+            cls.matcher.add(actions)
         return cls._instances[aws_action_pattern]
+
+    @classmethod
+    def register(cls, actions: SpecifiedActions) -> SpecifiedActions:
+        """Make actions built elsewhere (e.g. in another process) known, returning
+        the instance of this process for their pattern."""
+        if actions.aws_action_pattern not in cls._instances:
+            if isinstance(actions, ExcludedActions):
+                actions.excluded = tuple(
+                    cls.register(pattern) for pattern in actions.excluded
+                )
+            cls._instances[actions.aws_action_pattern] = actions
+            cls.matcher.add(actions)
+        return cls._instances[actions.aws_action_pattern]
+
+    @classmethod
+    def get_or_create_excluded(
+        cls, aws_action_patterns: Iterable[str]
+    ) -> SpecifiedActions:
+        """Actions of a `NotAction` list: every action not covered by the patterns."""
+        return cls.get_or_create(not_action_pattern(aws_action_patterns))
+
+    @classmethod
+    def patterns_matching(cls, action: str) -> List[SpecifiedActions]:
+        """Every known action pattern that covers `action`."""
+        return cls.matcher.patterns_for(action)
+
+    @classmethod
+    def set_catalogue(cls, actions: Iterable[str]):
+        """Replace the catalogue of concrete actions that patterns expand to."""
+        cls.matcher.clear_actions()
+        cls.matcher.add_actions(actions)
+        cls._expansions = {}
+
+    @classmethod
+    def expand(cls, aws_action_pattern: str) -> Tuple[str, ...]:
+        """Every catalogue action covered by an action pattern (memoized)."""
+        expansion = cls._expansions.get(aws_action_pattern)
+        if expansion is None:
+            excluded = excluded_patterns(aws_action_pattern)
+            if excluded:
+                excluded_actions = cls.action_set(aws_action_pattern).actions
+                expansion = tuple(
+                    action
+                    for action in cls.matcher.catalogue
+                    if action not in excluded_actions
+                )
+            else:
+                actions = cls.get_or_create(aws_action_pattern)
+                expansion = tuple(cls.matcher.expand(actions))
+            cls._expansions[aws_action_pattern] = expansion
+        return expansion
+
+    @classmethod
+    def action_set(cls, aws_action_pattern: str) -> ActionSet:
+        """Catalogue actions covered by a pattern, as a (possibly complemented) set."""
+        excluded = excluded_patterns(aws_action_pattern)
+        if excluded:
+            return ActionSet(
+                frozenset(
+                    action for pattern in excluded for action in cls.expand(pattern)
+                ),
+                complement=True,
+            )
+        return ActionSet(frozenset(cls.expand(aws_action_pattern)))
+
+    @classmethod
+    def is_expanded(cls, aws_action_pattern: str) -> bool:
+        return aws_action_pattern in cls._expansions
+
+    @classmethod
+    def expansions(cls) -> Dict[str, Tuple[str, ...]]:
+        return dict(cls._expansions)
+
+    @classmethod
+    def add_expansions(cls, expansions: Dict[str, Tuple[str, ...]]):
+        """Add expansions computed earlier (e.g. loaded from a disk cache)."""
+        cls._expansions.update(expansions)
@@ -0,0 +1,328 @@
+"""
+Offline catalogue of AWS service actions.
+
+The catalogue is bundled in `data/catalogue/aws_actions.json.gz` and lists,
+for every service prefix, its actions (with their access level, resource
+types and condition keys), its resource types (with their ARN format) and its
+condition keys (with their type). It is regenerated from the IAM definition
+shipped by policy_sentry with:
+
+    pip download --no-deps policy_sentry
+    unzip policy_sentry-*.whl policy_sentry/shared/data/iam-definition.json
+    python -m cloud_guardian.iam_static.graph.permission.catalogue \\
+        policy_sentry/shared/data/iam-definition.json --source policy_sentry-<version>
+
+On request (see `GraphBuilder.finish`), wildcard expansions of the action
+patterns met during ingestion are computed up front and cached on disk, by
+default next to the other outputs, keyed by the catalogue version.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cloud_guardian import logger
+from cloud_guardian.iam_static.graph.permission.actions import (
+    ActionsFactory,
+    excluded_patterns,
+)
+from cloud_guardian.utils.shared import data_path, output_path
+
+CATALOGUE_PATH = data_path / "catalogue" / "aws_actions.json.gz"
+
+EXPANSIONS_CACHE_PATH = output_path / "cache"
+
+# Bump when the layout of the catalogue file changes
+CATALOGUE_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ActionInfo:
+    service: str
+    name: str
+    access_level: str
+    resource_types: Tuple[str, ...]
+    condition_keys: Tuple[str, ...]
+
+    @property
+    def id(self) -> str:
+        return f"{self.service}:{self.name}"
+
+
+@dataclass
+class ServiceInfo:
+    prefix: str
+    name: str
+    actions: Dict[str, ActionInfo]
+    # resource type -> ARN format
+    resource_types: Dict[str, str]
+    # condition key -> value type
+    condition_keys: Dict[str, str]
+
+
+class ActionCatalogue:
+    def __init__(self, version: str, services: Dict[str, ServiceInfo]):
+        self.version = version
+        self.services = services
+
+    @classmethod
+    def from_dict(cls, catalogue_dict: Dict) -> "ActionCatalogue":
+        if catalogue_dict.get("format") != CATALOGUE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported catalogue format {catalogue_dict.get('format')}"
+            )
+        services = {}
+        for prefix, service in catalogue_dict["services"].items():
+            services[prefix] = ServiceInfo(
+                prefix=prefix,
+                name=service["name"],
+                actions={
+                    name: ActionInfo(
+                        service=prefix,
+                        name=name,
+                        access_level=access_level,
+                        resource_types=tuple(resource_types),
+                        condition_keys=tuple(condition_keys),
+                    )
+                    for name, (
+                        access_level,
+                        resource_types,
+                        condition_keys,
+                    ) in service["actions"].items()
+                },
+                resource_types=service["resource_types"],
+                condition_keys=service["condition_keys"],
+            )
+        return cls(catalogue_dict["version"], services)
+
+    def to_dict(self) -> Dict:
+        return {
+            "format": CATALOGUE_FORMAT_VERSION,
+            "version": self.version,
+            "services": {
+                prefix: {
+                    "name": service.name,
+                    "actions": {
+                        name: [
+                            action.access_level,
+                            list(action.resource_types),
+                            list(action.condition_keys),
+                        ]
+                        for name, action in sorted(service.actions.items())
+                    },
+                    "resource_types": dict(sorted(service.resource_types.items())),
+                    "condition_keys": dict(sorted(service.condition_keys.items())),
+                }
+                for prefix, service in sorted(self.services.items())
+            },
+        }
+
+    @classmethod
+    def load(cls, file_path: Path = CATALOGUE_PATH) -> "ActionCatalogue":
+        with gzip.open(file_path, "rt") as file:
+            return cls.from_dict(json.load(file))
+
+    def save(self, file_path: Path = CATALOGUE_PATH):
+        os.makedirs(Path(file_path).parent, exist_ok=True)
+        # mtime=0 keeps the file byte-identical across regenerations
+        with open(file_path, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb", mtime=0) as file:
+                file.write(json.dumps(self.to_dict(), separators=(",", ":")).encode())
+
+    def __iter__(self) -> Iterator[ActionInfo]:
+        for service in self.services.values():
+            yield from service.actions.values()
+
+    def __len__(self) -> int:
+        return sum(len(service.actions) for service in self.services.values())
+
+    def __contains__(self, action: str) -> bool:
+        return self.get(action) is not None
+
+    def get(self, action: str) -> Optional[ActionInfo]:
+        """Catalogue entry of an action, whatever the case of its name."""
+        return self._actions_by_key.get(action.lower())
+
+    @cached_property
+    def _actions_by_key(self) -> Dict[str, ActionInfo]:
+        return {action.id.lower(): action for action in self}
+
+    def action_ids(self) -> List[str]:
+        return [action.id for action in self]
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Short hash of the action names, identifying cached expansions."""
+        digest = hashlib.sha256(self.version.encode())
+        for action in sorted(self.action_ids()):
+            digest.update(action.encode())
+        return digest.hexdigest()[:16]
+
+
+_catalogue: Optional[ActionCatalogue] = None
+
+
+def get_catalogue() -> ActionCatalogue:
+    """The bundled catalogue, loaded on first use."""
+    global _catalogue
+    if _catalogue is None:
+        _catalogue = ActionCatalogue.load()
+        logger.info(
+            f"Loaded {len(_catalogue)} actions of catalogue {_catalogue.version}"
+        )
+    return _catalogue
+
+
+# catalogue whose actions `ActionsFactory` currently expands patterns to
+_active: Optional[ActionCatalogue] = None
+
+
+def use_catalogue(catalogue: Optional[ActionCatalogue] = None) -> ActionCatalogue:
+    """Make `ActionsFactory` expand patterns over the catalogue's actions."""
+    global _active
+    catalogue = catalogue or get_catalogue()
+    if catalogue is not _active:
+        ActionsFactory.set_catalogue(catalogue.action_ids())
+        _active = catalogue
+    return catalogue
+
+
+def _expansions_file(catalogue: ActionCatalogue, cache_dir: Path) -> Path:
+    return Path(cache_dir) / f"expansions-{catalogue.fingerprint}.json"
+
+
+def load_expansions(catalogue: ActionCatalogue, cache_dir: Path) -> int:
+    """Load cached expansions into `ActionsFactory`; returns how many were loaded."""
+    try:
+        with open(_expansions_file(catalogue, cache_dir), "r") as file:
+            cached = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+    actions = catalogue.action_ids()
+    ActionsFactory.add_expansions(
+        {
+            pattern: tuple(actions[index] for index in indexes)
+            for pattern, indexes in cached.items()
+        }
+    )
+    return len(cached)
+
+
+def save_expansions(catalogue: ActionCatalogue, cache_dir: Path):
+    """Write every expansion computed so far, as indexes into the catalogue."""
+    index = {action: position for position, action in enumerate(catalogue.action_ids())}
+    # complements of NotAction lists are derived from the patterns they exclude
+    expansions = {
+        pattern: [index[action] for action in actions if action in index]
+        for pattern, actions in sorted(ActionsFactory.expansions().items())
+        if not excluded_patterns(pattern)
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = _expansions_file(catalogue, cache_dir)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(expansions, file, separators=(",", ":"))
+    os.replace(tmp_path, file_path)
+
+
+def precompute_expansions(
+    patterns: Optional[Iterable[str]] = None,
+    cache_dir: Path = EXPANSIONS_CACHE_PATH,
+) -> int:
+    """Expand action patterns over the catalogue, reusing and updating the disk cache.
+
+    Defaults to every pattern known to `ActionsFactory`. Returns the number
+    of patterns that had to be expanded.
+    """
+    catalogue = use_catalogue()
+    if patterns is None:
+        patterns = list(ActionsFactory._instances)
+    patterns = [
+        expanded
+        for pattern in patterns
+        for expanded in excluded_patterns(pattern) or [pattern]
+    ]
+    missing = [
+        pattern for pattern in patterns if not ActionsFactory.is_expanded(pattern)
+    ]
+    if missing and load_expansions(catalogue, cache_dir):
+        missing = [
+            pattern for pattern in missing if not ActionsFactory.is_expanded(pattern)
+        ]
+    for pattern in missing:
+        ActionsFactory.expand(pattern)
+    if missing:
+        save_expansions(catalogue, cache_dir)
+    if missing:
+        logger.info(f"Expanded {len(missing)} new action pattern(s)")
+    return len(missing)
+
+
+def _action_condition_keys(privilege: Dict) -> List[str]:
+    keys = set()
+    for resource_type in privilege.get("resource_types", {}).values():
+        keys.update(resource_type.get("condition_keys", []))
+    return sorted(keys)
+
+
+def from_iam_definition(iam_definition: Dict, version: str) -> ActionCatalogue:
+    """Convert policy_sentry's `iam-definition.json` into a catalogue."""
+    services = {}
+    for prefix, service in sorted(iam_definition.items()):
+        if not isinstance(service, dict) or "privileges" not in service:
+            continue
+        services[prefix] = ServiceInfo(
+            prefix=prefix,
+            name=service["service_name"],
+            actions={
+                name: ActionInfo(
+                    service=prefix,
+                    name=name,
+                    access_level=privilege.get("access_level", ""),
+                    resource_types=tuple(
+                        sorted(
+                            resource_type
+                            for resource_type in privilege.get("resource_types", {})
+                            if resource_type
+                        )
+                    ),
+                    condition_keys=tuple(_action_condition_keys(privilege)),
+                )
+                for name, privilege in service["privileges"].items()
+            },
+            resource_types={
+                name: resource.get("arn", "")
+                for name, resource in service.get("resources", {}).items()
+            },
+            condition_keys={
+                name: condition.get("type", "")
+                for name, condition in service.get("conditions", {}).items()
+            },
+        )
+    return ActionCatalogue(version, services)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerate the action catalogue.")
+    parser.add_argument("iam_definition", type=Path, help="iam-definition.json")
+    parser.add_argument(
+        "--source", required=True, help="where the definition comes from"
+    )
+    parser.add_argument("--output", type=Path, default=CATALOGUE_PATH)
+    args = parser.parse_args()
+
+    with open(args.iam_definition, "r") as file:
+        iam_definition = json.load(file)
+    schema = iam_definition.get("policy_sentry_schema_version", "unknown")
+    catalogue = from_iam_definition(iam_definition, f"{args.source} ({schema})")
+    catalogue.save(args.output)
+    logger.info(
+        f"Wrote {len(catalogue)} actions of {len(catalogue.services)} services"
+        f" to {args.output}"
+    )
@@ -1,111 +1,379 @@
+"""
+IAM condition operators.
+
+An operator name is a base operator (e.g. `StringLike`), optionally prefixed
+by a set qualifier (`ForAllValues:` or `ForAnyValue:`) and suffixed by
+`IfExists`. Each (operator, key, value) of a `Condition` block is one
+condition, whose value is compiled once when it is built.
+
+A condition whose key is missing from the request context is met only by
+`...IfExists` and negated operators, by `ForAllValues` and by `Null` checks
+expecting the key to be missing.
+"""
+
 import hashlib
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Any, Union
+import operator
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from ipaddress import ip_address, ip_network
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from cloud_guardian.iam_static.graph.exceptions import ConditionNotSupported
+from cloud_guardian.utils.arn import arn_regex, wildcard_regex
+
+# Number of distinct runtime IP addresses whose parsed form is kept
+_PARSE_CACHE_SIZE = 4096
+
+SET_QUALIFIERS = ("ForAllValues", "ForAnyValue")
+
+_IF_EXISTS = "IfExists"
+
+# comparison -> (reduction of the condition values to a single bound,
+# comparison of the runtime value to that bound)
+_ORDERINGS = {
+    "LessThan": (max, operator.lt),
+    "LessThanEquals": (max, operator.le),
+    "GreaterThan": (min, operator.gt),
+    "GreaterThanEquals": (min, operator.ge),
+}
+
+
+def _values(condition_value: Any) -> List[Any]:
+    """Values of a condition, any of which may match."""
+    if isinstance(condition_value, list):
+        return condition_value
+    return [condition_value]
+
+
+def _is_in(value: Any, values: frozenset) -> bool:
+    return value in values
+
+
+def _never(value: Any, bound: Any) -> bool:
+    return False
+
+
+def split_operator(condition_operator: str) -> Tuple[Optional[str], str, bool]:
+    """Split an operator into its set qualifier, base operator and `IfExists` flag."""
+    qualifier, _, base = condition_operator.rpartition(":")
+    if_exists = base.endswith(_IF_EXISTS) and base != _IF_EXISTS
+    if if_exists:
+        base = base[: -len(_IF_EXISTS)]
+    return qualifier or None, base, if_exists
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _parse_ip(value: str):
+    return ip_address(value)
+
+
+def _parse_date(value: Union[str, int, float, datetime]) -> datetime:
+    """Parse an ISO 8601 date (UTC unless it says otherwise) or epoch timestamp;
+    datetimes are taken as they are, naive ones as UTC."""
+    if isinstance(value, datetime):
+        date = value
+    elif isinstance(value, (int, float)) or str(value).isdigit():
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    else:
+        date = datetime.fromisoformat(str(value))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
 
 
 @dataclass(frozen=True)
 class SupportedCondition:
     id: str
-    condition_value: Union[str, list, dict]
+    # not hashed, as it may be a list
+    condition_value: Union[str, list, dict] = field(hash=False)
     condition_key: str
     condition_operator: str
     value_type: str
+    # condition value parsed once, when the condition is built
+    _compiled: Any = field(default=None, init=False, repr=False, compare=False)
+    _qualifier: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _negated: bool = field(default=False, init=False, repr=False, compare=False)
+    _if_missing: bool = field(default=False, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        qualifier, base, if_exists = split_operator(self.condition_operator)
+        negated = "Not" in base
+        object.__setattr__(self, "_qualifier", qualifier)
+        object.__setattr__(self, "_negated", negated)
+        object.__setattr__(
+            self, "_if_missing", if_exists or negated or qualifier == "ForAllValues"
+        )
+        object.__setattr__(self, "_compiled", self.compile())
 
     def __str__(self):
         return f"{self.condition_key} {self.condition_operator} {self.condition_value}"
 
+    @property
+    def base_operator(self) -> str:
+        return split_operator(self.condition_operator)[1]
+
+    def compile(self) -> Any:
+        """Parse the condition value into the typed form used by `matches`."""
+        return self.condition_value
+
+    def matches(self, runtime_value: Any) -> bool:
+        """Whether a single runtime value matches one of the condition values,
+        ignoring negation and set qualifiers."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
     def evaluate(self, runtime_value: Any) -> bool:
+        """Whether the condition is met by the value of its key (None if missing)."""
+        if runtime_value is None or runtime_value == []:
+            return self._if_missing
+        if self._qualifier is None and not isinstance(runtime_value, list):
+            return self.matches(runtime_value) != self._negated
+        values = runtime_value if isinstance(runtime_value, list) else [runtime_value]
+        if self._qualifier == "ForAllValues":
+            return all(self.matches(value) != self._negated for value in values)
+        if self._qualifier == "ForAnyValue":
+            return any(self.matches(value) != self._negated for value in values)
+        return any(self.matches(value) for value in values) != self._negated
+
+    def evaluate_many(self, runtime_values: Iterable[Any]) -> List[bool]:
+        """Evaluate the condition against a batch of runtime values.
+
+        Each distinct value is evaluated once.
+        """
+        outcomes: Dict[Any, bool] = {}
+        results = []
+        for runtime_value in runtime_values:
+            key = (
+                tuple(runtime_value)
+                if isinstance(runtime_value, list)
+                else runtime_value
+            )
+            try:
+                outcome = outcomes.get(key)
+            except TypeError:
+                # unhashable values (e.g. nested lists) are not shared
+                results.append(self.evaluate(runtime_value))
+                continue
+            if outcome is None:
+                outcome = self.evaluate(runtime_value)
+                outcomes[key] = outcome
+            results.append(outcome)
+        return results
+
+
+class StringCondition(SupportedCondition):
+    def compile(self) -> Any:
+        base = self.base_operator
+        values = [str(value) for value in _values(self.condition_value)]
+        ignore_case = base.endswith("IgnoreCase")
+        if base.endswith("Like"):
+            regex = "|".join(wildcard_regex(value) for value in values)
+            return ignore_case, re.compile(regex)
+        if ignore_case:
+            values = [value.lower() for value in values]
+        return ignore_case, frozenset(values)
+
+    def matches(self, runtime_value: Any) -> bool:
+        ignore_case, values = self._compiled
+        value = str(runtime_value)
+        if ignore_case:
+            value = value.lower()
+        if isinstance(values, frozenset):
+            return value in values
+        return values.fullmatch(value) is not None
+
+
+class ArnCondition(SupportedCondition):
+    # ArnEquals and ArnLike both accept wildcards
+    def compile(self) -> re.Pattern:
+        return re.compile(
+            "|".join(arn_regex(str(value)) for value in _values(self.condition_value))
+        )
+
+    def matches(self, runtime_value: Any) -> bool:
+        return self._compiled.fullmatch(str(runtime_value)) is not None
+
+
+class _OrderedCondition(SupportedCondition):
+    """Conditions comparing parsed values: equality or ordering."""
+
+    family: str = ""
+
+    @staticmethod
+    def parse(value: Any) -> Any:
         raise NotImplementedError("Subclasses must implement this method.")
 
+    def compile(self) -> Tuple[Callable[[Any, Any], bool], Any]:
+        comparison = self.base_operator[len(self.family) :]
+        values = [self.parse(value) for value in _values(self.condition_value)]
+        if comparison in _ORDERINGS:
+            if not values:
+                # no value to be lower or greater than
+                return _never, None
+            reduce, compare = _ORDERINGS[comparison]
+            # e.g. lower than any of the values is lower than the highest one
+            return compare, reduce(values)
+        return _is_in, frozenset(values)
 
-@dataclass(frozen=True)
-class DateGreaterThan(SupportedCondition):
-    condition_value: str
-    condition_key: str = "aws:CurrentTime"
-    condition_operator: str = "DateGreaterThan"
-    value_type: str = "Date"
+    def matches(self, runtime_value: Any) -> bool:
+        try:
+            parsed = self.parse(runtime_value)
+        except (TypeError, ValueError):
+            return False
+        compare, bound = self._compiled
+        return compare(parsed, bound)
 
-    def evaluate(self, runtime_value: str) -> bool:
-        condition_date = datetime.fromisoformat(self.condition_value)
-        runtime_date = datetime.fromisoformat(runtime_value)
-        return runtime_date > condition_date
 
+class NumericCondition(_OrderedCondition):
+    family = "Numeric"
 
-@dataclass(frozen=True)
-class DateLessThan(SupportedCondition):
-    condition_value: str
-    condition_key: str = "aws:CurrentTime"
-    condition_operator: str = "DateLessThan"
-    value_type: str = "Date"
+    @staticmethod
+    def parse(value: Any) -> float:
+        return float(value)
 
-    def evaluate(self, runtime_value: str) -> bool:
-        condition_date = datetime.fromisoformat(self.condition_value)
-        runtime_date = datetime.fromisoformat(runtime_value)
-        return runtime_date < condition_date
 
+class DateCondition(_OrderedCondition):
+    family = "Date"
 
-@dataclass(frozen=True)
-class IpAddress(SupportedCondition):
-    condition_value: Union[str, list]
-    condition_key: str = "aws:SourceIp"
-    condition_operator: str = "IpAddress"
-    value_type: str = "IPAddress"
-
-    def evaluate(self, runtime_value: str) -> bool:
-        from ipaddress import ip_address, ip_network
-
-        if isinstance(self.condition_value, list):
-            return any(
-                ip_address(runtime_value) in ip_network(ip)
-                for ip in self.condition_value
-            )
-        return ip_address(runtime_value) in ip_network(self.condition_value)
+    @staticmethod
+    def parse(value: Any) -> datetime:
+        return _parse_date(value)
+
+
+class BoolCondition(SupportedCondition):
+    def compile(self) -> frozenset:
+        return frozenset(str(value).lower() for value in _values(self.condition_value))
+
+    def matches(self, runtime_value: Any) -> bool:
+        return str(runtime_value).lower() in self._compiled
+
+
+class BinaryCondition(SupportedCondition):
+    # base64 encoded values, compared as they are
+    def compile(self) -> frozenset:
+        return frozenset(str(value) for value in _values(self.condition_value))
+
+    def matches(self, runtime_value: Any) -> bool:
+        return str(runtime_value) in self._compiled
+
+
+class IpAddressCondition(SupportedCondition):
+    def compile(self) -> tuple:
+        return tuple(
+            ip_network(value, strict=False) for value in _values(self.condition_value)
+        )
+
+    def matches(self, runtime_value: Any) -> bool:
+        try:
+            address = _parse_ip(runtime_value)
+        except ValueError:
+            return False
+        return any(address in network for network in self._compiled)
+
+
+class NullCondition(SupportedCondition):
+    # whether the key is expected to be missing
+    def compile(self) -> bool:
+        return str(_values(self.condition_value)[0]).lower() == "true"
+
+    def evaluate(self, runtime_value: Any) -> bool:
+        return (runtime_value is None or runtime_value == []) == self._compiled
 
 
 class ConditionFactory:
     _instances = {}
+    # base operator -> condition class
     _condition_map = {
-        "DateGreaterThan": DateGreaterThan,
-        "IpAddress": IpAddress,
-        "DateLessThan": DateLessThan,
+        **{
+            f"String{operator_name}": StringCondition
+            for operator_name in [
+                "Equals",
+                "NotEquals",
+                "EqualsIgnoreCase",
+                "NotEqualsIgnoreCase",
+                "Like",
+                "NotLike",
+            ]
+        },
+        **{
+            f"{family}{comparison}": condition_class
+            for family, condition_class in [
+                ("Numeric", NumericCondition),
+                ("Date", DateCondition),
+            ]
+            for comparison in ["Equals", "NotEquals", *_ORDERINGS]
+        },
+        **{
+            f"Arn{operator_name}": ArnCondition
+            for operator_name in ["Equals", "Like", "NotEquals", "NotLike"]
+        },
+        "Bool": BoolCondition,
+        "BinaryEquals": BinaryCondition,
+        "IpAddress": IpAddressCondition,
+        "NotIpAddress": IpAddressCondition,
+        "Null": NullCondition,
+    }
+    _value_types = {
+        StringCondition: "String",
+        ArnCondition: "ARN",
+        NumericCondition: "Numeric",
+        DateCondition: "Date",
+        BoolCondition: "Boolean",
+        BinaryCondition: "Binary",
+        IpAddressCondition: "IPAddress",
+        NullCondition: "Null",
     }
 
     @classmethod
-    def from_dict(cls, condition_dict):
+    def from_dict(cls, condition_dict) -> SupportedCondition:
+        """The condition of a block holding a single operator and key."""
         condition_type, details = next(iter(condition_dict.items()))
-        if condition_type not in cls._condition_map:
+        condition_key, value = next(iter(details.items()))
+        return cls.get_or_create(condition_type, condition_key, value)
+
+    @classmethod
+    def from_block(
+        cls, condition_block: Dict[str, Dict[str, Any]]
+    ) -> List[SupportedCondition]:
+        """Every condition of a `Condition` block, all of which must be met."""
+        return [
+            cls.get_or_create(condition_type, condition_key, value)
+            for condition_type, details in condition_block.items()
+            for condition_key, value in details.items()
+        ]
+
+    @classmethod
+    def get_or_create(
+        cls, condition_type: str, condition_key: str, value: Any
+    ) -> SupportedCondition:
+        qualifier, base, _ = split_operator(condition_type)
+        condition_class = cls._condition_map.get(base)
+        if condition_class is None or (
+            qualifier is not None and qualifier not in SET_QUALIFIERS
+        ):
             raise ConditionNotSupported(condition_type)
 
-        condition_key, value = next(iter(details.items()))
         condition_id = cls._create_id(condition_type, condition_key, value)
-
         if condition_id not in cls._instances:
-            condition_class = cls._condition_map[condition_type]
             condition_instance = condition_class(
                 id=condition_id,
                 condition_key=condition_key,
                 condition_operator=condition_type,
                 condition_value=value,
-                value_type=cls._infer_type(value),
+                value_type=cls._value_types[condition_class],
             )
             cls._instances[condition_id] = condition_instance
         return cls._instances[condition_id]
 
+    @classmethod
+    def register(cls, condition: SupportedCondition) -> SupportedCondition:
+        """Make a condition built elsewhere (e.g. in another process) known."""
+        return cls._instances.setdefault(condition.id, condition)
+
     @staticmethod
     def _create_id(condition_type, condition_key, value):
         combined = f"{condition_type}{condition_key}{value}"
         return hashlib.sha256(combined.encode()).hexdigest()
-
-    @staticmethod
-    def _infer_type(value):
-        if isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return "Date"
-            except ValueError:
-                return "String"
-        elif isinstance(value, list) or isinstance(value, dict):
-            return "List"
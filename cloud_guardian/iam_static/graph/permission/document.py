@@ -0,0 +1,81 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from cloud_guardian.iam_static.graph.permission.normalization import (
+    _as_list,
+    _as_list_of_statements,
+    normalize_statements,
+)
+from cloud_guardian.iam_static.graph.permission.permission import (
+    Permission,
+    PermissionFactory,
+)
+
+# Resources of a policy statement with the permissions it grants on them
+StatementPermissions = Tuple[List[str], List[Permission]]
+
+
+def statement_permissions(
+    policy_document: Dict[str, Any],
+) -> List[StatementPermissions]:
+    """Build the permissions of each statement of a policy document, once
+    normalised."""
+    statements = []
+    for statement in normalize_statements(_as_list_of_statements(policy_document)):
+        permissions = PermissionFactory.from_policy_document({"Statement": [statement]})
+        if "NotResource" in statement:
+            # every resource, the exclusions being carried by the permissions
+            resources = ["*"]
+        else:
+            resources = _as_list(statement.get("Resource"))
+        statements.append((resources, permissions))
+    return statements
+
+
+class PolicyDocument:
+    """A policy document kept as raw JSON until its permissions are needed.
+
+    The statements of a document are parsed into Permission objects on first
+    access, i.e. when `GraphBuilder` first attaches the policy, and kept with
+    the document from then on. A document that is never attached is never
+    parsed.
+    """
+
+    __slots__ = ("raw", "_statement_permissions")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._statement_permissions: Optional[Tuple[StatementPermissions, ...]] = None
+
+    @classmethod
+    def from_dict(cls, policy_document: Dict[str, Any]) -> "PolicyDocument":
+        return cls(json.dumps(policy_document, separators=(",", ":")).encode())
+
+    @classmethod
+    def from_json(cls, text: Union[str, bytes]) -> "PolicyDocument":
+        return cls(text.encode() if isinstance(text, str) else text)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return json.loads(self.raw)
+
+    @property
+    def statement_permissions(self) -> Tuple[StatementPermissions, ...]:
+        if self._statement_permissions is None:
+            self._statement_permissions = tuple(
+                statement_permissions(json.loads(self.raw))
+            )
+        return self._statement_permissions
+
+    @property
+    def permissions(self) -> List[Permission]:
+        return [
+            permission
+            for _, permissions in self.statement_permissions
+            for permission in permissions
+        ]
+
+    def __eq__(self, other):
+        return isinstance(other, PolicyDocument) and self.raw == other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
@@ -0,0 +1,163 @@
+"""
+Canonical form of policy statements.
+
+Statements that only differ in how they are written (a string or a list
+`Action`, the order of their elements, duplicated actions, action patterns
+covered by a wider one in the same statement, their `Sid`) normalise to the
+same dict. Statements of a document with the same effect, resources,
+principals and conditions are then merged into one, so that each distinct
+grant builds one set of permissions and one set of edges.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from cloud_guardian.utils.arn import compile_wildcard, has_wildcard
+
+_ACTION_ELEMENTS = ("Action", "NotAction")
+_RESOURCE_ELEMENTS = ("Resource", "NotResource")
+_PRINCIPAL_ELEMENTS = ("Principal", "NotPrincipal")
+
+
+def _as_list(value: Union[str, List[str], None]) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def _as_list_of_statements(policy_document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    statements = policy_document.get("Statement", [])
+    if isinstance(statements, dict):
+        return [statements]
+    return statements
+
+
+def _covers(wider: str, pattern: str) -> bool:
+    """Whether every action of `pattern` is an action of `wider`.
+
+    `wider`'s wildcards matching the text of `pattern`, including its own
+    wildcards, means that they can absorb whatever those stand for; a "?"
+    stands for one character, so it cannot absorb a "*". Action names are
+    case-insensitive.
+    """
+    return (
+        has_wildcard(wider)
+        and compile_wildcard(wider, single_char="[^*]", ignore_case=True).fullmatch(
+            pattern
+        )
+        is not None
+    )
+
+
+def collapse_patterns(patterns: Iterable[str]) -> List[str]:
+    """Sorted, distinct action patterns, without those another one covers.
+
+    Patterns differing only in case are duplicates; the first one in sorted
+    order is kept.
+    """
+    distinct = {}
+    for pattern in sorted(set(patterns)):
+        distinct.setdefault(pattern.lower(), pattern)
+    patterns = list(distinct.values())
+    wildcards = [pattern for pattern in patterns if has_wildcard(pattern)]
+    return [
+        pattern
+        for pattern in patterns
+        if not any(
+            # of two patterns covering each other, the first one is kept
+            wider != pattern
+            and _covers(wider, pattern)
+            and not (_covers(pattern, wider) and pattern < wider)
+            for wider in wildcards
+        )
+    ]
+
+
+def _normalize_values(values: Any) -> Any:
+    """Sorted, distinct values of a list; a single value on its own."""
+    if not isinstance(values, list):
+        return values
+    values = sorted(set(values), key=str)
+    return values[0] if len(values) == 1 else values
+
+
+def _normalize_principal(principal: Union[str, Dict[str, Any]]) -> Any:
+    if isinstance(principal, str):
+        return principal
+    return {
+        principal_type: _normalize_values(_as_list(values))
+        for principal_type, values in sorted(principal.items())
+    }
+
+
+def normalize_statement(statement: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical form of a policy statement."""
+    normalized = {"Effect": statement["Effect"]}
+    for element in _ACTION_ELEMENTS:
+        if element in statement:
+            normalized[element] = collapse_patterns(_as_list(statement[element]))
+    for element in _RESOURCE_ELEMENTS:
+        if element in statement:
+            resources = sorted(set(_as_list(statement[element])))
+            if element == "Resource" and "*" in resources:
+                resources = ["*"]
+            normalized[element] = resources
+    for element in _PRINCIPAL_ELEMENTS:
+        if element in statement:
+            normalized[element] = _normalize_principal(statement[element])
+    if statement.get("Condition"):
+        normalized["Condition"] = {
+            condition_type: {
+                condition_key: _normalize_values(value)
+                for condition_key, value in sorted(details.items())
+            }
+            for condition_type, details in sorted(statement["Condition"].items())
+        }
+    return normalized
+
+
+def statement_digest(statement: Dict[str, Any]) -> str:
+    """Content hash of a normalised statement, its action patterns compared
+    regardless of case."""
+    statement = {
+        element: (
+            [pattern.lower() for pattern in values]
+            if element in _ACTION_ELEMENTS
+            else values
+        )
+        for element, values in statement.items()
+    }
+    text = json.dumps(statement, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def normalize_statements(
+    statements: Iterable[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """Normalise statements, merging those that only differ in their `Action`."""
+    merged: Dict[Tuple[bool, str], Dict[str, Any]] = {}
+    for statement in map(normalize_statement, statements):
+        if "Action" not in statement:
+            merged.setdefault((False, statement_digest(statement)), statement)
+            continue
+        rest = dict(statement)
+        actions = rest.pop("Action")
+        key = (True, statement_digest(rest))
+        if key in merged:
+            merged[key]["Action"] = collapse_patterns(merged[key]["Action"] + actions)
+        else:
+            merged[key] = statement
+    return list(merged.values())
+
+
+def normalize_policy_document(policy_document: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical form of a policy document."""
+    normalized = {
+        "Statement": normalize_statements(_as_list_of_statements(policy_document))
+    }
+    if "Version" in policy_document:
+        normalized["Version"] = policy_document["Version"]
+    return normalized
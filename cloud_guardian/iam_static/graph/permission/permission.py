@@ -1,10 +1,11 @@
 import hashlib
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 from cloud_guardian.iam_static.graph.permission.actions import (
     ActionsFactory,
+    ExcludedActions,
     SpecifiedActions,
 )
 from cloud_guardian.iam_static.graph.permission.conditions import (
@@ -12,6 +13,7 @@ from cloud_guardian.iam_static.graph.permission.conditions import (
     SupportedCondition,
 )
 from cloud_guardian.iam_static.graph.permission.effects import Effect
+from cloud_guardian.utils.arn import arn_matches, is_arn, parse_arn
 
 
 # the rank of a permission identifies it applies by definition
@@ -21,6 +23,23 @@ class PermissionRank(Enum):
     DYADIC = 2
 
 
+def _as_tuple(values: Union[str, Iterable[str], None]) -> Tuple[str, ...]:
+    if values is None:
+        return ()
+    if isinstance(values, str):
+        return (values,)
+    return tuple(sorted(set(values)))
+
+
+def _principal_ids(principal: Union[str, Dict[str, Any], None]) -> Tuple[str, ...]:
+    """Identity ARNs and service principals of a `Principal`/`NotPrincipal` element."""
+    if principal is None or isinstance(principal, str):
+        return _as_tuple(principal)
+    return _as_tuple(
+        value for values in principal.values() for value in _as_tuple(values)
+    )
+
+
 @dataclass
 class Permission:
     id: str
@@ -34,6 +53,12 @@ class Permission:
     # - dyadic (attached to a pair of nodes)
     rank: Optional[PermissionRank] = None
 
+    # complements of the statement's `NotResource` and `NotPrincipal`
+    # elements: the permission applies to every resource (principal) except
+    # those matching these ARN patterns
+    not_resources: Tuple[str, ...] = ()
+    not_principals: Tuple[str, ...] = ()
+
     def __eq__(self, other):
         if not isinstance(other, Permission):
             return False
@@ -43,12 +68,16 @@ class Permission:
             self.effect.name,
             tuple(self.conditions),
             self.rank,
+            self.not_resources,
+            self.not_principals,
         ) == (
             other.id,
             other.action.aws_action_pattern,
             other.effect.name,
             tuple(other.conditions),
             other.rank,
+            other.not_resources,
+            other.not_principals,
         )
 
     def __hash__(self):
@@ -59,6 +88,8 @@ class Permission:
                 self.effect.name,
                 tuple(self.conditions),
                 self.rank,
+                self.not_resources,
+                self.not_principals,
             )
         )
 
@@ -77,6 +108,11 @@ class Permission:
         if self.rank is not None:
             return
 
+        # a NotAction list covers almost every action
+        if isinstance(self.action, ExcludedActions):
+            self.rank = PermissionRank.DYADIC
+            return
+
         for keyword, custom_rank in custom_ranks.items():
             if keyword in self.action.id.lower():
                 self.rank = custom_rank
@@ -91,23 +127,53 @@ class Permission:
         actions = [
             ActionsFactory.get_or_create(action) for action in permission_dict["Action"]
         ]
-        conditions = []
-        if "Condition" in permission_dict:
-            for condition_type, details in permission_dict["Condition"].items():
-                condition = ConditionFactory.get_or_create({condition_type: details})
-                conditions.append(condition)
+        conditions = ConditionFactory.from_block(permission_dict.get("Condition", {}))
 
         return [
             cls(action=action, effect=effect, conditions=conditions)
             for action in actions
         ]
 
+    def applies_to(self, resource_arn: Optional[str]) -> bool:
+        """Whether the permission covers a resource (None for no specific resource)."""
+        if resource_arn is None:
+            return True
+        return not any(
+            arn_matches(pattern, resource_arn) for pattern in self.not_resources
+        )
+
+    def excludes_principal(self, principal_arn: str) -> bool:
+        """Whether a principal is named by the statement's `NotPrincipal`."""
+        if not self.not_principals:
+            return False
+        if principal_arn in self.not_principals:
+            return True
+        if not is_arn(principal_arn):
+            return False
+        # naming an account (or its root user) names all its principals
+        parsed = parse_arn(principal_arn)
+        return bool(parsed.account) and any(
+            excluded
+            in (parsed.account, f"arn:{parsed.partition}:iam::{parsed.account}:root")
+            for excluded in self.not_principals
+        )
+
     def is_granted(self, runtime_values: Dict[str, Any]) -> bool:
         for condition in self.conditions:
             if not condition.evaluate(runtime_values.get(condition.condition_key)):
                 return False
         return self.effect == Effect.ALLOW
 
+    def conditions_met_many(self, contexts: Sequence[Dict[str, Any]]) -> List[bool]:
+        """Whether all the conditions hold, for each of a batch of request contexts."""
+        met = [True] * len(contexts)
+        for condition in self.conditions:
+            outcomes = condition.evaluate_many(
+                context.get(condition.condition_key) for context in contexts
+            )
+            met = [previous and outcome for previous, outcome in zip(met, outcomes)]
+        return met
+
 
 class PermissionFactory:
     _instances = {}
@@ -119,8 +185,14 @@ class PermissionFactory:
         effect: Effect,
         conditions: List[SupportedCondition],
         rank: Optional[PermissionRank] = None,
+        not_resources: Iterable[str] = (),
+        not_principals: Iterable[str] = (),
     ) -> Permission:
-        permission_id = cls._create_id(action, effect, conditions)
+        not_resources = _as_tuple(not_resources)
+        not_principals = _as_tuple(not_principals)
+        permission_id = cls._create_id(
+            action, effect, conditions, not_resources, not_principals
+        )
 
         if permission_id not in cls._instances:
             # Create the Permission with the generated ID
@@ -130,26 +202,56 @@ class PermissionFactory:
                 effect=effect,
                 conditions=conditions,
                 rank=rank,
+                not_resources=not_resources,
+                not_principals=not_principals,
             )
         return cls._instances[permission_id]
 
+    @classmethod
+    def register(cls, permission: Permission) -> Permission:
+        """Make a permission built elsewhere (e.g. in another process) known,
+        along with its actions and conditions, returning the instance of this
+        process for its id."""
+        if permission.id not in cls._instances:
+            permission.action = ActionsFactory.register(permission.action)
+            permission.conditions = [
+                ConditionFactory.register(condition)
+                for condition in permission.conditions
+            ]
+            cls._instances[permission.id] = permission
+        return cls._instances[permission.id]
+
     @classmethod
     def from_dict(cls, permission_dict: Dict[str, Any]) -> List[Permission]:
         effect = Effect(permission_dict["Effect"])
-        if isinstance(permission_dict["Action"], str):
+        if "NotAction" in permission_dict:
+            # kept as the complement of the listed patterns, never expanded
+            actions = [
+                ActionsFactory.get_or_create_excluded(
+                    _as_tuple(permission_dict["NotAction"])
+                )
+            ]
+        elif isinstance(permission_dict["Action"], str):
             actions = [ActionsFactory.get_or_create(permission_dict["Action"])]
         else:
             actions = [
                 ActionsFactory.get_or_create(action)
                 for action in permission_dict["Action"]
             ]
-        conditions = []
-        if "Condition" in permission_dict:
-            for condition_type, details in permission_dict["Condition"].items():
-                condition = ConditionFactory.from_dict({condition_type: details})
-                conditions.append(condition)
+        conditions = ConditionFactory.from_block(permission_dict.get("Condition", {}))
+        not_resources = _as_tuple(permission_dict.get("NotResource"))
+        not_principals = _principal_ids(permission_dict.get("NotPrincipal"))
 
-        return [cls.get_or_create(action, effect, conditions) for action in actions]
+        return [
+            cls.get_or_create(
+                action,
+                effect,
+                conditions,
+                not_resources=not_resources,
+                not_principals=not_principals,
+            )
+            for action in actions
+        ]
 
     @staticmethod
     def from_policy_document(policy_document: Dict[str, Any]) -> List[Permission]:
@@ -160,8 +262,17 @@ class PermissionFactory:
 
     @staticmethod
     def _create_id(
-        action: SpecifiedActions, effect: Effect, conditions: List[SupportedCondition]
+        action: SpecifiedActions,
+        effect: Effect,
+        conditions: List[SupportedCondition],
+        not_resources: Tuple[str, ...] = (),
+        not_principals: Tuple[str, ...] = (),
     ) -> str:
         action_effect = f"{action.aws_action_pattern}{effect}"
         conditions_str = "".join(sorted(str(c) for c in conditions))
+        # only present when set, so that the ids of other permissions are unchanged
+        if not_resources:
+            conditions_str += f"NotResource{list(not_resources)}"
+        if not_principals:
+            conditions_str += f"NotPrincipal{list(not_principals)}"
         return hashlib.sha256(f"{action_effect}{conditions_str}".encode()).hexdigest()
@@ -1,6 +1,32 @@
+from typing import Optional, Set, Union
+
+from botocore.exceptions import ClientError
+from cloud_guardian import logger
 from cloud_guardian.aws.helpers.generic import get_identity_or_resource_from_arn
+from cloud_guardian.aws.helpers.iam.account_management import (
+    get_account_authorization_details,
+)
+from cloud_guardian.aws.helpers.s3.bucket_operations import list_buckets
+from cloud_guardian.aws.helpers.s3.bucket_policy import get_bucket_policy
 from cloud_guardian.aws.manager import AWSManager
+from cloud_guardian.iam_static.graph.delta import GraphDelta, compute_delta
+from cloud_guardian.iam_static.graph.evaluation import EffectivePermissionEvaluator
 from cloud_guardian.iam_static.graph.graph import IAMGraph
+from cloud_guardian.iam_static.graph.identities.group import Group, GroupFactory
+from cloud_guardian.iam_static.graph.identities.resources import Resource
+from cloud_guardian.iam_static.graph.identities.role import Role, RoleFactory
+from cloud_guardian.iam_static.graph.identities.services import SupportedService
+from cloud_guardian.iam_static.graph.identities.user import User, UserFactory
+from cloud_guardian.iam_static.graph.initializers import (
+    GraphBuilder,
+    _create_date,
+    _resource_from_arn,
+)
+from cloud_guardian.iam_static.graph.relationships.relationships import IsPartOf
+from cloud_guardian.utils.arn import parse_arn
+from cloud_guardian.utils.loaders import iter_authorization_details_page
+
+Node = Union[User, Group, Role, Resource, SupportedService]
 
 
 class IAMManager:
@@ -11,53 +37,138 @@ class IAMManager:
         self.iam = aws_manager.iam
         self.s3 = aws_manager.s3
         self.graph = IAMGraph()
+        self.builder = GraphBuilder(graph=self.graph)
+        # follows the changes made to the graph through its listeners
+        self.evaluator = EffectivePermissionEvaluator(self.graph)
+
+    def update_graph(self) -> Set[str]:
+        """Pull the account from AWS and apply what changed since the last pull.
+
+        Returns the ids of the principals whose permissions may have changed.
+        """
+        builder = GraphBuilder()
+        for page in get_account_authorization_details(self.iam):
+            builder.add_records(iter_authorization_details_page(page))
+        for bucket in list_buckets(self.s3):
+            try:
+                policy_document = get_bucket_policy(self.s3, bucket["name"])
+            except ClientError:
+                continue
+            builder.add_resource_policy({"PolicyDocument": policy_document})
+        current = builder.finish()
+
+        delta = compute_delta(self.graph, current)
+        logger.info(f"Updating graph: {delta.summary()}")
+        self.builder.policies.update(builder.policies)
+        return self.apply_delta(delta)
+
+    def apply_delta(self, delta: GraphDelta) -> Set[str]:
+        """Apply a delta to the graph in place.
 
-    def update_graph(self):
-        # TODO: use the helper functions in
-        # cloud_guardian.aws.helpers.iam and cloud_guardian.aws.helpers.s3 (or add new ones if needed)
-        # with the rerefence self.iam and self.s3 to
-        # pull the data needed to populate self.graph data structures without adding new ones (no Policy etc..)
-        # then delete analyzer.py, analyzer_old etc..
-        # Use the methods below when possible, add new ones if needed
-        pass
-
-    def update_node(self, arn: str):
-        # TODO: identity can be a User, Role, Group
-        # 1 - get the identity info from aws, 2 - create/update in the graph
-        get_identity_or_resource_from_arn(arn, self.iam, self.s3)
-        # ...
-        pass
+        Listeners registered on the graph see each individual change; the
+        returned ids are the principals touched by the delta, including the
+        members of touched groups.
+        """
+        removers = {
+            User: self._remove_user,
+            Group: self._remove_group,
+            Role: self._remove_role,
+            Resource: self._remove_resource,
+        }
+        for relationship in delta.removed_relationships:
+            self.graph.remove_relationship(relationship)
+        for node in delta.removed_nodes:
+            removers.get(type(node), self.graph.remove_node)(node.id)
+        for node in delta.added_nodes:
+            self.update_node(node.id, node)
+        for relationship in delta.added_relationships:
+            self.graph.add_relationship(relationship)
+        for policy_arn, (_, version) in delta.policy_versions.items():
+            if version is None:
+                self.graph.policy_versions.pop(policy_arn, None)
+            else:
+                self.graph.policy_versions[policy_arn] = version
+
+        touched = delta.touched_ids()
+        for node_id in list(touched):
+            if isinstance(self.graph.get_entity_by_id(node_id), Group):
+                touched.update(self._members(node_id))
+        return {
+            node_id
+            for node_id in touched
+            if not isinstance(self.graph.get_entity_by_id(node_id), Resource)
+        }
+
+    def update_node(self, arn: str, node: Optional[Node] = None):
+        """Create or update a User, Group, Role or Resource in the graph.
+
+        When `node` is not given, the entity is fetched from AWS.
+        """
+        if node is None:
+            node = self._fetch_node(arn)
+        adders = {
+            User: self._add_user,
+            Group: self._add_group,
+            Role: self._add_role,
+            Resource: self._add_resource,
+        }
+        adders.get(type(node), self.graph.add_node)(node)
 
     def update_permissions_to_node(self, policy_document: dict, arn: str):
-        # TODO
-        # policy_document is the policy document in json format (dict) e.g. {"Version": "2012-10-17", "Statement": [{"Effect": "Allow", "Action": "s3:GetObject", "Resource": "arn:aws:s3:::examplebucket/*"}]}
-        # Create/Update Permission objects and attach to the nodes in the graph, etc..
-        pass
+        """Give the node `arn` the permissions granted by `policy_document`."""
+        identity = self.graph.get_entity_by_id(arn)
+        if identity is None:
+            self.update_node(arn)
+            identity = self.graph.get_entity_by_id(arn)
+        self.builder.connect_policy_document(identity, policy_document)
+
+    def _fetch_node(self, arn: str) -> Node:
+        if parse_arn(arn).service == "s3":
+            resource = _resource_from_arn(arn)
+            if resource is None:
+                raise ValueError(f"Unsupported resource ARN {arn}")
+            return resource
+        details = get_identity_or_resource_from_arn(arn, self.iam, self.s3)
+        if "UserName" in details:
+            factory, name = UserFactory, details["UserName"]
+        elif "GroupName" in details:
+            factory, name = GroupFactory, details["GroupName"]
+        else:
+            factory, name = RoleFactory, details["RoleName"]
+        return factory.get_or_create(
+            name=name, arn=arn, create_date=_create_date(details)
+        )
+
+    def _members(self, group_id: str) -> Set[str]:
+        return {
+            source
+            for source, _, edge_data in self.graph.graph.in_edges(group_id, data=True)
+            if edge_data["relationship"].type == IsPartOf.type
+        }
+
+    def _add_user(self, user: User):
+        self.graph.add_node(user)
 
-    def _add_user():
-        pass
+    def _add_role(self, role: Role):
+        self.graph.add_node(role)
 
-    def _add_role():
-        pass
+    def _add_group(self, group: Group):
+        self.graph.add_node(group)
 
-    def _add_group():
-        pass
+    def _add_resource(self, resource: Resource):
+        self.graph.add_node(resource)
 
-    def _add_resource():
-        pass
+    # removing a node also removes its edges, so memberships, trust and
+    # permissions attached to it go away with it
 
-    def _remove_user():
-        # TODO: check edges / permissions attached and other ndoes affected by it
-        pass
+    def _remove_user(self, arn: str):
+        self.graph.remove_node(arn)
 
-    def _remove_role():
-        # TODO: check edges / permissions attached and other ndoes affected by it
-        pass
+    def _remove_role(self, arn: str):
+        self.graph.remove_node(arn)
 
-    def _remove_group():
-        # TODO: check edges / permissions attached and other ndoes affected by it
-        pass
+    def _remove_group(self, arn: str):
+        self.graph.remove_node(arn)
 
-    def _remove_resource():
-        # TODO: check edges / permissions attached and other ndoes affected by it
-        pass
+    def _remove_resource(self, arn: str):
+        self.graph.remove_node(arn)
@@ -0,0 +1,160 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional
+
+# Upper bound on the number of interned ARNs; the cache is reset when reached
+_CACHE_SIZE = 1 << 20
+
+# Number of distinct patterns whose compiled regex is kept
+_PATTERN_CACHE_SIZE = 1 << 16
+
+_cache: Dict[str, "Arn"] = {}
+
+
+@dataclass(frozen=True, slots=True)
+class Arn:
+    """A parsed ARN: arn:partition:service:region:account:resource.
+
+    The resource part is split into `resource_type`, `path` and `name`, e.g.
+    `user/division/Alice` has type "user", path "/division/" and name "Alice".
+    S3 ARNs have no account and region; their type is "bucket" or "object" and
+    their name the bucket name or the object key.
+    """
+
+    raw: str
+    partition: str
+    service: str
+    region: str
+    account: str
+    resource: str
+    resource_type: str
+    path: str
+    name: str
+
+    @property
+    def bucket(self) -> str:
+        """Bucket of an S3 bucket or object ARN."""
+        return self.resource.split("/", 1)[0]
+
+    @property
+    def is_wildcard(self) -> bool:
+        return has_wildcard(self.raw)
+
+    def __str__(self):
+        return self.raw
+
+
+def _split_resource(service: str, resource: str):
+    """Split the resource part of an ARN into (type, path, name)."""
+    if service == "s3":
+        bucket, _, key = resource.partition("/")
+        if key:
+            return "object", "", key
+        return "bucket", "", bucket
+    if "/" in resource:
+        resource_type, _, rest = resource.partition("/")
+        path, _, name = rest.rpartition("/")
+        return resource_type, f"/{path}/" if path else "/", name
+    if ":" in resource:
+        resource_type, _, name = resource.partition(":")
+        return resource_type, "", name
+    return "", "", resource
+
+
+def parse_arn(arn: str) -> Arn:
+    """Parse an ARN, returning the same interned Arn for equal strings.
+
+    ARNs without an account field (`arn:aws:iam::user/Alice`, as found in the
+    toy example) are accepted and get an empty account.
+    """
+    parsed = _cache.get(arn)
+    if parsed is not None:
+        return parsed
+
+    parts = arn.split(":", 5)
+    if len(parts) < 5 or parts[0] != "arn":
+        raise ValueError(f"Invalid ARN format: {arn}")
+    if len(parts) == 5:
+        _, partition, service, region, resource = parts
+        account = ""
+    else:
+        _, partition, service, region, account, resource = parts
+    resource_type, path, name = _split_resource(service, resource)
+    parsed = Arn(
+        raw=arn,
+        partition=partition,
+        service=service,
+        region=region,
+        account=account,
+        resource=resource,
+        resource_type=resource_type,
+        path=path,
+        name=name,
+    )
+
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    _cache[arn] = parsed
+    return parsed
+
+
+def is_arn(value: str) -> bool:
+    return value.startswith("arn:")
+
+
+def has_wildcard(pattern: str) -> bool:
+    return "*" in pattern or "?" in pattern
+
+
+def wildcard_regex(
+    pattern: str, any_char: str = ".", single_char: Optional[str] = None
+) -> str:
+    """Regex of a pattern in which "*" matches any run of `any_char` and "?"
+    a single `single_char` (`any_char` by default)."""
+    return (
+        re.escape(pattern)
+        .replace(r"\*", f"{any_char}*")
+        .replace(r"\?", single_char or any_char)
+    )
+
+
+@lru_cache(maxsize=_PATTERN_CACHE_SIZE)
+def compile_wildcard(
+    pattern: str,
+    any_char: str = ".",
+    single_char: Optional[str] = None,
+    ignore_case: bool = False,
+) -> re.Pattern:
+    """Compiled `wildcard_regex` of a pattern, to be used with `fullmatch`."""
+    return re.compile(
+        wildcard_regex(pattern, any_char, single_char),
+        re.IGNORECASE if ignore_case else 0,
+    )
+
+
+def arn_regex(pattern: str) -> str:
+    """Regex of an ARN pattern, as matched by `ArnLike` and resource elements.
+
+    Wildcards stay within one of the colon-separated components, except in
+    the last one (the resource, or "*" on its own), where they also match
+    ":" and "/".
+    """
+    components = pattern.split(":", 5)
+    return ":".join(
+        wildcard_regex(component, "." if last else "[^:]")
+        for last, component in zip([False] * (len(components) - 1) + [True], components)
+    )
+
+
+@lru_cache(maxsize=_PATTERN_CACHE_SIZE)
+def compile_arn_pattern(pattern: str) -> re.Pattern:
+    """Compiled `arn_regex` of an ARN pattern, to be used with `fullmatch`."""
+    return re.compile(arn_regex(pattern))
+
+
+def arn_matches(pattern: str, arn: str) -> bool:
+    """Whether an ARN pattern covers an ARN."""
+    if not has_wildcard(pattern):
+        return pattern == arn
+    return compile_arn_pattern(pattern).fullmatch(arn) is not None
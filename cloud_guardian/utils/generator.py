@@ -0,0 +1,374 @@
+"""
+Deterministic generator of synthetic IAM datasets.
+
+Writes groups.json, policies.json, roles.json and users.json in the format of
+`data/toy_example/original`, so that every stage of the pipeline can be sized
+and benchmarked on accounts of realistic scale. The same configuration and seed
+always produce byte-identical files.
+"""
+
+import argparse
+import json
+import os
+import random
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from cloud_guardian import logger
+from cloud_guardian.utils.shared import data_path
+
+# Actions drawn for generated statements, by service
+_ACTIONS = {
+    "s3": [
+        "GetObject",
+        "PutObject",
+        "DeleteObject",
+        "ListBucket",
+        "GetBucketPolicy",
+        "PutBucketPolicy",
+        "GetObjectAcl",
+        "PutObjectAcl",
+    ],
+    "iam": [
+        "CreateUser",
+        "DeleteUser",
+        "GetUser",
+        "ListUsers",
+        "CreatePolicy",
+        "AttachUserPolicy",
+        "AttachRolePolicy",
+        "PassRole",
+        "ListRoles",
+    ],
+    "sts": ["AssumeRole", "GetCallerIdentity"],
+    "ec2": [
+        "DescribeInstances",
+        "RunInstances",
+        "StartInstances",
+        "StopInstances",
+        "TerminateInstances",
+    ],
+    "lambda": ["InvokeFunction", "CreateFunction", "ListFunctions"],
+}
+
+_SERVICE_PRINCIPALS = ["ec2.amazonaws.com", "lambda.amazonaws.com"]
+
+_CREATE_DATE = "2023-01-01T12:00:00Z"
+
+
+@dataclass
+class GeneratorConfig:
+    users: int = 1000
+    groups: int = 50
+    roles: int = 100
+    policies: int = 200
+    buckets: int = 50
+    # number of groups each user belongs to
+    groups_per_user: int = 2
+    # number of managed policies attached to each user, group and role
+    policies_per_identity: int = 2
+    # inclusive (min, max) ranges
+    statements_per_policy: Tuple[int, int] = (1, 4)
+    actions_per_statement: Tuple[int, int] = (1, 6)
+    resources_per_statement: Tuple[int, int] = (1, 3)
+    # probability that an action or a resource is a wildcard
+    wildcard_ratio: float = 0.1
+    # probability that a statement has a condition
+    condition_density: float = 0.1
+    # probability that a statement denies instead of allowing
+    deny_ratio: float = 0.05
+    # roles are chained so that each role can assume the next one
+    trust_chain_length: int = 3
+    account_id: str = "123456789012"
+    seed: int = 0
+
+
+class _Generator:
+    def __init__(self, config: GeneratorConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        # group index -> indexes of its users
+        self.members: List[List[int]] = [[] for _ in range(config.groups)]
+
+    def arn(self, resource: str) -> str:
+        return f"arn:aws:iam::{self.config.account_id}:{resource}"
+
+    def user_name(self, index: int) -> str:
+        return f"user-{index:07d}"
+
+    def group_name(self, index: int) -> str:
+        return f"group-{index:05d}"
+
+    def role_name(self, index: int) -> str:
+        return f"role-{index:05d}"
+
+    def policy_name(self, index: int) -> str:
+        return f"policy-{index:05d}"
+
+    def bucket_name(self, index: int) -> str:
+        return f"bucket-{index:05d}"
+
+    def between(self, bounds: Tuple[int, int]) -> int:
+        return self.rng.randint(*bounds)
+
+    def attached_policies(self) -> List[Dict[str, str]]:
+        count = min(self.config.policies_per_identity, self.config.policies)
+        return [
+            {
+                "PolicyName": self.policy_name(index),
+                "PolicyArn": self.arn(f"policy/{self.policy_name(index)}"),
+            }
+            for index in sorted(self.rng.sample(range(self.config.policies), count))
+        ]
+
+    def action(self, service: str) -> str:
+        if self.rng.random() >= self.config.wildcard_ratio:
+            return f"{service}:{self.rng.choice(_ACTIONS[service])}"
+        roll = self.rng.random()
+        if roll < 0.1:
+            return "*"
+        if roll < 0.4:
+            return f"{service}:*"
+        verb = self.rng.choice(_ACTIONS[service])
+        return f"{service}:{verb[: self.rng.randint(1, len(verb) - 1)]}*"
+
+    def bucket_resources(self) -> List[str]:
+        resources = []
+        for _ in range(self.between(self.config.resources_per_statement)):
+            bucket = self.bucket_name(self.rng.randrange(self.config.buckets))
+            if self.rng.random() < self.config.wildcard_ratio:
+                resources.append(f"arn:aws:s3:::{bucket}/*")
+            else:
+                resources.append(f"arn:aws:s3:::{bucket}")
+        return sorted(set(resources))
+
+    def condition(self) -> Dict[str, Dict[str, str]]:
+        if self.rng.random() < 0.5:
+            return {
+                "IpAddress": {"aws:SourceIp": f"10.{self.rng.randrange(256)}.0.0/16"}
+            }
+        operator = self.rng.choice(["DateGreaterThan", "DateLessThan"])
+        month = self.rng.randint(1, 12)
+        return {operator: {"aws:CurrentTime": f"2024-{month:02d}-01T00:00:00Z"}}
+
+    def statement(self) -> Dict[str, Any]:
+        service = self.rng.choice(list(_ACTIONS))
+        actions = sorted(
+            {
+                self.action(service)
+                for _ in range(self.between(self.config.actions_per_statement))
+            }
+        )
+        if (
+            service == "s3"
+            and self.config.buckets
+            and self.rng.random() >= self.config.wildcard_ratio
+        ):
+            resource = self.bucket_resources()
+        else:
+            resource = "*"
+        statement = {
+            "Effect": (
+                "Deny" if self.rng.random() < self.config.deny_ratio else "Allow"
+            ),
+            "Action": actions,
+            "Resource": resource,
+        }
+        if self.rng.random() < self.config.condition_density:
+            statement["Condition"] = self.condition()
+        return statement
+
+    def policy_document(self) -> Dict[str, Any]:
+        return {
+            "Version": "2012-10-17",
+            "Statement": [
+                self.statement()
+                for _ in range(self.between(self.config.statements_per_policy))
+            ],
+        }
+
+    def users(self) -> Iterator[Dict[str, Any]]:
+        group_count = min(self.config.groups_per_user, self.config.groups)
+        for index in range(self.config.users):
+            for group in self.rng.sample(range(self.config.groups), group_count):
+                self.members[group].append(index)
+            yield {
+                "UserName": self.user_name(index),
+                "UserArn": self.arn(f"user/{self.user_name(index)}"),
+                "CreateDate": _CREATE_DATE,
+                "AttachedPolicies": self.attached_policies(),
+            }
+
+    def groups(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.config.groups):
+            yield {
+                "GroupName": self.group_name(index),
+                "GroupArn": self.arn(f"group/{self.group_name(index)}"),
+                "CreateDate": _CREATE_DATE,
+                "Users": [
+                    {
+                        "UserName": self.user_name(user),
+                        "UserArn": self.arn(f"user/{self.user_name(user)}"),
+                    }
+                    for user in self.members[index]
+                ],
+                "AttachedPolicies": self.attached_policies(),
+            }
+
+    def trusted_principal(self, index: int) -> Dict[str, str]:
+        chain_length = max(self.config.trust_chain_length, 1)
+        if index % chain_length:
+            # within a chain, each role is assumed from the previous one
+            return {"AWS": self.arn(f"role/{self.role_name(index - 1)}")}
+        if self.config.users and self.rng.random() < 0.9:
+            user = self.user_name(self.rng.randrange(self.config.users))
+            return {"AWS": self.arn(f"user/{user}")}
+        return {"Service": self.rng.choice(_SERVICE_PRINCIPALS)}
+
+    def roles(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.config.roles):
+            yield {
+                "RoleName": self.role_name(index),
+                "RoleArn": self.arn(f"role/{self.role_name(index)}"),
+                "CreateDate": _CREATE_DATE,
+                "AssumeRolePolicyDocument": {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {
+                            "Effect": "Allow",
+                            "Principal": self.trusted_principal(index),
+                            "Action": "sts:AssumeRole",
+                        }
+                    ],
+                },
+                "AttachedPolicies": self.attached_policies(),
+            }
+
+    def identity_policies(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.config.policies):
+            yield {
+                "PolicyName": self.policy_name(index),
+                "PolicyArn": self.arn(f"policy/{self.policy_name(index)}"),
+                "PolicyDocument": self.policy_document(),
+            }
+
+    def resource_policies(self) -> Iterator[Dict[str, Any]]:
+        for index in range(self.config.buckets):
+            bucket = self.bucket_name(index)
+            principals = []
+            if self.config.groups:
+                group = self.group_name(self.rng.randrange(self.config.groups))
+                principals.append(self.arn(f"group/{group}"))
+            if self.config.roles:
+                role = self.role_name(self.rng.randrange(self.config.roles))
+                principals.append(self.arn(f"role/{role}"))
+            yield {
+                "PolicyDocument": {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {
+                            "Effect": "Allow",
+                            "Principal": {"AWS": principal},
+                            "Action": sorted(
+                                {
+                                    self.action("s3")
+                                    for _ in range(
+                                        self.between(self.config.actions_per_statement)
+                                    )
+                                }
+                            ),
+                            "Resource": [
+                                f"arn:aws:s3:::{bucket}",
+                                f"arn:aws:s3:::{bucket}/*",
+                            ],
+                        }
+                        for principal in principals
+                    ],
+                }
+            }
+
+
+def _write_records(
+    file_path: Path, sections: Iterable[Tuple[str, Iterable[Dict[str, Any]]]]
+) -> int:
+    """Write top-level arrays of records one record at a time; returns the count."""
+    count = 0
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", buffering=1 << 20) as file:
+        file.write("{")
+        for section_index, (key, records) in enumerate(sections):
+            if section_index:
+                file.write(",")
+            file.write(f"\n  {json.dumps(key)}: [")
+            for record_index, record in enumerate(records):
+                if record_index:
+                    file.write(",")
+                file.write("\n    ")
+                file.write(json.dumps(record))
+                count += 1
+            file.write("\n  ]")
+        file.write("\n}\n")
+    os.replace(tmp_path, file_path)
+    return count
+
+
+def generate_dataset(config: GeneratorConfig, output_dir: Path):
+    """Write a synthetic dataset described by `config` to `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    generator = _Generator(config)
+
+    # users first: group memberships are drawn while the users are written
+    counts = {
+        "users.json": _write_records(
+            output_dir / "users.json", [("Users", generator.users())]
+        ),
+        "groups.json": _write_records(
+            output_dir / "groups.json", [("Groups", generator.groups())]
+        ),
+        "roles.json": _write_records(
+            output_dir / "roles.json", [("Roles", generator.roles())]
+        ),
+        "policies.json": _write_records(
+            output_dir / "policies.json",
+            [
+                ("IdentityBasedPolicies", generator.identity_policies()),
+                ("ResourceBasedPolicies", generator.resource_policies()),
+            ],
+        ),
+    }
+    for file_name, count in counts.items():
+        logger.info(f"Wrote {count} records to {output_dir / file_name}")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=data_path / "generated" / "original",
+        help="folder where the JSON files are written",
+    )
+    for config_field in fields(GeneratorConfig):
+        option = f"--{config_field.name.replace('_', '-')}"
+        if isinstance(config_field.default, tuple):
+            parser.add_argument(option, type=int, nargs=2, default=config_field.default)
+        else:
+            parser.add_argument(
+                option,
+                type=type(config_field.default),
+                default=config_field.default,
+            )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = vars(_parse_args())
+    output = args.pop("output")
+    config = GeneratorConfig(
+        **{
+            name: tuple(value) if isinstance(value, list) else value
+            for name, value in args.items()
+        }
+    )
+    generate_dataset(config, output)
@@ -1,6 +1,211 @@
 import json
 import os
 from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Tuple, Union
+
+from cloud_guardian import logger
+from cloud_guardian.utils.arn import is_arn, parse_arn
+
+# Size of the first read from a JSON file; reads grow geometrically when a
+# single record does not fit in the buffer
+_CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+
+_DELIMITERS = _WHITESPACE + ",]}"
+
+_decoder = json.JSONDecoder()
+
+
+class _JSONStream:
+    """Incremental reader over a JSON text that decodes one value at a time."""
+
+    def __init__(self, file, chunk_size: int = _CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        """Append up to `size` characters to the buffer, dropping consumed ones."""
+        if self.eof:
+            return False
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def expect(self, char: str):
+        """Consume `char`, raising if the next token is something else."""
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(
+                f"Expecting '{char}', found '{found}'", self.buffer, self.pos
+            )
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """Decode the next complete JSON value from the stream."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            # a number or literal is only complete once a delimiter follows it
+            truncated = end == len(self.buffer) or self.buffer[end] not in _DELIMITERS
+            if self.buffer[self.pos] not in '{["' and truncated and self._fill(size):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_items(
+    file_path: Path, chunk_size: int = _CHUNK_SIZE
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Streams the members of a top-level JSON object as (key, value) pairs.
+
+    Arrays are unrolled: each element is yielded separately under the array key,
+    so memory is bounded by the largest element rather than by the whole file.
+    """
+    with open(file_path, "r") as file:
+        stream = _JSONStream(file, chunk_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(":")
+            if stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.expect("]")
+                else:
+                    while True:
+                        yield key, stream.decode()
+                        if stream.peek() == ",":
+                            stream.expect(",")
+                        else:
+                            stream.expect("]")
+                            break
+            else:
+                yield key, stream.decode()
+            if stream.peek() == ",":
+                stream.expect(",")
+            else:
+                stream.expect("}")
+                return
+
+
+def stream_json_array(file_path: Path, key: str) -> Iterator[Any]:
+    """Yields the elements of the top-level array `key` of a JSON file one by one."""
+    for item_key, item in iter_json_items(file_path):
+        if item_key == key:
+            yield item
+
+
+# Record kinds yielded by `stream_iam_records`, in dependency order: policies
+# before the identities they are attached to, identities before the trust and
+# resource-based policies that reference them
+_IAM_RECORD_SOURCES = [
+    ("policy", "policies.json", "IdentityBasedPolicies"),
+    ("user", "users.json", "Users"),
+    ("group", "groups.json", "Groups"),
+    ("role", "roles.json", "Roles"),
+    ("resource_policy", "policies.json", "ResourceBasedPolicies"),
+]
+
+
+def stream_iam_records(data_folder: Path) -> Iterator[Tuple[str, dict]]:
+    """
+    Streams the records of a groups/policies/roles/users.json folder one at a time.
+
+    Yields (kind, record) pairs where kind is one of "policy", "user", "group",
+    "role" or "resource_policy". Missing files are skipped; a file that is not
+    valid JSON stops the stream with a `json.JSONDecodeError`.
+    """
+    for kind, file_name, key in _IAM_RECORD_SOURCES:
+        file_path = os.path.join(data_folder, file_name)
+        try:
+            for record in stream_json_array(file_path, key):
+                yield kind, record
+        except FileNotFoundError:
+            logger.warning(f"{file_name} not found in {data_folder}")
+        except json.JSONDecodeError:
+            logger.error(f"{file_path} could not be decoded as JSON")
+            raise
+
+
+# Record kinds of `aws iam get-account-authorization-details` output, by list key
+_AUTHORIZATION_DETAILS_KINDS = {
+    "UserDetailList": "user_detail",
+    "GroupDetailList": "group_detail",
+    "RoleDetailList": "role_detail",
+    "Policies": "managed_policy",
+}
+
+
+def iter_authorization_details_page(page: dict) -> Iterator[Tuple[str, dict]]:
+    """Yields the records of an in-memory authorization details page, such as a
+    `get_account_authorization_details` API response."""
+    for key, kind in _AUTHORIZATION_DETAILS_KINDS.items():
+        for record in page.get(key, []):
+            yield kind, record
+
+
+def authorization_details_files(paths: Iterable[Path]) -> List[Path]:
+    """Expand directories into the (sorted) JSON page files they contain."""
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.json")))
+        else:
+            files.append(path)
+    return files
+
+
+def stream_authorization_details(
+    paths: Union[Path, Iterable[Path]],
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Streams the records of `aws iam get-account-authorization-details` dumps.
+
+    `paths` can be a single file, a folder of page files or a list of both; each
+    page is read once. Yields (kind, record) pairs where kind is one of
+    "user_detail", "group_detail", "role_detail" or "managed_policy". A page
+    that is not valid JSON stops the stream with a `json.JSONDecodeError`.
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    for file_path in authorization_details_files(paths):
+        try:
+            for key, record in iter_json_items(file_path):
+                kind = _AUTHORIZATION_DETAILS_KINDS.get(key)
+                if kind is not None:
+                    yield kind, record
+        except json.JSONDecodeError:
+            logger.error(f"{file_path} could not be decoded as JSON")
+            raise
 
 
 def load_iam_data_into_dictionaries(data_folder: Path):
@@ -25,9 +230,10 @@ def load_iam_data_into_dictionaries(data_folder: Path):
             with open(file_path, "r") as file:
                 data_dict.update(json.load(file))
         except FileNotFoundError:
-            print(f"Warning: {file_name} not found in {data_folder}")
+            logger.warning(f"{file_name} not found in {data_folder}")
         except json.JSONDecodeError:
-            print(f"Error: {file_name} could not be decoded as JSON.")
+            logger.error(f"{file_path} could not be decoded as JSON")
+            raise
 
     # Return the dictionaries
     return groups_data, policies_data, roles_data, users_data
@@ -38,11 +244,9 @@ def extract_bucket_names(policy):
     statements = policy["PolicyDocument"]["Statement"]
     for statement in statements:
         resources = statement["Resource"]
+        if isinstance(resources, str):
+            resources = [resources]
         for resource in resources:
-            if resource.startswith("arn:aws:s3:::"):
-                # Extract part after 'arn:aws:s3:::'
-                part = resource[13:]  # Skip the leading 'arn:aws:s3:::'
-                # Take everything before the first '/' if it exists
-                bucket_name = part.split("/")[0]
-                bucket_names.add(bucket_name)
+            if is_arn(resource) and parse_arn(resource).service == "s3":
+                bucket_names.add(parse_arn(resource).bucket)
     return list(bucket_names)
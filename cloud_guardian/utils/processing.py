@@ -1,8 +1,19 @@
+import hashlib
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
 
 from cloud_guardian.utils.shared import data_path
 
+# Name of the file, in the output folder, that records the hash of each input
+_MANIFEST_NAME = ".manifest.json"
+
+# Bump when `process_json_data` changes so that cached outputs are regenerated
+_MANIFEST_VERSION = 1
+
+_HASH_CHUNK_SIZE = 1 << 20
+
 
 def process_json_data(data):
     if isinstance(data, dict):
@@ -25,27 +36,88 @@ def process_json_data(data):
             process_json_data(item)
 
 
-def process_files(input_dir, output_dir):
+def file_hash(file_path) -> str:
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest(output_dir) -> Dict[str, str]:
+    manifest_path = os.path.join(output_dir, _MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get("version") != _MANIFEST_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+
+def _save_manifest(output_dir, hashes: Dict[str, str]):
+    manifest_path = os.path.join(output_dir, _MANIFEST_NAME)
+    with open(manifest_path, "w") as file:
+        json.dump({"version": _MANIFEST_VERSION, "files": hashes}, file, indent=4)
+
+
+def write_json(data, file_path, indent: int = 4):
+    """Write JSON by streaming encoded chunks, replacing the file atomically."""
+    tmp_path = f"{file_path}.tmp"
+    encoder = json.JSONEncoder(indent=indent)
+    with open(tmp_path, "w", buffering=_HASH_CHUNK_SIZE) as file:
+        for chunk in encoder.iterencode(data):
+            file.write(chunk)
+    os.replace(tmp_path, file_path)
+
+
+def process_file(input_file_path, output_file_path):
+    # Open and read the JSON data
+    with open(input_file_path, "r") as file:
+        print(f"Processing {input_file_path}")
+        json_data = json.load(file)
+
+    # Process the JSON data
+    process_json_data(json_data)
+
+    # Write the processed data to the output directory
+    write_json(json_data, output_file_path)
+
+
+def process_files(input_dir, output_dir, max_workers: Optional[int] = None):
     # Create the processed folder if it does not exist
     os.makedirs(output_dir, exist_ok=True)
 
-    # List all JSON files in the original directory
-    for filename in os.listdir(input_dir):
+    manifest = _load_manifest(output_dir)
+    hashes = {}
+    changed = []
+
+    # List all JSON files in the original directory, skipping those whose
+    # content did not change since their output was last written
+    for filename in sorted(os.listdir(input_dir)):
         if filename.endswith(".json"):
             input_file_path = os.path.join(input_dir, filename)
             output_file_path = os.path.join(output_dir, filename)
 
-            # Open and read the JSON data
-            with open(input_file_path, "r") as file:
-                print(f"Processing {input_file_path}")
-                json_data = json.load(file)
+            hashes[filename] = file_hash(input_file_path)
+            if manifest.get(filename) == hashes[filename] and os.path.exists(
+                output_file_path
+            ):
+                print(f"Skipping unchanged {input_file_path}")
+                continue
+            changed.append((input_file_path, output_file_path))
 
-            # Process the JSON data
-            process_json_data(json_data)
+    # Process the changed files in parallel
+    if len(changed) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(process_file, *zip(*changed)))
+    else:
+        for input_file_path, output_file_path in changed:
+            process_file(input_file_path, output_file_path)
 
-            # Write the processed data to the output directory
-            with open(output_file_path, "w") as file:
-                json.dump(json_data, file, indent=4)
+    _save_manifest(output_dir, hashes)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,6 @@
+from cloud_guardian.utils.arn import parse_arn
+
+
 def get_name_from_arn(arn: str) -> str:
     """Gets only the name from an ARN."""
-    return arn.split("/")[-1]
+    return parse_arn(arn).name